@@ -0,0 +1,28 @@
+from django.urls import include, path
+
+from . import async_views
+from .shopping_list import SHOPPING_LIST_RENDERERS
+from .urls import router
+
+# Синхронные представления DRF по именам маршрутов: ими обрабатываются
+# запросы на запись к тем же адресам.
+sync_views = {pattern.name: pattern.callback for pattern in router.urls}
+
+
+def read(name, handler, renderer_classes=None):
+    return async_views.read_async(handler, sync_views[name],
+                                  renderer_classes)
+
+
+urlpatterns = [
+    path('recipes/', read('recipe-list', async_views.recipe_list)),
+    path('recipes/download_shopping_cart/',
+         read('recipe-download-shopping-cart',
+              async_views.download_shopping_cart, SHOPPING_LIST_RENDERERS)),
+    path('recipes/<int:pk>/',
+         read('recipe-detail', async_views.recipe_detail)),
+    path('tags/', read('tag-list', async_views.tag_list)),
+    path('ingredients/',
+         read('ingredient-list', async_views.ingredient_list)),
+    path('', include('api.urls')),
+]
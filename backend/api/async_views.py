@@ -0,0 +1,223 @@
+from datetime import datetime
+from itertools import islice
+
+from asgiref.sync import sync_to_async
+from django.contrib.auth.models import AnonymousUser
+from django.core.cache import cache
+from django.http import Http404, HttpResponse, StreamingHttpResponse
+from django.utils.translation import gettext as _
+from django.views.decorators.csrf import csrf_exempt
+from rest_framework import exceptions
+from rest_framework.authtoken.models import Token
+from rest_framework.negotiation import DefaultContentNegotiation
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+from food.models import Recipe
+from foodgram.timing import get_current_timing
+
+from .serializers import RecipeSerializer
+from .shopping_list import cached_stream, get_cache_key, get_shopping_list
+from .views import IngredientViewSet, RecipeViewSet, TagViewSet
+
+READ_METHODS = ('GET', 'HEAD')
+# Фрагментов списка покупок за один переход в поток.
+STREAM_BATCH_SIZE = 64
+
+
+async def authenticate(request):
+    """
+    Пользователь по заголовку «Authorization: Token <ключ>»,
+    как в TokenAuthentication; без заголовка - аноним.
+    """
+    auth = request.headers.get('Authorization', '').split()
+    if not auth or auth[0].lower() != 'token':
+        return AnonymousUser()
+    if len(auth) == 1:
+        raise exceptions.AuthenticationFailed(
+            _('Invalid token header. No credentials provided.'))
+    if len(auth) > 2:
+        raise exceptions.AuthenticationFailed(
+            _('Invalid token header. '
+              'Token string should not contain spaces.'))
+    token = await Token.objects.select_related('user').filter(
+        key=auth[1]).afirst()
+    if token is None:
+        raise exceptions.AuthenticationFailed(_('Invalid token.'))
+    if not token.user.is_active:
+        raise exceptions.AuthenticationFailed(_('User inactive or deleted.'))
+    return token.user
+
+
+def render(data, status=200):
+    return HttpResponse(JSONRenderer().render(data), status=status,
+                        content_type=JSONRenderer.media_type)
+
+
+def negotiate(request, renderer_classes):
+    try:
+        return DefaultContentNegotiation().select_renderer(
+            request, [renderer() for renderer in renderer_classes])[0]
+    except Http404:
+        raise exceptions.NotFound()
+
+
+def read_async(handler, sync_view, renderer_classes=None):
+    """
+    Представление для ASGI: GET и HEAD обрабатывает корутина
+    handler(request, **kwargs) с запросом DRF, остальные методы
+    (и случаи, когда handler вернул None) - синхронное
+    представление DRF sync_view в потоке. С renderer_classes формат
+    ответа выбирается до проверки токена, как в DRF; ошибки всегда
+    отдаются в JSON. Время handler без запросов к базе - метрика app
+    в Server-Timing, как у ServerTimingMixin.
+    """
+    async def view(request, *args, **kwargs):
+        if request.method in READ_METHODS:
+            drf_request = Request(request)
+            timing = get_current_timing()
+            try:
+                if renderer_classes:
+                    drf_request.accepted_renderer = negotiate(
+                        drf_request, renderer_classes)
+                drf_request.user = await authenticate(request)
+                mark = timing.mark() if timing is not None else None
+                try:
+                    response = await handler(drf_request, **kwargs)
+                finally:
+                    if mark is not None:
+                        timing.add_app_time(mark)
+            except exceptions.APIException as error:
+                response = render(
+                    error.detail if isinstance(error.detail, (list, dict))
+                    else {'detail': error.detail},
+                    error.status_code)
+                if isinstance(error, (exceptions.AuthenticationFailed,
+                                      exceptions.NotAuthenticated)):
+                    response['WWW-Authenticate'] = 'Token'
+            if response is not None:
+                return response
+        return await sync_to_async(sync_view)(request, *args, **kwargs)
+    return csrf_exempt(view)
+
+
+def wants_json(request):
+    """
+    False для браузерного API и других форматов: их отдают
+    синхронные представления.
+    """
+    format = request.query_params.get(api_settings.URL_FORMAT_OVERRIDE)
+    if format:
+        return format == 'json'
+    return 'text/html' not in request.headers.get('Accept', '')
+
+
+def get_view(viewset, request, action, **kwargs):
+    """Экземпляр viewset для get_queryset, filter_queryset и т.п."""
+    return viewset(request=request, format_kwarg=None, action=action,
+                   args=(), kwargs=kwargs)
+
+
+async def recipe_list(request):
+    view = get_view(RecipeViewSet, request, 'list')
+    paginator = view.paginator
+    params = request.query_params
+    page = params.get(paginator.page_query_param, '1')
+    if (paginator.use_cursor(request)
+            or params.get(paginator.count_query_param) == 'approximate'
+            or not page.isdigit() or not wants_json(request)):
+        # Пагинация по ключу, оценка количества, страница «last»
+        # и браузерный API - синхронным кодом DRF.
+        return None
+    page = int(page)
+    # Фильтры проверяют значения (теги, автор) запросами к базе.
+    queryset = await sync_to_async(view.filter_queryset)(
+        view.get_queryset())
+    page_size = paginator.get_page_size(request)
+    offset = (page - 1) * page_size
+    count = await queryset.acount()
+    if page < 1 or (page > 1 and offset >= count):
+        raise exceptions.NotFound(paginator.invalid_page_message)
+    recipes = [recipe async for recipe
+               in queryset[offset:offset + page_size]]
+    url = request.build_absolute_uri()
+    if page == 1:
+        previous = None
+    elif page == 2:
+        previous = remove_query_param(url, paginator.page_query_param)
+    else:
+        previous = replace_query_param(
+            url, paginator.page_query_param, page - 1)
+    return render({
+        'count': count,
+        'next': (replace_query_param(url, paginator.page_query_param,
+                                     page + 1)
+                 if offset + page_size < count else None),
+        'previous': previous,
+        'results': RecipeSerializer(
+            recipes, many=True, context=view.get_serializer_context()).data,
+    })
+
+
+async def recipe_detail(request, pk):
+    view = get_view(RecipeViewSet, request, 'retrieve', pk=pk)
+    if not wants_json(request):
+        return None
+    recipe = await view.get_queryset().filter(pk=pk).afirst()
+    if recipe is None:
+        raise exceptions.NotFound(
+            f'No {Recipe._meta.object_name} matches the given query.')
+    return render(RecipeSerializer(
+        recipe, context=view.get_serializer_context()).data)
+
+
+async def tag_list(request):
+    if not wants_json(request):
+        return None
+    return await get_view(TagViewSet, request, 'list').alist(request)
+
+
+async def ingredient_list(request):
+    if not wants_json(request):
+        return None
+    return await get_view(IngredientViewSet, request, 'list').alist(request)
+
+
+async def iterate_in_thread(iterator, batch_size=STREAM_BATCH_SIZE):
+    """
+    Асинхронный генератор по синхронному iterator: элементы берутся
+    порциями по batch_size в одном и том же потоке, чтобы курсор базы
+    данных оставался на одном подключении, а в памяти была только
+    текущая порция.
+    """
+    iterator = iter(iterator)
+    take = sync_to_async(lambda: list(islice(iterator, batch_size)))
+    while batch := await take():
+        for item in batch:
+            yield item
+
+
+async def download_shopping_cart(request):
+    renderer = request.accepted_renderer
+    user = request.user
+    if not user.is_authenticated:
+        raise exceptions.NotAuthenticated()
+    date = datetime.now().strftime('%d-%m-%Y')
+    cache_key = await sync_to_async(get_cache_key, thread_sensitive=False)(
+        user, renderer.format, date)
+    body = await cache.aget(cache_key)
+    if body is not None:
+        response = HttpResponse(body, content_type=renderer.media_type)
+    else:
+        # Строки читаются курсором, а фрагменты (для PDF - страницы)
+        # отдаются по мере готовности, как в синхронном представлении.
+        rows = get_shopping_list(user).iterator()
+        response = StreamingHttpResponse(
+            iterate_in_thread(cached_stream(
+                renderer.stream(user, rows, date), cache_key)),
+            content_type=renderer.media_type)
+    response['Content-Disposition'] = (
+        f'attachment; filename=shopping_list.{renderer.format}')
+    return response
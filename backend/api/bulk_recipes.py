@@ -0,0 +1,254 @@
+import base64
+import json
+import mimetypes
+import uuid
+from itertools import islice
+from urllib.parse import unquote, urlsplit
+
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation
+from django.core.files import File
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.db.models import Prefetch
+from rest_framework import serializers
+
+from food.aggregates import change_counter, tags_mask
+from food.catalog import record_changes
+from food.feed import fan_out
+from food.images import schedule_variants
+from food.models import Ingredient, Recipe, RecipeIngredient, Tag, User
+
+from .fields import UploadedImageField
+from .serializers import RecipeSerializer
+
+EXPORT_CHUNK_SIZE = 500
+
+
+class ImportImageField(UploadedImageField):
+    """
+    Изображение в base64 или ссылка на файл из хранилища этого сайта
+    (как в выгрузке без встроенных изображений): файл копируется
+    под новым именем.
+    """
+    default_error_messages = {
+        'not_embedded': 'Изображение должно быть в base64 или ссылаться '
+                        'на файл этого сайта (export_recipes '
+                        '--embed-images встраивает изображения).',
+    }
+
+    def to_internal_value(self, data):
+        if isinstance(data, str) and data.startswith(
+                ('http://', 'https://', settings.MEDIA_URL)):
+            return self.open_stored(data)
+        return super().to_internal_value(data)
+
+    def open_stored(self, url):
+        path = unquote(urlsplit(url).path)
+        if not path.startswith(settings.MEDIA_URL):
+            self.fail('not_embedded')
+        name = path[len(settings.MEDIA_URL):]
+        try:
+            if not name or not default_storage.exists(name):
+                self.fail('not_embedded')
+            size = default_storage.size(name)
+        except SuspiciousFileOperation:
+            self.fail('not_embedded')
+        max_size = settings.IMAGE_UPLOAD_MAX_SIZE
+        if size > max_size:
+            self.fail('too_large', max_size=max_size)
+        file = default_storage.open(name)
+        extension = self.check_image(file)
+        return File(file, name=f'{uuid.uuid4()}.{extension}')
+
+
+class RecipeImportSerializer(RecipeSerializer):
+    """
+    Рецепт из строки NDJSON. Теги задаются id или slug, ингредиенты -
+    названием (и единицей измерения) или id. Справочники берутся
+    из контекста без запросов.
+    """
+    tags = serializers.ListField(
+        child=serializers.CharField(), allow_empty=False)
+    image = ImportImageField()
+
+    def validate_tags(self, value):
+        tags = self.context['tags']
+        for tag in value:
+            if tag not in tags:
+                raise serializers.ValidationError(f'Тег {tag} не существует')
+        return list(dict.fromkeys(tags[tag] for tag in value))
+
+    def validate_ingredients(self, value):
+        # id в другой базе может принадлежать другому ингредиенту,
+        # поэтому название важнее id, а id нужен, только если
+        # названия нет.
+        names = self.context['ingredient_names']
+        items = []
+        for item in value:
+            if isinstance(item, dict) and 'name' in item:
+                ingredient_id, unit = names.get(
+                    str(item['name']).casefold(), (None, None))
+                expected = item.get('measurement_unit')
+                if ingredient_id is None or (
+                        expected is not None
+                        and str(expected).casefold() != unit.casefold()):
+                    raise serializers.ValidationError(
+                        f"Ингредиент {item['name']}"
+                        f"{f' ({expected})' if expected else ''} "
+                        f"не существует")
+                item = {**item, 'id': ingredient_id}
+            items.append(item)
+        return super().validate_ingredients(items)
+
+    def get_existing_ingredient_ids(self, ids):
+        known = self.context['ingredient_ids']
+        return {ingredient_id for ingredient_id in ids
+                if ingredient_id in known}
+
+
+class RecipeImporter:
+    """
+    Загружает рецепты автора author из строк NDJSON: проверяет пачку
+    из batch_size строк и записывает ее через bulk_create в отдельной
+    транзакции. Ошибки копятся в errors с номерами строк.
+    """
+
+    def __init__(self, author, batch_size=None):
+        self.author = author
+        self.batch_size = batch_size or settings.RECIPE_IMPORT_BATCH_SIZE
+        self.created = 0
+        self.errors = []
+        tags = {}
+        for tag_id, slug in Tag.objects.values_list('id', 'slug'):
+            tags[str(tag_id)] = tags[slug] = tag_id
+        names = {}
+        for ingredient_id, name, unit in Ingredient.objects.values_list(
+                'id', 'name', 'measurement_unit'):
+            names[name.casefold()] = (ingredient_id, unit)
+        self.context = {
+            'tags': tags,
+            'ingredient_names': names,
+            'ingredient_ids': {
+                ingredient_id for ingredient_id, _ in names.values()},
+        }
+
+    def run(self, lines):
+        lines = enumerate(lines, start=1)
+        while True:
+            batch = list(islice(lines, self.batch_size))
+            if not batch:
+                break
+            valid = []
+            for line_num, line in batch:
+                data = self.validate_line(line_num, line)
+                if data is not None:
+                    valid.append(data)
+            if valid:
+                self.save(valid)
+        return self.report()
+
+    def validate_line(self, line_num, line):
+        if line is None:
+            self.errors.append({'line': line_num,
+                                'errors': 'Слишком длинная строка'})
+            return None
+        if not line.strip():
+            return None
+        try:
+            data = json.loads(line)
+        except ValueError:
+            self.errors.append({'line': line_num,
+                                'errors': 'Некорректный JSON'})
+            return None
+        serializer = RecipeImportSerializer(data=data, context=self.context)
+        if not serializer.is_valid():
+            self.errors.append({'line': line_num,
+                                'errors': serializer.errors})
+            return None
+        return serializer.validated_data
+
+    @transaction.atomic
+    def save(self, items):
+        # bulk_create не отправляет сигналы: маска тегов, счетчик
+        # рецептов автора, варианты изображений и ленты подписчиков
+        # обновляются здесь.
+        recipes = Recipe.objects.bulk_create([
+            Recipe(
+                author=self.author,
+                tags_mask=tags_mask(data['tags']),
+                **{key: value for key, value in data.items()
+                   if key not in ('tags', 'ingredients')}
+            )
+            for data in items
+        ])
+        Recipe.tags.through.objects.bulk_create([
+            Recipe.tags.through(recipe_id=recipe.id, tag_id=tag_id)
+            for recipe, data in zip(recipes, items)
+            for tag_id in data['tags']
+        ])
+        RecipeIngredient.objects.bulk_create([
+            RecipeIngredient(recipe_id=recipe.id, ingredient_id=item['id'],
+                             quantity=item['amount'])
+            for recipe, data in zip(recipes, items)
+            for item in data['ingredients']
+        ])
+        change_counter(User, self.author.pk, 'recipes_count', len(recipes))
+        fan_out(recipes)
+        for recipe in recipes:
+            schedule_variants(recipe, 'image')
+        ids = [recipe.id for recipe in recipes]
+        transaction.on_commit(lambda: record_changes(Recipe, ids))
+        self.created += len(recipes)
+
+    def report(self):
+        return {'created': self.created, 'failed': len(self.errors),
+                'errors': self.errors}
+
+
+def embed_image(image):
+    content_type = mimetypes.guess_type(image.name)[0]
+    with image.open('rb') as file:
+        encoded = base64.b64encode(file.read()).decode()
+    return f'data:{content_type};base64,{encoded}'
+
+
+def export_lines(queryset, build_url=None, embed_images=False):
+    """
+    Строки NDJSON с рецептами queryset. Рецепты читаются пачками
+    по EXPORT_CHUNK_SIZE вместе со связанными объектами. Формат
+    совместим с импортом: ссылки на изображения импорт разрешает
+    на этом же сайте, для переноса в другую базу нужен embed_images.
+    """
+    queryset = queryset.select_related('author').prefetch_related(
+        'tags',
+        Prefetch('recipe_ingredients',
+                 queryset=RecipeIngredient.objects.select_related(
+                     'ingredient')),
+    )
+    for recipe in queryset.iterator(chunk_size=EXPORT_CHUNK_SIZE):
+        if not recipe.image:
+            image = None
+        elif embed_images:
+            image = embed_image(recipe.image)
+        else:
+            image = recipe.image.url
+            if build_url:
+                image = build_url(image)
+        line = {
+            'id': recipe.id,
+            'name': recipe.name,
+            'author': recipe.author.username,
+            'tags': [tag.slug for tag in recipe.tags.all()],
+            'ingredients': [
+                {'id': row.ingredient_id,
+                 'name': row.ingredient.name,
+                 'measurement_unit': row.ingredient.measurement_unit,
+                 'amount': row.quantity}
+                for row in recipe.recipe_ingredients.all()
+            ],
+            'image': image,
+            'text': recipe.text,
+            'cooking_time': recipe.cooking_time,
+        }
+        yield json.dumps(line, ensure_ascii=False) + '\n'
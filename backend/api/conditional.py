@@ -0,0 +1,126 @@
+import gzip
+import hashlib
+
+from django.http import HttpResponse, HttpResponseNotModified
+from django.utils.cache import patch_cache_control, patch_vary_headers
+from django.utils.http import http_date, parse_http_date_safe
+from rest_framework.renderers import JSONRenderer
+
+from food.catalog import aget_catalog_version, get_catalog_version
+from foodgram.routers import read_from_primary
+
+
+class ConditionalCatalogMixin:
+    """
+    Условные GET для справочников (теги, ингредиенты).
+    Версия содержимого меняется сигналами при изменении модели;
+    ETag и Last-Modified проверяются до обращения к базе данных,
+    а готовое (и сжатое gzip) тело полного списка хранится
+    в памяти процесса до смены версии.
+    """
+    _bodies = {}
+    # Версия справочника текущего запроса для get_list_data.
+    catalog_version = None
+
+    def list(self, request, *args, **kwargs):
+        if request.accepted_renderer.format != 'json':
+            return super().list(request, *args, **kwargs)
+        version, modified = get_catalog_version(self.queryset.model)
+        self.catalog_version = version
+        etag = self._get_etag(request, version)
+        if self._not_modified(request, etag, modified):
+            return self._finalize(request, None, etag, modified)
+        body = self._get_cached_body(request, version)
+        if body is None:
+            # Тело запоминается (и клиентом - по ETag) под версией,
+            # поэтому читается с основной базы, а не с отстающей реплики.
+            with read_from_primary():
+                data = self.get_list_data(request)
+            body = self._store_body(request, version, data)
+        return self._finalize(request, body, etag, modified)
+
+    async def alist(self, request):
+        """
+        list для асинхронного представления (api.async_views):
+        версия берется из кеша без потока, список - через
+        aget_list_data.
+        """
+        version, modified = await aget_catalog_version(self.queryset.model)
+        self.catalog_version = version
+        etag = self._get_etag(request, version)
+        if self._not_modified(request, etag, modified):
+            return self._finalize(request, None, etag, modified)
+        body = self._get_cached_body(request, version)
+        if body is None:
+            with read_from_primary():
+                data = await self.aget_list_data(request)
+            body = self._store_body(request, version, data)
+        return self._finalize(request, body, etag, modified)
+
+    def get_list_data(self, request):
+        queryset = self.filter_queryset(self.get_queryset())
+        return self.get_serializer(queryset, many=True).data
+
+    async def aget_list_data(self, request):
+        queryset = self.filter_queryset(self.get_queryset())
+        return self.get_serializer(
+            [obj async for obj in queryset], many=True).data
+
+    @staticmethod
+    def _use_gzip(request):
+        return 'gzip' in request.headers.get('Accept-Encoding', '')
+
+    def _get_etag(self, request, version):
+        query = request.META.get('QUERY_STRING', '')
+        return '"{}{}{}"'.format(
+            version,
+            '-' + hashlib.md5(query.encode()).hexdigest()[:8] if query else '',
+            '-gz' if self._use_gzip(request) else '')
+
+    @staticmethod
+    def _not_modified(request, etag, modified):
+        if_none_match = request.headers.get('If-None-Match')
+        if if_none_match is not None:
+            return (if_none_match.strip() == '*'
+                    or etag in (tag.strip() for tag
+                                in if_none_match.split(',')))
+        since = parse_http_date_safe(
+            request.headers.get('If-Modified-Since', ''))
+        return since is not None and modified <= since
+
+    def _get_body_key(self, request):
+        return (self.queryset.model._meta.label_lower,
+                request.META.get('QUERY_STRING', ''))
+
+    def _get_cached_body(self, request, version):
+        """Тело и его gzip-версия из памяти процесса или None."""
+        cached = self._bodies.get(self._get_body_key(request))
+        if cached is not None and cached[0] == version:
+            return cached[1], cached[2]
+        return None
+
+    def _store_body(self, request, version, data):
+        key = self._get_body_key(request)
+        body = JSONRenderer().render(data)
+        gzipped = gzip.compress(body)
+        if not key[1]:
+            # Хранится только полный список, варианты с фильтрами
+            # (например, поиск по имени) не ограничены по количеству.
+            self._bodies[key] = (version, body, gzipped)
+        return body, gzipped
+
+    def _finalize(self, request, body, etag, modified):
+        """Ответ с телом body (None - 304) и заголовками кеширования."""
+        use_gzip = self._use_gzip(request)
+        if body is None:
+            response = HttpResponseNotModified()
+        else:
+            response = HttpResponse(body[1] if use_gzip else body[0],
+                                    content_type='application/json')
+            if use_gzip:
+                response['Content-Encoding'] = 'gzip'
+        response['ETag'] = etag
+        response['Last-Modified'] = http_date(modified)
+        patch_cache_control(response, no_cache=True)
+        patch_vary_headers(response, ['Accept-Encoding'])
+        return response
@@ -0,0 +1,127 @@
+import bisect
+import heapq
+import threading
+from array import array
+from collections import Counter
+from itertools import groupby
+
+from food.catalog import get_changes
+from food.models import Recipe, RecipeIngredient
+from foodgram.routers import read_from_primary
+
+
+class CookIndex:
+    """
+    Обратный индекс «ингредиент -> отсортированный массив id рецептов»
+    в памяти процесса для поиска рецептов по имеющимся продуктам.
+    Изменения рецептов (своих и других воркеров) применяются точечно
+    по общему журналу изменений (food.catalog.get_changes); полная
+    перестройка - только при первом поиске и если журнал неполон.
+    Массивы не изменяются на месте, а заменяются новыми, поэтому
+    поиск работает со снимком без блокировки.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._changes = None
+        self._postings = {}
+        self._sizes = {}
+
+    def _sync(self):
+        if get_changes(Recipe, self._changes)[0] == self._changes:
+            return
+        with self._lock:
+            # Пока ждали блокировку, изменения мог применить другой поток.
+            number, changed = get_changes(Recipe, self._changes)
+            if number == self._changes:
+                return
+            with read_from_primary():
+                if changed is None:
+                    self._rebuild()
+                elif changed:
+                    self._refresh(changed)
+            self._changes = number
+
+    def _rebuild(self):
+        postings, sizes = {}, Counter()
+        rows = RecipeIngredient.objects.order_by(
+            'ingredient_id', 'recipe_id'
+        ).values_list('ingredient_id', 'recipe_id').iterator(
+            chunk_size=10000)
+        for ingredient_id, recipe_id in rows:
+            postings.setdefault(ingredient_id, array('q')).append(recipe_id)
+            sizes[recipe_id] += 1
+        self._postings, self._sizes = postings, dict(sizes)
+
+    def _refresh(self, recipe_ids):
+        """
+        Перечитывает ингредиенты рецептов recipe_ids из базы данных.
+        Словари копируются и заменяются целиком: search читает их
+        после того, как отпустит блокировку.
+        """
+        added = {}
+        for recipe_id, ingredient_id in RecipeIngredient.objects.filter(
+                recipe_id__in=recipe_ids).values_list(
+                    'recipe_id', 'ingredient_id'):
+            added.setdefault(ingredient_id, []).append(recipe_id)
+        counts = Counter(recipe_id for recipes in added.values()
+                         for recipe_id in recipes)
+        postings = dict(self._postings)
+        for ingredient_id, recipes in self._postings.items():
+            if ingredient_id not in added and not any(
+                    self._contains(recipes, recipe_id)
+                    for recipe_id in recipe_ids):
+                continue
+            kept = [recipe_id for recipe_id in recipes
+                    if recipe_id not in recipe_ids]
+            postings[ingredient_id] = array(
+                'q', sorted(kept + added.pop(ingredient_id, [])))
+        for ingredient_id, recipes in added.items():
+            postings[ingredient_id] = array('q', sorted(recipes))
+        sizes = dict(self._sizes)
+        for recipe_id in recipe_ids:
+            if recipe_id in counts:
+                sizes[recipe_id] = counts[recipe_id]
+            else:
+                sizes.pop(recipe_id, None)
+        self._postings, self._sizes = postings, sizes
+
+    @staticmethod
+    def _contains(recipes, recipe_id):
+        position = bisect.bisect_left(recipes, recipe_id)
+        return position < len(recipes) and recipes[position] == recipe_id
+
+    def invalidate(self):
+        """Индекс будет перестроен при следующем поиске."""
+        with self._lock:
+            self._changes = None
+
+    def search(self, ingredient_ids, max_missing=2):
+        """
+        id рецептов, в которых есть хотя бы один из ingredient_ids,
+        а недостает не более max_missing ингредиентов: сначала рецепты
+        без недостающих ингредиентов, затем с одним и т.д., внутри
+        группы - новые первыми. Возвращает список пар (id, недостает).
+        """
+        self._sync()
+        with self._lock:
+            postings, sizes = self._postings, self._sizes
+            lists = [postings[ingredient_id]
+                     for ingredient_id in set(ingredient_ids)
+                     if ingredient_id in postings]
+        # Слияние отсортированных массивов: одинаковые id идут подряд,
+        # их число - количество совпавших ингредиентов рецепта.
+        groups = [[] for _ in range(max_missing + 1)]
+        for recipe_id, matches in groupby(heapq.merge(*lists)):
+            size = sizes.get(recipe_id)
+            if size is None:
+                continue
+            missing = size - sum(1 for _ in matches)
+            if 0 <= missing <= max_missing:
+                groups[missing].append(recipe_id)
+        return [(recipe_id, missing)
+                for missing, group in enumerate(groups)
+                for recipe_id in reversed(group)]
+
+
+cook_index = CookIndex()
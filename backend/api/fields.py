@@ -0,0 +1,132 @@
+import base64
+import binascii
+import uuid
+from tempfile import SpooledTemporaryFile
+
+from django.conf import settings
+from django.core.files import File
+from django.core.files.uploadedfile import UploadedFile
+from PIL import Image, UnidentifiedImageError
+from rest_framework import serializers
+from rest_framework.relations import MANY_RELATION_KWARGS
+
+# Кратно 4, чтобы каждый фрагмент base64 декодировался отдельно.
+BASE64_CHUNK_SIZE = 64 * 1024
+# Пробельные символы ASCII, допустимые внутри строки base64.
+WHITESPACE = str.maketrans('', '', ' \t\n\r\x0b\x0c')
+ALLOWED_IMAGE_FORMATS = {
+    'JPEG': 'jpg',
+    'PNG': 'png',
+    'GIF': 'gif',
+    'WEBP': 'webp',
+}
+
+
+class UploadedImageField(serializers.ImageField):
+    """
+    Изображение строкой base64 (как в drf-extra-fields) или файлом
+    из multipart/form-data. base64 декодируется по частям во временный
+    файл с проверкой размера по ходу декодирования, а Pillow читает
+    только заголовок изображения.
+    """
+    EMPTY_VALUES = (None, '', [], (), {})
+    default_error_messages = {
+        'too_large': 'Размер изображения не должен превышать {max_size} байт.',
+        'invalid_base64': 'Некорректная строка base64.',
+        'invalid_image': 'Загрузите корректное изображение '
+                         '(JPEG, PNG, GIF или WebP).',
+    }
+
+    def to_internal_value(self, data):
+        if data in self.EMPTY_VALUES:
+            return None
+        max_size = settings.IMAGE_UPLOAD_MAX_SIZE
+        if isinstance(data, str):
+            file = self.decode_base64(data, max_size)
+            extension = self.check_image(file)
+            return File(file, name=f'{uuid.uuid4()}.{extension}')
+        if not isinstance(data, UploadedFile):
+            self.fail('invalid_image')
+        if data.size > max_size:
+            self.fail('too_large', max_size=max_size)
+        # Файл из multipart сохраняется как есть: большой файл уже
+        # лежит на диске и будет перемещен хранилищем без копирования.
+        data.name = f'{uuid.uuid4()}.{self.check_image(data)}'
+        return data
+
+    def decode_base64(self, data, max_size):
+        if data.startswith('data:'):
+            data = data[data.find(',') + 1:]
+        file = SpooledTemporaryFile(
+            max_size=settings.FILE_UPLOAD_MAX_MEMORY_SIZE)
+        rest = ''
+        try:
+            for start in range(0, len(data), BASE64_CHUNK_SIZE):
+                # Строка может быть разбита на строки (MIME, PEM):
+                # пробельные символы убираются, а декодируется часть,
+                # кратная 4, остаток переходит в следующий фрагмент.
+                chunk = rest + data[
+                    start:start + BASE64_CHUNK_SIZE].translate(WHITESPACE)
+                end = len(chunk) - len(chunk) % 4
+                file.write(base64.b64decode(chunk[:end], validate=True))
+                rest = chunk[end:]
+                if file.tell() > max_size:
+                    file.close()
+                    self.fail('too_large', max_size=max_size)
+            if rest:
+                raise binascii.Error('Incorrect padding')
+        except (binascii.Error, ValueError):
+            file.close()
+            self.fail('invalid_base64')
+        file.seek(0)
+        return file
+
+    def check_image(self, file):
+        """Проверяет заголовок изображения и возвращает расширение."""
+        try:
+            with Image.open(file) as image:
+                image_format = image.format
+                width, height = image.size
+        except (UnidentifiedImageError, OSError, Image.DecompressionBombError):
+            self.fail('invalid_image')
+        finally:
+            file.seek(0)
+        if (image_format not in ALLOWED_IMAGE_FORMATS
+                or width * height > Image.MAX_IMAGE_PIXELS):
+            self.fail('invalid_image')
+        return ALLOWED_IMAGE_FORMATS[image_format]
+
+
+class BulkManyRelatedField(serializers.ManyRelatedField):
+    """Проверяет все первичные ключи списка одним запросом IN."""
+
+    def to_internal_value(self, data):
+        if isinstance(data, str) or not hasattr(data, '__iter__'):
+            self.fail('not_a_list', input_type=type(data).__name__)
+        if not self.allow_empty and len(data) == 0:
+            self.fail('empty')
+        child = self.child_relation
+        pks = []
+        for pk in data:
+            try:
+                pks.append(int(pk))
+            except (TypeError, ValueError):
+                child.fail('incorrect_type', data_type=type(pk).__name__)
+        objects = child.get_queryset().in_bulk(pks)
+        for pk in pks:
+            if pk not in objects:
+                child.fail('does_not_exist', pk_value=pk)
+        return [objects[pk] for pk in dict.fromkeys(pks)]
+
+
+class BulkPrimaryKeyRelatedField(serializers.PrimaryKeyRelatedField):
+    """PrimaryKeyRelatedField, который при many=True не делает запрос
+    на каждый элемент списка."""
+
+    @classmethod
+    def many_init(cls, *args, **kwargs):
+        list_kwargs = {'child_relation': cls(*args, **kwargs)}
+        for key in kwargs:
+            if key in MANY_RELATION_KWARGS:
+                list_kwargs[key] = kwargs[key]
+        return BulkManyRelatedField(**list_kwargs)
@@ -1,22 +1,82 @@
+from django.db import connections
+from django.db.models import BooleanField, F, Q
+from django.db.models.expressions import RawSQL
+from django.db.models.lookups import Exact, GreaterThan
 from django_filters import rest_framework as filters
+from rest_framework.filters import OrderingFilter
 
 from food.models import Recipe, Tag
 
+from .search import search_recipes
+
+
+def tags_mask_condition(using, tags, match_all):
+    """
+    Условие «у рецепта есть любой (match_all - каждый) из тегов tags»
+    по битам Recipe.tags_mask. В PostgreSQL - через массив номеров
+    битов food_tags_bits(tags_mask) с GIN-индексом (миграция 0017),
+    в SQLite индекса для побитового И нет: таблица просматривается
+    целиком, что приемлемо только для локальной разработки.
+    """
+    if not tags:
+        return Q(pk__in=[])
+    if connections[using].vendor == 'postgresql':
+        operator = '@>' if match_all else '&&'
+        return Q(RawSQL(
+            f'food_tags_bits(food_recipe.tags_mask) {operator} %s::integer[]',
+            ([tag.pk - 1 for tag in tags],), output_field=BooleanField()))
+    mask = sum(tag.bit for tag in tags)
+    matched = F('tags_mask').bitand(mask)
+    if match_all:
+        return Q(Exact(matched, mask))
+    return Q(GreaterThan(matched, 0))
+
 
 class RecipeFilter(filters.FilterSet):
     tags = filters.ModelMultipleChoiceFilter(
         field_name='tags__slug',
         to_field_name='slug',
         queryset=Tag.objects.all(),
+        method='filter_tags',
+    )
+    tags_mode = filters.ChoiceFilter(
+        choices=(('any', 'Любой из тегов'), ('all', 'Все теги')),
+        method='filter_tags_mode',
     )
 
     is_favorited = filters.BooleanFilter(method='filter_is_favorited')
     is_in_shopping_cart = filters.BooleanFilter(
         method='filter_is_in_shopping_cart')
+    search = filters.CharFilter(method='filter_search')
 
     class Meta:
         model = Recipe
-        fields = ['tags', 'author', 'is_favorited', 'is_in_shopping_cart']
+        fields = ['tags', 'tags_mode', 'author', 'is_favorited',
+                  'is_in_shopping_cart', 'search']
+
+    def filter_tags(self, queryset, name, value):
+        """
+        Фильтрует по Recipe.tags_mask без соединения с таблицей тегов.
+        Теги, которым не хватило бита, проверяются подзапросом.
+        """
+        if not value:
+            return queryset
+        with_bit = [tag for tag in value if tag.bit]
+        overflow = [tag for tag in value if not tag.bit]
+        match_all = self.form.cleaned_data.get('tags_mode') == 'all'
+        tagged = Recipe.tags.through.objects.values('recipe')
+        condition = tags_mask_condition(queryset.db, with_bit, match_all)
+        if match_all:
+            for tag in overflow:
+                queryset = queryset.filter(id__in=tagged.filter(tag=tag))
+            return queryset.filter(condition) if with_bit else queryset
+        if overflow:
+            condition |= Q(id__in=tagged.filter(tag__in=overflow))
+        return queryset.filter(condition)
+
+    def filter_tags_mode(self, queryset, name, value):
+        # Учитывается в filter_tags.
+        return queryset
 
     def filter_is_favorited(self, queryset, name, value):
         user = self.request.user
@@ -29,3 +89,27 @@ class RecipeFilter(filters.FilterSet):
         if value and user.is_authenticated:
             return queryset.filter(in_shopping_cart__user=user)
         return queryset
+
+    def filter_search(self, queryset, name, value):
+        value = value.strip()
+        if not value:
+            return queryset
+        return search_recipes(queryset, value)
+
+
+class RecipeOrderingFilter(OrderingFilter):
+    """
+    Добавляет -id к сортировке, чтобы порядок страниц был стабильным.
+    При поиске по умолчанию сортирует по релевантности.
+    """
+
+    def get_default_ordering(self, view):
+        if view.request.query_params.get('search', '').strip():
+            return ['-search_rank', '-id']
+        return super().get_default_ordering(view)
+
+    def get_ordering(self, request, queryset, view):
+        ordering = super().get_ordering(request, queryset, view)
+        if ordering and not {'id', '-id'} & set(ordering):
+            ordering = [*ordering, '-id']
+        return ordering
@@ -0,0 +1,84 @@
+import bisect
+import threading
+import time
+
+from django.conf import settings
+
+from food.catalog import get_catalog_version
+from food.models import Ingredient
+from foodgram.routers import read_from_primary
+
+from .serializers import IngredientSerializer
+
+
+class IngredientIndex:
+    """
+    Индекс ингредиентов в памяти процесса для автодополнения.
+    Названия хранятся отсортированными в casefold, поиск по префиксу -
+    бинарный поиск диапазона, без обращения к базе данных.
+    Индекс перестраивается лениво, когда меняется общая для всех
+    воркеров версия справочника (food.catalog), и не реже чем раз
+    в INGREDIENT_INDEX_TTL секунд - на случай изменений в обход
+    сигналов (queryset.update()).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._built = None
+        self._built_at = 0.0
+        # (ключи, строки) заменяются одним присваиванием: search читает
+        # их без блокировки и не должен увидеть ключи одной версии
+        # со строками другой.
+        self._entries = ([], [])
+
+    def invalidate(self):
+        self._built = None
+
+    def is_fresh(self, version):
+        ttl = getattr(settings, 'INGREDIENT_INDEX_TTL', 300)
+        return (self._built == version
+                and time.monotonic() - self._built_at < ttl)
+
+    def _ensure_built(self, version=None):
+        if version is None:
+            version = get_catalog_version(Ingredient)[0]
+        if self.is_fresh(version):
+            return
+        with self._lock:
+            if self.is_fresh(version):
+                return
+            # Версия прочитана до запроса к базе: изменение во время
+            # перестройки приведет к еще одной перестройке.
+            with read_from_primary():
+                rows = Ingredient.objects.values(
+                    *IngredientSerializer.Meta.fields)
+                entries = sorted(
+                    (row['name'].casefold(), row['id'], row) for row in rows
+                )
+            self._entries = ([key for key, _, _ in entries],
+                             [row for _, _, row in entries])
+            self._built = version
+            self._built_at = time.monotonic()
+
+    def search(self, query='', limit=None, version=None):
+        """
+        Сначала ингредиенты, название которых начинается с query,
+        затем те, в которых query встречается внутри названия.
+        version - уже прочитанная версия справочника.
+        """
+        self._ensure_built(version)
+        keys, items = self._entries
+        query = query.casefold()
+        start = bisect.bisect_left(keys, query)
+        end = bisect.bisect_left(keys, query + '\U0010ffff', start)
+        result = items[start:end]
+        if not query or (limit is not None and len(result) >= limit):
+            return result[:limit]
+        result.extend(
+            items[i] for i, key in enumerate(keys)
+            if (i < start or i >= end) and query in key
+        )
+        return result[:limit]
+
+
+ingredient_index = IngredientIndex()
@@ -0,0 +1,73 @@
+from django.conf import settings
+from rest_framework import parsers, status
+from rest_framework.exceptions import APIException
+
+
+class PayloadTooLarge(APIException):
+    status_code = status.HTTP_413_REQUEST_ENTITY_TOO_LARGE
+    default_detail = 'Слишком большой запрос.'
+    default_code = 'payload_too_large'
+
+
+def upload_max_size():
+    """Изображение IMAGE_UPLOAD_MAX_SIZE в base64 плюс остальные поля."""
+    return settings.IMAGE_UPLOAD_MAX_SIZE * 4 // 3 + 64 * 1024
+
+
+def iter_lines(stream, max_length):
+    """
+    Строки бинарного потока по одной. Вместо строки длиннее
+    max_length возвращает None, а ее остаток пропускает.
+    """
+    while True:
+        line = stream.readline(max_length + 1)
+        if not line:
+            return
+        if len(line) > max_length:
+            while line and not line.endswith(b'\n'):
+                line = stream.readline(max_length + 1)
+            yield None
+        else:
+            yield line
+
+
+class BodySizeLimitMixin:
+    """
+    Отклоняет запрос по заголовку Content-Length до чтения тела
+    (предел - upload_max_size).
+    """
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        request = parser_context['request']
+        try:
+            length = int(request.META.get('CONTENT_LENGTH') or 0)
+        except ValueError:
+            length = 0
+        if length > upload_max_size():
+            raise PayloadTooLarge()
+        return super().parse(stream, media_type, parser_context)
+
+
+class LimitedJSONParser(BodySizeLimitMixin, parsers.JSONParser):
+    pass
+
+
+class LimitedMultiPartParser(BodySizeLimitMixin, parsers.MultiPartParser):
+    pass
+
+
+UPLOAD_PARSERS = [LimitedJSONParser, LimitedMultiPartParser]
+
+
+class NDJSONParser(parsers.BaseParser):
+    """
+    Тело application/x-ndjson - итератор строк, которые читаются
+    из потока по мере обработки, а не загружаются целиком. Строка
+    ограничена upload_max_size.
+    """
+    media_type = 'application/x-ndjson'
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        if stream is None:
+            return iter(())
+        return iter_lines(stream, upload_max_size())
@@ -0,0 +1,363 @@
+import functools
+import hashlib
+import re
+import struct
+import zlib
+from pathlib import Path
+
+# Таблицы TrueType, которые остаются в подмножестве шрифта: нужные PDF
+# для отрисовки глифов, а также небольшие cmap и OS/2 для программ,
+# которые их ожидают. name, post, kern, GPOS, GSUB и т.п. отбрасываются.
+SUBSET_TABLES = ('OS/2', 'cmap', 'cvt ', 'fpgm', 'glyf', 'head', 'hhea',
+                 'hmtx', 'loca', 'maxp', 'prep')
+# Флаги составного глифа (таблица glyf).
+ARG_WORDS, HAS_SCALE, MORE_COMPONENTS, XY_SCALE, TWO_BY_TWO = (
+    0x1, 0x8, 0x20, 0x40, 0x80)
+
+
+def checksum(data):
+    """Контрольная сумма таблицы TrueType: сумма 32-битных слов."""
+    data += b'\0' * (-len(data) % 4)
+    return sum(struct.unpack(f'>{len(data) // 4}L', data)) & 0xFFFFFFFF
+
+
+class TrueTypeFont:
+    """
+    Шрифт TrueType для встраивания в PDF: номера глифов символов
+    (таблица cmap, формат 4), ширины глифов и метрики. В документ
+    встраивается подмножество шрифта только с использованными
+    глифами (subset).
+    """
+
+    def __init__(self, path):
+        with open(path, 'rb') as file:
+            data = file.read()
+        tables = {}
+        number = struct.unpack_from('>H', data, 4)[0]
+        for index in range(number):
+            tag, _, offset, length = struct.unpack_from(
+                '>4sLLL', data, 12 + 16 * index)
+            tables[tag.decode('latin-1')] = (offset, length)
+        head = tables['head'][0]
+        hhea = tables['hhea'][0]
+        self.units = struct.unpack_from('>H', data, head + 18)[0]
+        self.bbox = [self._scale(value) for value in
+                     struct.unpack_from('>4h', data, head + 36)]
+        ascent, descent = struct.unpack_from('>2h', data, hhea + 4)
+        self.ascent = self._scale(ascent)
+        self.descent = self._scale(descent)
+        metrics = struct.unpack_from('>H', data, hhea + 34)[0]
+        self.advances = [
+            self._scale(value) for value in struct.unpack_from(
+                f'>{metrics}H', data, tables['hmtx'][0])[::2]]
+        self.glyphs = self._read_cmap(data, tables['cmap'][0])
+        self.name = re.sub(r'[^A-Za-z0-9-]', '', Path(path).stem) or 'Font'
+        glyph_count = struct.unpack_from('>H', data, tables['maxp'][0] + 4)[0]
+        long_offsets = struct.unpack_from('>h', data, head + 50)[0]
+        loca = tables['loca'][0]
+        if long_offsets:
+            self.locations = struct.unpack_from(
+                f'>{glyph_count + 1}L', data, loca)
+        else:
+            self.locations = [offset * 2 for offset in struct.unpack_from(
+                f'>{glyph_count + 1}H', data, loca)]
+        self.data = data
+        self.tables = tables
+
+    def _scale(self, value):
+        return round(value * 1000 / self.units)
+
+    @staticmethod
+    def _read_cmap(data, cmap):
+        """Символы BMP -> номера глифов из подтаблицы Unicode (3, 1)."""
+        number = struct.unpack_from('>H', data, cmap + 2)[0]
+        for index in range(number):
+            platform, encoding, offset = struct.unpack_from(
+                '>HHL', data, cmap + 4 + 8 * index)
+            table = cmap + offset
+            if ((platform, encoding) == (3, 1)
+                    and struct.unpack_from('>H', data, table)[0] == 4):
+                break
+        else:
+            raise ValueError('В шрифте нет таблицы cmap формата 4')
+        segments = struct.unpack_from('>H', data, table + 6)[0] // 2
+        ends = struct.unpack_from(f'>{segments}H', data, table + 14)
+        starts_at = table + 16 + 2 * segments
+        starts = struct.unpack_from(f'>{segments}H', data, starts_at)
+        deltas = struct.unpack_from(
+            f'>{segments}h', data, starts_at + 2 * segments)
+        ranges_at = starts_at + 4 * segments
+        ranges = struct.unpack_from(f'>{segments}H', data, ranges_at)
+        glyphs = {}
+        for index, (start, end) in enumerate(zip(starts, ends)):
+            for code in range(start, min(end, 0xFFFE) + 1):
+                if ranges[index]:
+                    glyph = struct.unpack_from(
+                        '>H', data, ranges_at + 2 * index + ranges[index]
+                        + 2 * (code - start))[0]
+                    if glyph:
+                        glyph = (glyph + deltas[index]) & 0xFFFF
+                else:
+                    glyph = (code + deltas[index]) & 0xFFFF
+                if glyph:
+                    glyphs[chr(code)] = glyph
+        return glyphs
+
+    def width(self, glyph):
+        return self.advances[min(glyph, len(self.advances) - 1)]
+
+    def _glyph(self, glyph):
+        start = self.tables['glyf'][0] + self.locations[glyph]
+        return self.data[start:start + self.locations[glyph + 1]
+                         - self.locations[glyph]]
+
+    def _components(self, glyph):
+        """Номера глифов, из которых составлен глиф glyph."""
+        data = self._glyph(glyph)
+        if len(data) < 10 or struct.unpack_from('>h', data)[0] >= 0:
+            return
+        position = 10
+        while True:
+            flags, component = struct.unpack_from('>HH', data, position)
+            yield component
+            position += 4 + (4 if flags & ARG_WORDS else 2)
+            if flags & HAS_SCALE:
+                position += 2
+            elif flags & XY_SCALE:
+                position += 4
+            elif flags & TWO_BY_TWO:
+                position += 8
+            if not flags & MORE_COMPONENTS:
+                return
+
+    def subset(self, glyphs):
+        """
+        Файл шрифта, в котором описаны только глифы glyphs, глиф 0
+        и глифы, из которых они составлены. Номера глифов не меняются
+        (в PDF - CIDToGIDMap /Identity), остальные глифы пустые.
+        """
+        keep, pending = set(), [0, *glyphs]
+        while pending:
+            glyph = pending.pop()
+            if glyph not in keep and glyph < len(self.locations) - 1:
+                keep.add(glyph)
+                pending.extend(self._components(glyph))
+        outlines, offsets = [], [0]
+        for glyph in range(len(self.locations) - 1):
+            data = self._glyph(glyph) if glyph in keep else b''
+            outlines.append(data + b'\0' * (-len(data) % 4))
+            offsets.append(offsets[-1] + len(outlines[-1]))
+        tables = {
+            tag: self.data[offset:offset + length]
+            for tag, (offset, length) in self.tables.items()
+            if tag in SUBSET_TABLES
+        }
+        tables['glyf'] = b''.join(outlines)
+        tables['loca'] = struct.pack(f'>{len(offsets)}L', *offsets)
+        head = bytearray(tables['head'])
+        # checkSumAdjustment пересчитывается в _pack, loca - длинного
+        # формата.
+        struct.pack_into('>L', head, 8, 0)
+        struct.pack_into('>h', head, 50, 1)
+        tables['head'] = bytes(head)
+        return self._pack(tables)
+
+    @staticmethod
+    def _pack(tables):
+        """Файл шрифта из таблиц {тег: данные}."""
+        tags = sorted(tables)
+        power = 1 << (len(tags).bit_length() - 1)
+        header = struct.pack('>LHHHH', 0x00010000, len(tags), power * 16,
+                             power.bit_length() - 1,
+                             (len(tags) - power) * 16)
+        offset = len(header) + 16 * len(tags)
+        directory, body = [], []
+        for tag in tags:
+            data = tables[tag]
+            if tag == 'head':
+                head = offset
+            directory.append(struct.pack(
+                '>4sLLL', tag.encode('latin-1'), checksum(data), offset,
+                len(data)))
+            body.append(data + b'\0' * (-len(data) % 4))
+            offset += len(body[-1])
+        font = bytearray(header + b''.join(directory) + b''.join(body))
+        struct.pack_into('>L', font, head + 8,
+                         (0xB1B0AFBA - checksum(bytes(font))) & 0xFFFFFFFF)
+        return bytes(font)
+
+
+@functools.lru_cache(maxsize=None)
+def load_font(path):
+    return TrueTypeFont(path)
+
+
+class PdfTextDocument:
+    """
+    PDF из строк текста, который пишется по мере поступления строк:
+    каждая заполненная страница сразу отдается фрагментом ответа,
+    а шрифт, дерево страниц и таблица смещений (xref) - в конце.
+    В памяти одновременно только текущая страница.
+    Текст набирается встроенным шрифтом TrueType (Type0, Identity-H);
+    если шрифт недоступен - стандартным Helvetica (только Latin-1).
+    """
+    # Объекты с постоянными номерами; страницы нумеруются после них.
+    CATALOG, PAGES, FONT, CID_FONT, DESCRIPTOR, FONT_FILE, TO_UNICODE = (
+        range(1, 8))
+
+    def __init__(self, font_path, page_size=(595, 842), margin=42,
+                 line_height=17, font_size=12):
+        try:
+            self.font = load_font(font_path)
+        except (OSError, ValueError, KeyError, struct.error):
+            self.font = None
+        self.page_size = page_size
+        self.margin = margin
+        self.line_height = line_height
+        self.font_size = font_size
+        self.lines_per_page = (page_size[1] - 2 * margin) // line_height
+        self.offsets = {}
+        self.position = 0
+        self.pages = []
+        self.used = {}
+
+    def stream(self, lines):
+        """Фрагменты PDF для строк lines."""
+        yield self._write(b'%PDF-1.4\n%\xe2\xe3\xcf\xd3\n')
+        page = []
+        for line in lines:
+            page.append(line)
+            if len(page) == self.lines_per_page:
+                yield self._page(page)
+                page = []
+        if page or not self.pages:
+            yield self._page(page)
+        yield self._finish()
+
+    def _write(self, data):
+        self.position += len(data)
+        return data
+
+    def _object(self, number, body, stream=None):
+        self.offsets[number] = self.position
+        data = f'{number} 0 obj\n'.encode() + body
+        if stream is not None:
+            data += b'\nstream\n' + stream + b'\nendstream'
+        return self._write(data + b'\nendobj\n')
+
+    def _encode(self, line):
+        if self.font is None:
+            text = line.encode('latin-1', 'replace')
+            for char in b'\\()':
+                text = text.replace(bytes([char]), b'\\' + bytes([char]))
+            return b'(' + text + b')'
+        glyphs = []
+        for char in line:
+            glyph = self.font.glyphs.get(char, 0)
+            self.used.setdefault(glyph, char)
+            glyphs.append(glyph)
+        return f'<{"".join(f"{glyph:04X}" for glyph in glyphs)}>'.encode()
+
+    def _page(self, lines):
+        number = 2 * len(self.pages) + 8
+        self.pages.append(number)
+        # Оператор ' переводит строку перед выводом текста.
+        top = self.page_size[1] - self.margin
+        content = [f'BT /F1 {self.font_size} Tf {self.line_height} TL '
+                   f'{self.margin} {top} Td'.encode()]
+        for line in lines:
+            content.append(self._encode(line) + b" '")
+        content.append(b'ET')
+        content = zlib.compress(b'\n'.join(content))
+        width, height = self.page_size
+        return self._object(
+            number,
+            f'<< /Type /Page /Parent {self.PAGES} 0 R '
+            f'/MediaBox [0 0 {width} {height}] '
+            f'/Resources << /Font << /F1 {self.FONT} 0 R >> >> '
+            f'/Contents {number + 1} 0 R >>'.encode()
+        ) + self._object(
+            number + 1,
+            f'<< /Length {len(content)} /Filter /FlateDecode >>'.encode(),
+            content)
+
+    def _fonts(self):
+        if self.font is None:
+            yield self._object(
+                self.FONT, b'<< /Type /Font /Subtype /Type1 '
+                b'/BaseFont /Helvetica /Encoding /WinAnsiEncoding >>')
+            return
+        font = self.font
+        used = sorted(self.used.items())
+        subset = font.subset(self.used)
+        compressed = zlib.compress(subset)
+        # Имя подмножества шрифта - шесть заглавных букв и «+».
+        digest = hashlib.md5(subset).digest()
+        name = ''.join(chr(65 + byte % 26) for byte in digest[:6]) + (
+            f'+{font.name}')
+        yield self._object(
+            self.FONT,
+            f'<< /Type /Font /Subtype /Type0 /BaseFont /{name} '
+            f'/Encoding /Identity-H '
+            f'/DescendantFonts [{self.CID_FONT} 0 R] '
+            f'/ToUnicode {self.TO_UNICODE} 0 R >>'.encode())
+        widths = ' '.join(f'{glyph} [{font.width(glyph)}]'
+                          for glyph, _ in used)
+        yield self._object(
+            self.CID_FONT,
+            f'<< /Type /Font /Subtype /CIDFontType2 /BaseFont /{name} '
+            f'/CIDSystemInfo << /Registry (Adobe) /Ordering (Identity) '
+            f'/Supplement 0 >> /FontDescriptor {self.DESCRIPTOR} 0 R '
+            f'/CIDToGIDMap /Identity /W [{widths}] >>'.encode())
+        yield self._object(
+            self.DESCRIPTOR,
+            f'<< /Type /FontDescriptor /FontName /{name} /Flags 32 '
+            f'/FontBBox [{" ".join(map(str, font.bbox))}] /ItalicAngle 0 '
+            f'/Ascent {font.ascent} /Descent {font.descent} '
+            f'/CapHeight {font.ascent} /StemV 80 '
+            f'/FontFile2 {self.FONT_FILE} 0 R >>'.encode())
+        yield self._object(
+            self.FONT_FILE,
+            f'<< /Length {len(compressed)} /Length1 {len(subset)} '
+            f'/Filter /FlateDecode >>'.encode(),
+            compressed)
+        blocks = []
+        for start in range(0, len(used), 100):
+            block = used[start:start + 100]
+            blocks.append(f'{len(block)} beginbfchar\n' + ''.join(
+                f'<{glyph:04X}> <{ord(char):04X}>\n' for glyph, char in block
+            ) + 'endbfchar\n')
+        to_unicode = (
+            '/CIDInit /ProcSet findresource begin 12 dict begin begincmap\n'
+            '/CIDSystemInfo << /Registry (Adobe) /Ordering (UCS) '
+            '/Supplement 0 >> def /CMapName /Adobe-Identity-UCS def '
+            '/CMapType 2 def\n'
+            '1 begincodespacerange <0000> <FFFF> endcodespacerange\n'
+            + ''.join(blocks)
+            + 'endcmap CMapName currentdict /CMap defineresource pop '
+            'end end').encode()
+        yield self._object(
+            self.TO_UNICODE, f'<< /Length {len(to_unicode)} >>'.encode(),
+            to_unicode)
+
+    def _finish(self):
+        chunks = list(self._fonts())
+        kids = ' '.join(f'{number} 0 R' for number in self.pages)
+        chunks.append(self._object(
+            self.PAGES,
+            f'<< /Type /Pages /Kids [{kids}] '
+            f'/Count {len(self.pages)} >>'.encode()))
+        chunks.append(self._object(
+            self.CATALOG,
+            f'<< /Type /Catalog /Pages {self.PAGES} 0 R >>'.encode()))
+        size = max(self.offsets) + 1
+        xref = [f'xref\n0 {size}\n0000000000 65535 f \n']
+        for number in range(1, size):
+            if number in self.offsets:
+                xref.append(f'{self.offsets[number]:010d} 00000 n \n')
+            else:
+                xref.append('0000000000 65535 f \n')
+        xref.append(f'trailer\n<< /Size {size} /Root {self.CATALOG} 0 R >>\n'
+                    f'startxref\n{self.position}\n%%EOF\n')
+        chunks.append(''.join(xref).encode())
+        return b''.join(chunks)
@@ -0,0 +1,182 @@
+from django.db import IntegrityError, router, transaction
+from django.db.models import Exists, OuterRef, Q, sql
+from django.db.models.sql.constants import ROW_COUNT
+
+from food.aggregates import recount_related, refresh_shopping_list
+from food.feed import backfill, forget
+from food.models import (Favorite, Follow, Recipe, RecipeIngredient,
+                         ShoppingCart, User)
+
+from .shopping_list import invalidate_shopping_lists
+
+CREATED = 'created'
+EXISTS = 'exists'
+DELETED = 'deleted'
+ABSENT = 'absent'
+NOT_FOUND = 'not_found'
+SELF = 'self'
+
+
+class UserRelation:
+    """
+    Связи пользователя с объектами: избранное, список покупок,
+    подписки. Объекты и уже существующие связи читаются одним
+    запросом, новые связи добавляются одним INSERT, а если его
+    опередил параллельный запрос - повторно без уже созданных.
+    Удаляются связи одним DELETE. Ни bulk_create, ни этот DELETE
+    не отправляют сигналы, поэтому счетчики и зависящие от связей
+    данные пересчитываются один раз на весь набор в after_add
+    и after_remove.
+    """
+
+    def __init__(self, model, user_field, target_field, target_model):
+        self.model = model
+        self.user_field = user_field
+        self.target_field = target_field
+        self.target_model = target_model
+
+    def links(self, user):
+        return self.model.objects.filter(**{self.user_field: user})
+
+    def lookup(self, user, target_ids):
+        """
+        Объекты target_ids {id: объект}; у связанных с user
+        объектов linked=True.
+        """
+        return {
+            target.pk: target
+            for target in self.target_model.objects.filter(
+                pk__in=target_ids
+            ).annotate(linked=Exists(self.links(user).filter(
+                **{self.target_field: OuterRef('pk')})))
+        }
+
+    def check(self, user, target):
+        """Статус ошибки, если связь с target недопустима."""
+        return None
+
+    def add(self, user, target_ids):
+        """
+        Добавляет связи с объектами target_ids. Возвращает статусы
+        {id: статус} и найденные объекты {id: объект}.
+        """
+        targets = self.lookup(user, target_ids)
+        results = {}
+        for target_id in target_ids:
+            target = targets.get(target_id)
+            if target is None:
+                results[target_id] = NOT_FOUND
+            elif target.linked:
+                results[target_id] = EXISTS
+            else:
+                results[target_id] = self.check(user, target) or CREATED
+        created = [target_id for target_id, result in results.items()
+                   if result == CREATED]
+        while created:
+            try:
+                with transaction.atomic():
+                    self.model.objects.bulk_create([
+                        self.model(**{self.user_field: user,
+                                      f'{self.target_field}_id': target_id})
+                        for target_id in created
+                    ])
+                    self.after_add(user, created)
+                break
+            except IntegrityError:
+                # Часть связей успел создать параллельный запрос.
+                taken = set(self.links(user).filter(**{
+                    f'{self.target_field}__in': created,
+                }).values_list(f'{self.target_field}_id', flat=True))
+                if not taken:
+                    raise
+                for target_id in taken:
+                    results[target_id] = EXISTS
+                created = [target_id for target_id in created
+                           if target_id not in taken]
+        return results, targets
+
+    def remove(self, user, target_ids):
+        """Удаляет связи с объектами target_ids, возвращает статусы."""
+        targets = self.lookup(user, target_ids)
+        existing = [target_id for target_id, target in targets.items()
+                    if target.linked]
+        deleted = 0
+        if existing:
+            with transaction.atomic():
+                deleted = self.delete_links(user, existing)
+                if deleted:
+                    self.after_remove(user, existing)
+        return {
+            target_id: (
+                NOT_FOUND if target_id not in targets
+                else DELETED if targets[target_id].linked and deleted
+                else ABSENT)
+            for target_id in target_ids
+        }
+
+    def delete_links(self, user, target_ids):
+        """
+        Удаляет связи user с target_ids одним DELETE ... IN, без
+        QuerySet.delete(), который читает строки и отправляет сигналы
+        для каждой. Возвращает количество удаленных строк.
+        """
+        query = sql.DeleteQuery(self.model)
+        query.add_q(Q(**{self.user_field: user,
+                         f'{self.target_field}__in': target_ids}))
+        return query.get_compiler(
+            router.db_for_write(self.model)).execute_sql(ROW_COUNT)
+
+    def recount(self, user, target_ids):
+        recount_related(self.model, **{self.target_field: target_ids})
+
+    def after_add(self, user, target_ids):
+        self.recount(user, target_ids)
+
+    def after_remove(self, user, target_ids):
+        # Часть строк мог удалить параллельный запрос, поэтому
+        # счетчики пересчитываются по таблице, а не уменьшаются.
+        self.recount(user, target_ids)
+
+
+class ShoppingCartRelation(UserRelation):
+
+    def after_add(self, user, target_ids):
+        super().after_add(user, target_ids)
+        self.refresh(user, target_ids)
+
+    def after_remove(self, user, target_ids):
+        super().after_remove(user, target_ids)
+        self.refresh(user, target_ids)
+
+    def refresh(self, user, recipe_ids):
+        """Пересчитывает список покупок user по ингредиентам recipe_ids."""
+        refresh_shopping_list(
+            [user.pk],
+            set(RecipeIngredient.objects.filter(
+                recipe__in=recipe_ids).values_list('ingredient_id',
+                                                   flat=True)))
+        invalidate_shopping_lists([user.pk])
+
+
+class FollowRelation(UserRelation):
+
+    def check(self, user, target):
+        return SELF if target == user else None
+
+    def recount(self, user, target_ids):
+        recount_related(self.model, following=target_ids,
+                        follower=[user.pk])
+
+    def after_add(self, user, target_ids):
+        super().after_add(user, target_ids)
+        backfill(user.pk, target_ids)
+
+    def after_remove(self, user, target_ids):
+        super().after_remove(user, target_ids)
+        forget(user.pk, target_ids)
+
+
+favorite_relation = UserRelation(Favorite, 'user', 'recipe', Recipe)
+shopping_cart_relation = ShoppingCartRelation(
+    ShoppingCart, 'user', 'recipe', Recipe)
+follow_relation = FollowRelation(Follow, 'follower', 'following', User)
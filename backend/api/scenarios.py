@@ -0,0 +1,147 @@
+import time
+from contextlib import nullcontext
+from dataclasses import dataclass
+from urllib.parse import urlencode
+
+from django.db import connection
+from django.db.models import Exists, OuterRef
+from django.urls import reverse
+
+from food.models import Ingredient, Recipe, ShoppingCart, Tag, User
+
+from .shopping_list import invalidate_shopping_lists
+
+
+@dataclass
+class Case:
+    """Запрос к API и неучитываемые действия до и после него."""
+    name: str
+    path: str
+    method: str = 'get'
+    status: int = 200
+    setup: object = None
+    teardown: object = None
+
+    @property
+    def writes(self):
+        return self.method != 'get'
+
+
+def run(client, case, wrapper=None):
+    """
+    Выполняет case, возвращает время запроса с чтением ответа
+    в секундах. wrapper оборачивает запросы к базе только этого
+    запроса. Неожиданный код ответа - ValueError.
+    """
+    if case.setup:
+        case.setup(client)
+    with (connection.execute_wrapper(wrapper) if wrapper
+          else nullcontext()):
+        started = time.perf_counter()
+        response = getattr(client, case.method)(case.path)
+        if response.streaming:
+            b''.join(response.streaming_content)
+        elapsed = time.perf_counter() - started
+    if case.teardown:
+        case.teardown(client)
+    if response.status_code != case.status:
+        raise ValueError(
+            f'{case.name}: {case.method.upper()} {case.path} вернул '
+            f'{response.status_code}, ожидался {case.status}')
+    return elapsed
+
+
+def get_user():
+    """
+    Пользователь с подписками и списком покупок, от имени которого
+    выполняются запросы. None, если база не заполнена.
+    """
+    return User.objects.filter(
+        Exists(ShoppingCart.objects.filter(user=OuterRef('pk'))),
+        following_count__gt=0,
+    ).order_by('-following_count', 'id').first()
+
+
+def get_cases(user, names=None, allow_writes=False):
+    """
+    Основные запросы к API от имени user; запросы, меняющие данные
+    (избранное, список покупок), - только с allow_writes. Запросы,
+    для которых в базе нет данных, пропускаются. names ограничивает
+    набор, неизвестное или недоступное имя - ValueError.
+    """
+    tags = list(Tag.objects.order_by('id').values_list(
+        'slug', flat=True)[:2])
+    author = User.objects.order_by('-recipes_count', 'id').first()
+    recipe = Recipe.objects.order_by('-favorites_count', 'id').first()
+    ingredient = Ingredient.objects.order_by('id').first()
+    # Рецепт вне избранного и списка покупок пользователя.
+    toggled = Recipe.objects.exclude(in_favorites__user=user).exclude(
+        in_shopping_cart__user=user).order_by('id').first()
+    recipes = reverse('recipe-list')
+
+    def request(method, path):
+        return lambda client: getattr(client, method)(path)
+
+    cases = [Case('recipes', recipes)]
+    if tags:
+        query = '&'.join(f'tags={slug}' for slug in tags)
+        cases.append(Case('recipes_tags', f'{recipes}?{query}'))
+    if len(tags) > 1:
+        cases.append(Case('recipes_tags_all',
+                          f'{recipes}?{query}&tags_mode=all'))
+    cases += [
+        Case('recipes_author', f'{recipes}?author={author.id}'),
+        Case('recipes_favorited', f'{recipes}?is_favorited=1'),
+        Case('recipes_in_cart', f'{recipes}?is_in_shopping_cart=1'),
+    ]
+    if recipe is not None:
+        search = urlencode({'search': recipe.name.split()[0]})
+        cases.append(Case('recipes_search', f'{recipes}?{search}'))
+    cases.append(
+        Case('recipes_popular', f'{recipes}?ordering=-favorites_count'))
+    if recipe is not None:
+        cases.append(Case('recipe_detail',
+                          reverse('recipe-detail', args=[recipe.id])))
+    cases += [
+        Case('subscriptions',
+             f"{reverse('user-subscriptions')}?recipes_limit=3"),
+        Case('feed', reverse('recipe-feed')),
+    ]
+    if ingredient is not None:
+        name = urlencode({'name': ingredient.name[:3]})
+        cases += [
+            Case('cook',
+                 f"{reverse('recipe-cook')}?ingredients={ingredient.id}"),
+            Case('ingredients_search',
+                 f"{reverse('ingredient-list')}?{name}"),
+        ]
+    # Кеш сбрасывается, чтобы выполнялась сборка списка.
+    cases.append(Case(
+        'download_shopping_cart', reverse('recipe-download-shopping-cart'),
+        setup=lambda client: invalidate_shopping_lists([user.pk])))
+    if toggled is not None:
+        favorite = reverse('recipe-favorite', args=[toggled.id])
+        cart = reverse('recipe-shopping-cart', args=[toggled.id])
+        cases += [
+            Case('favorite_add', favorite, 'post', 201,
+                 teardown=request('delete', favorite)),
+            Case('favorite_remove', favorite, 'delete', 204,
+                 setup=request('post', favorite)),
+            Case('cart_add', cart, 'post', 201,
+                 teardown=request('delete', cart)),
+            Case('cart_remove', cart, 'delete', 204,
+                 setup=request('post', cart)),
+        ]
+    if names is None:
+        return [case for case in cases if allow_writes or not case.writes]
+    known = {case.name: case for case in cases}
+    unknown = set(names) - set(known)
+    if unknown:
+        raise ValueError(
+            f"Неизвестные эндпоинты: {', '.join(sorted(unknown))}")
+    writes = sorted(name for name in set(names) if known[name].writes)
+    if writes and not allow_writes:
+        raise ValueError(
+            f"Эндпоинты меняют данные, нужен --allow-writes: "
+            f"{', '.join(writes)}")
+    return [case for case in cases if case.name in names]
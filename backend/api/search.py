@@ -0,0 +1,47 @@
+import re
+
+from django.db import connections
+from django.db.models import BooleanField, FloatField, Q
+from django.db.models.expressions import RawSQL
+
+WORD_RE = re.compile(r'\w+')
+
+
+def _fts5_query(query):
+    """Запрос FTS5: все слова пользователя как префиксы, без операторов."""
+    return ' '.join(f'"{word}"*' for word in WORD_RE.findall(query))
+
+
+def search_recipes(queryset, query):
+    """
+    Отбирает рецепты по полнотекстовому запросу и добавляет аннотацию
+    search_rank (чем больше, тем релевантнее). PostgreSQL использует
+    столбец search_vector с GIN-индексом, SQLite - таблицу FTS5.
+    """
+    vendor = connections[queryset.db].vendor
+    if vendor == 'postgresql':
+        tsquery = "websearch_to_tsquery('russian', %s)"
+        return queryset.filter(RawSQL(
+            f'food_recipe.search_vector @@ {tsquery}', (query,),
+            output_field=BooleanField(),
+        )).annotate(search_rank=RawSQL(
+            f'ts_rank(food_recipe.search_vector, {tsquery})', (query,),
+            output_field=FloatField(),
+        ))
+    if vendor == 'sqlite':
+        match = _fts5_query(query)
+        if not match:
+            return queryset.annotate(search_rank=RawSQL('0', ())).none()
+        # Соединение с таблицей FTS5 по rowid: MATCH выполняется
+        # один раз и дает и отбор, и bm25 для каждой строки.
+        return queryset.filter(
+            search_document__isnull=False
+        ).filter(RawSQL(
+            'food_recipe_fts MATCH %s', (match,),
+            output_field=BooleanField(),
+        )).annotate(search_rank=RawSQL(
+            '-bm25(food_recipe_fts, 10.0, 1.0)', (),
+            output_field=FloatField(),
+        ))
+    return queryset.annotate(search_rank=RawSQL('0', ())).filter(
+        Q(name__icontains=query) | Q(text__icontains=query))
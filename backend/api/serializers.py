@@ -1,15 +1,57 @@
+import json
 import re
 
+from django.core.files.storage import default_storage
 from django.db import transaction
+from django.http import QueryDict
 from djoser.serializers import UserCreateSerializer as DjoserCreateSerializer
-from drf_extra_fields.fields import Base64ImageField
 from rest_framework import serializers
 
-from food.models import Follow, Ingredient, Recipe, RecipeIngredient, Tag, User
+from food.aggregates import refresh_shopping_list
+from food.models import (Follow, Ingredient, Recipe, RecipeIngredient,
+                         ShoppingCart, Tag, User)
+from food.signals import recipe_ingredients_changed
+
+from .fields import BulkPrimaryKeyRelatedField, UploadedImageField
+from .shopping_list import invalidate_shopping_lists
+
+BATCH_MAX_SIZE = 100
+
+
+def get_recipes_limit(request):
+    """Возвращает положительный recipes_limit из запроса или None."""
+    if not request:
+        return None
+    try:
+        limit = int(request.query_params.get('recipes_limit'))
+    except (TypeError, ValueError):
+        return None
+    return limit if limit > 0 else None
+
+
+class ImageVariantsField(serializers.Field):
+    """Ссылки на уменьшенные копии изображения: {вариант: {формат: url}}."""
+
+    def __init__(self, **kwargs):
+        kwargs['read_only'] = True
+        super().__init__(**kwargs)
+
+    def to_representation(self, value):
+        request = self.context.get('request')
+        result = {}
+        for variant, files in value.items():
+            if variant == 'source':
+                continue
+            result[variant] = {}
+            for extension, path in files.items():
+                url = default_storage.url(path)
+                result[variant][extension] = (
+                    request.build_absolute_uri(url) if request else url)
+        return result
 
 
 class UserAvatarSerializer(serializers.ModelSerializer):
-    avatar = Base64ImageField(required=True)
+    avatar = UploadedImageField(required=True)
 
     class Meta:
         model = User
@@ -18,8 +60,11 @@ class UserAvatarSerializer(serializers.ModelSerializer):
 
 class UserSerializer(serializers.ModelSerializer):
     is_subscribed = serializers.SerializerMethodField()
+    avatar_variants = ImageVariantsField()
 
     def get_is_subscribed(self, obj):
+        if hasattr(obj, 'is_subscribed'):
+            return obj.is_subscribed
         request = self.context.get('request')
         if not request or request.user.is_anonymous:
             return False
@@ -31,7 +76,7 @@ class UserSerializer(serializers.ModelSerializer):
         model = User
         fields = ['id', 'username', 'email',
                   'first_name', 'last_name',
-                  'is_subscribed', 'avatar']
+                  'is_subscribed', 'avatar', 'avatar_variants']
 
 
 class IngredientSerializer(serializers.ModelSerializer):
@@ -61,61 +106,104 @@ class RecipeIngredientSerializer(serializers.ModelSerializer):
 
 class RecipeSerializer(serializers.ModelSerializer):
     author = UserSerializer(read_only=True)
-    tags = serializers.PrimaryKeyRelatedField(
+    tags = BulkPrimaryKeyRelatedField(
         queryset=Tag.objects.all(), many=True, allow_empty=False
     )
     ingredients = serializers.ListField(
         child=serializers.DictField(), write_only=True, allow_empty=False
     )
-    image = Base64ImageField()
+    image = UploadedImageField()
+    image_variants = ImageVariantsField()
     is_favorited = serializers.SerializerMethodField()
     is_in_shopping_cart = serializers.SerializerMethodField()
 
     class Meta:
         model = Recipe
         fields = ['id', 'name', 'tags', 'author', 'ingredients',
-                  'image', 'text', 'cooking_time',
+                  'image', 'image_variants', 'text', 'cooking_time',
                   'is_favorited', 'is_in_shopping_cart']
 
     def get_is_favorited(self, obj):
+        if hasattr(obj, 'is_favorited'):
+            return obj.is_favorited
         request = self.context.get('request')
         if not request or request.user.is_anonymous:
             return False
         return obj.in_favorites.filter(user=request.user).exists()
 
     def get_is_in_shopping_cart(self, obj):
+        if hasattr(obj, 'is_in_shopping_cart'):
+            return obj.is_in_shopping_cart
         request = self.context.get('request')
         if not request or request.user.is_anonymous:
             return False
         return obj.in_shopping_cart.filter(user=request.user).exists()
 
+    def to_internal_value(self, data):
+        if isinstance(data, QueryDict):
+            # multipart/form-data: теги передаются несколькими полями,
+            # ингредиенты - строкой JSON.
+            values = data.dict()
+            if 'tags' in data:
+                values['tags'] = data.getlist('tags')
+            if isinstance(values.get('ingredients'), str):
+                try:
+                    values['ingredients'] = json.loads(values['ingredients'])
+                except ValueError:
+                    raise serializers.ValidationError({
+                        'ingredients': 'Ожидается список в формате JSON'})
+            data = values
+        return super().to_internal_value(data)
+
     def validate_ingredients(self, value):
         if not value:
             raise serializers.ValidationError(
                 'Ингредиенты не могут быть пустыми')
-        ids = []
+        amounts = {}
         for item in value:
             if 'id' not in item or 'amount' not in item:
                 raise serializers.ValidationError(
                     'Каждый ингредиент должен содержать id и amount')
-            if not Ingredient.objects.filter(id=item['id']).exists():
+            try:
+                ingredient_id = int(item['id'])
+                amount = float(item['amount'])
+            except (TypeError, ValueError):
                 raise serializers.ValidationError(
-                    f"Ингредиент с id {item['id']} не существует")
-            if item['id'] in ids:
+                    'id и amount должны быть числами')
+            if ingredient_id in amounts:
                 raise serializers.ValidationError(
                     'Ингредиенты не должны повторяться')
-            ids.append(item['id'])
-            if int(item['amount']) < 1:
+            if amount < 1:
                 raise serializers.ValidationError(
                     'Количество должно быть больше 0')
-        return value
+            amounts[ingredient_id] = amount
+        existing = self.get_existing_ingredient_ids(amounts)
+        for ingredient_id in amounts:
+            if ingredient_id not in existing:
+                raise serializers.ValidationError(
+                    f'Ингредиент с id {ingredient_id} не существует')
+        return [{'id': ingredient_id, 'amount': amount}
+                for ingredient_id, amount in amounts.items()]
+
+    def get_existing_ingredient_ids(self, ids):
+        return set(Ingredient.objects.filter(
+            id__in=ids).values_list('id', flat=True))
 
     def to_representation(self, instance):
+        if hasattr(instance, 'is_author_subscribed'):
+            # Переносим аннотацию из queryset на автора, чтобы
+            # UserSerializer не делал отдельный запрос на каждый рецепт.
+            instance.author.is_subscribed = instance.is_author_subscribed
         representation = super().to_representation(instance)
         representation['tags'] = TagSerializer(
             instance.tags.all(), many=True).data
+        ingredients = instance.recipe_ingredients.all()
+        if 'recipe_ingredients' not in getattr(
+                instance, '_prefetched_objects_cache', {}):
+            # После create/update prefetch сброшен.
+            ingredients = ingredients.select_related('ingredient')
         representation['ingredients'] = RecipeIngredientSerializer(
-            instance.recipe_ingredients.all(), many=True
+            ingredients, many=True
         ).data
         return representation
 
@@ -126,6 +214,7 @@ class RecipeSerializer(serializers.ModelSerializer):
         recipe = Recipe.objects.create(**validated_data)
         recipe.tags.set(tags)
         self._create_ingredients(recipe, ingredients)
+        recipe_ingredients_changed.send(sender=Recipe, recipe=recipe)
         return recipe
 
     @transaction.atomic
@@ -133,11 +222,20 @@ class RecipeSerializer(serializers.ModelSerializer):
         tags = validated_data.pop('tags', None)
         ingredients = validated_data.pop('ingredients', None)
         instance = super().update(instance, validated_data)
-        if tags is not None:
+        if tags is not None and (
+                {tag.id for tag in tags}
+                != {tag.id for tag in instance.tags.all()}):
+            # set() сам удаляет лишние и добавляет недостающие связи.
             instance.tags.set(tags)
         if ingredients is not None:
-            instance.recipe_ingredients.all().delete()
-            self._create_ingredients(instance, ingredients)
+            ingredient_ids = self._sync_ingredients(instance, ingredients)
+            if ingredient_ids:
+                user_ids = list(ShoppingCart.objects.filter(
+                    recipe=instance).values_list('user_id', flat=True))
+                refresh_shopping_list(user_ids, ingredient_ids)
+                invalidate_shopping_lists(user_ids)
+                recipe_ingredients_changed.send(
+                    sender=Recipe, recipe=instance)
         return instance
 
     def _create_ingredients(self, recipe, ingredients_data):
@@ -151,10 +249,36 @@ class RecipeSerializer(serializers.ModelSerializer):
         ]
         RecipeIngredient.objects.bulk_create(objs)
 
+    def _sync_ingredients(self, recipe, ingredients_data):
+        """
+        Приводит ингредиенты рецепта к ingredients_data, изменяя только
+        отличающиеся строки. Возвращает id затронутых ингредиентов.
+        """
+        existing = {row.ingredient_id: row
+                    for row in recipe.recipe_ingredients.all()}
+        amounts = {item['id']: item['amount'] for item in ingredients_data}
+        removed = existing.keys() - amounts.keys()
+        added = [item for item in ingredients_data
+                 if item['id'] not in existing]
+        changed = []
+        for ingredient_id, row in existing.items():
+            if ingredient_id in amounts and (
+                    row.quantity != amounts[ingredient_id]):
+                row.quantity = amounts[ingredient_id]
+                changed.append(row)
+        if removed:
+            RecipeIngredient.objects.filter(
+                recipe=recipe, ingredient_id__in=removed).delete()
+        if changed:
+            RecipeIngredient.objects.bulk_update(changed, ['quantity'])
+        if added:
+            self._create_ingredients(recipe, added)
+        return (removed | {item['id'] for item in added}
+                | {row.ingredient_id for row in changed})
+
 
 class SubscriptionSerializer(serializers.ModelSerializer):
     recipes = serializers.SerializerMethodField()
-    recipes_count = serializers.SerializerMethodField()
     is_subscribed = serializers.SerializerMethodField()
     avatar = serializers.SerializerMethodField()
 
@@ -172,18 +296,15 @@ class SubscriptionSerializer(serializers.ModelSerializer):
             return request.build_absolute_uri(obj.avatar.url)
         return None
 
-    def get_recipes_count(self, obj):
-        return obj.recipes.count()
-
     def get_recipes(self, obj):
         request = self.context.get('request')
-        limit = request.query_params.get('recipes_limit') if request else None
-        queryset = obj.recipes.all()
-        if limit:
-            try:
-                queryset = queryset[:int(limit)]
-            except ValueError:
-                pass
+        if hasattr(obj, 'limited_recipes'):
+            queryset = obj.limited_recipes
+        else:
+            queryset = obj.recipes.all()
+            limit = get_recipes_limit(request)
+            if limit is not None:
+                queryset = queryset[:limit]
         return RecipeShortSerializer(
             queryset, many=True, context={'request': request}
         ).data
@@ -222,6 +343,16 @@ class UserRegistrationSerializer(DjoserCreateSerializer):
 
 
 class RecipeShortSerializer(serializers.ModelSerializer):
+    image_variants = ImageVariantsField()
+
     class Meta:
         model = Recipe
-        fields = ('id', 'name', 'image', 'cooking_time')
+        fields = ('id', 'name', 'image', 'image_variants', 'cooking_time')
+
+
+class BatchIdsSerializer(serializers.Serializer):
+    ids = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        allow_empty=False,
+        max_length=BATCH_MAX_SIZE,
+    )
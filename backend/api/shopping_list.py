@@ -0,0 +1,157 @@
+import csv
+import io
+import json
+import uuid
+from abc import ABC, abstractmethod
+
+from django.conf import settings
+from django.core.cache import cache
+from rest_framework.renderers import BaseRenderer
+
+from food.models import ShoppingListItem
+
+from .pdf import PdfTextDocument
+
+CACHE_VERSION_KEY = 'shopping_list_version:{}'
+CACHE_BODY_KEY = 'shopping_list:{user}:{format}:{date}:{version}:{common}'
+
+
+def get_shopping_list(user):
+    """Суммарное количество каждого ингредиента из списка покупок."""
+    return ShoppingListItem.objects.filter(user=user).values(
+        'ingredient__name',
+        'ingredient__measurement_unit',
+        'total_amount'
+    ).order_by('ingredient__name')
+
+
+def _get_version(key):
+    return cache.get_or_set(
+        CACHE_VERSION_KEY.format(key), lambda: uuid.uuid4().hex, None)
+
+
+def get_cache_key(user, format, date):
+    return CACHE_BODY_KEY.format(
+        user=user.id, format=format, date=date,
+        version=_get_version(user.id), common=_get_version('all'))
+
+
+def invalidate_shopping_lists(user_ids=None):
+    """
+    Сбрасывает кеш списков покупок указанных пользователей,
+    без аргументов - всех пользователей.
+    """
+    if user_ids is None:
+        cache.delete(CACHE_VERSION_KEY.format('all'))
+        return
+    cache.delete_many(
+        [CACHE_VERSION_KEY.format(user_id) for user_id in set(user_ids)])
+
+
+def cached_stream(chunks, cache_key):
+    """
+    Отдает фрагменты ответа и сохраняет тело в кеш, если оно
+    не превышает SHOPPING_LIST_CACHE_MAX_SIZE байт.
+    """
+    max_size = settings.SHOPPING_LIST_CACHE_MAX_SIZE
+    buffer, size = [], 0
+    for chunk in chunks:
+        if isinstance(chunk, str):
+            chunk = chunk.encode('utf-8')
+        if buffer is not None:
+            size += len(chunk)
+            buffer.append(chunk)
+            if size > max_size:
+                buffer = None
+        yield chunk
+    if buffer is not None:
+        cache.set(cache_key, b''.join(buffer),
+                  settings.SHOPPING_LIST_CACHE_TIMEOUT)
+
+
+class ShoppingListRenderer(ABC, BaseRenderer):
+    """
+    Базовый рендерер списка покупок. Выбирается по ?format=,
+    сам список формируется потоково через stream(user, rows, date).
+    Ответы с ошибками представление отдает в JSON.
+    """
+    charset = 'utf-8'
+
+    @abstractmethod
+    def stream(self, user, rows, date):
+        """Фрагменты ответа (str или bytes) для строк rows."""
+
+
+class TextShoppingListRenderer(ShoppingListRenderer):
+    media_type = 'text/plain'
+    format = 'txt'
+
+    def stream(self, user, rows, date):
+        yield f'Список покупок для: {user.username}\n'
+        yield f'Дата: {date}\n\n'
+        for item in rows:
+            yield (f'{item["ingredient__name"]} '
+                   f'({item["ingredient__measurement_unit"]}) '
+                   f'— {item["total_amount"]}\n')
+
+
+class CsvShoppingListRenderer(ShoppingListRenderer):
+    media_type = 'text/csv'
+    format = 'csv'
+
+    def stream(self, user, rows, date):
+        line = io.StringIO()
+        writer = csv.writer(line)
+        for values in self._values(rows):
+            writer.writerow(values)
+            yield line.getvalue()
+            line.seek(0)
+            line.truncate()
+
+    def _values(self, rows):
+        yield ['name', 'measurement_unit', 'amount']
+        for item in rows:
+            yield [item['ingredient__name'],
+                   item['ingredient__measurement_unit'],
+                   item['total_amount']]
+
+
+class JsonShoppingListRenderer(ShoppingListRenderer):
+    media_type = 'application/json'
+    format = 'json'
+
+    def stream(self, user, rows, date):
+        yield json.dumps(
+            {'user': user.username, 'date': date}, ensure_ascii=False
+        )[:-1] + ', "ingredients": ['
+        separator = ''
+        for item in rows:
+            yield separator + json.dumps({
+                'name': item['ingredient__name'],
+                'measurement_unit': item['ingredient__measurement_unit'],
+                'amount': item['total_amount'],
+            }, ensure_ascii=False)
+            separator = ', '
+        yield ']}'
+
+
+class PdfShoppingListRenderer(TextShoppingListRenderer):
+    """
+    PDF со строками текстового списка, шрифт - SHOPPING_LIST_PDF_FONT.
+    Страницы отдаются по мере заполнения, таблица смещений - в конце.
+    """
+    media_type = 'application/pdf'
+    format = 'pdf'
+    charset = None
+
+    def stream(self, user, rows, date):
+        return PdfTextDocument(settings.SHOPPING_LIST_PDF_FONT).stream(
+            line.rstrip('\n') for line in super().stream(user, rows, date))
+
+
+SHOPPING_LIST_RENDERERS = [
+    TextShoppingListRenderer,
+    CsvShoppingListRenderer,
+    JsonShoppingListRenderer,
+    PdfShoppingListRenderer,
+]
@@ -0,0 +1,169 @@
+import atexit
+import string
+import threading
+from collections import Counter, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import close_old_connections
+from django.db.models import Case, F, Value, When
+
+from food.catalog import get_changes
+from food.models import Recipe
+from foodgram.routers import read_from_primary
+
+ALPHABET = string.digits + string.ascii_letters
+ID_BITS = 40
+ID_MODULUS = 2 ** ID_BITS
+
+
+def encode_recipe_id(pk):
+    """
+    Короткий код рецепта: id переставляется обратимой биекцией
+    (умножение на нечетное число по модулю 2**40 и XOR с ключом)
+    и записывается в base62.
+    """
+    value = (pk * settings.SHORT_LINK_MULTIPLIER % ID_MODULUS
+             ^ settings.SHORT_LINK_KEY)
+    code = ''
+    while True:
+        value, digit = divmod(value, len(ALPHABET))
+        code = ALPHABET[digit] + code
+        if not value:
+            return code
+
+
+def decode_short_code(code):
+    """id рецепта по короткому коду или None для некорректного кода."""
+    if not 0 < len(code) <= 7:
+        return None
+    value = 0
+    for char in code:
+        digit = ALPHABET.find(char)
+        if digit < 0:
+            return None
+        value = value * len(ALPHABET) + digit
+    if value >= ID_MODULUS:
+        return None
+    inverse = pow(settings.SHORT_LINK_MULTIPLIER, -1, ID_MODULUS)
+    return (value ^ settings.SHORT_LINK_KEY) * inverse % ID_MODULUS
+
+
+class RecipeIdCache:
+    """
+    Ограниченный LRU-кеш id существующих рецептов в памяти процесса.
+    В базу данных обращается только при промахе. Рецепты, удаленные
+    другими воркерами, убираются по общему журналу изменений
+    (food.catalog.get_changes).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._ids = OrderedDict()
+        self._changes = None
+
+    def _sync(self):
+        since = self._changes
+        number, changed = get_changes(Recipe, since)
+        if number == since:
+            return
+        with self._lock:
+            if self._changes != since:
+                # Журнал уже применил другой поток.
+                return
+            if changed is None:
+                self._ids.clear()
+            else:
+                for pk in changed:
+                    self._ids.pop(pk, None)
+            self._changes = number
+
+    def exists(self, pk):
+        self._sync()
+        with self._lock:
+            if pk in self._ids:
+                self._ids.move_to_end(pk)
+                return True
+        with read_from_primary():
+            if not Recipe.objects.filter(pk=pk).exists():
+                return False
+        with self._lock:
+            self._ids[pk] = None
+            if len(self._ids) > settings.SHORT_LINK_CACHE_SIZE:
+                self._ids.popitem(last=False)
+        return True
+
+    def discard(self, pk):
+        with self._lock:
+            self._ids.pop(pk, None)
+
+
+class ClickBuffer:
+    """
+    Счетчик переходов по коротким ссылкам. Переходы копятся в памяти
+    и записываются в базу одним UPDATE в фоновом потоке - после
+    SHORT_LINK_FLUSH_SIZE переходов или через SHORT_LINK_FLUSH_INTERVAL
+    секунд после первого незаписанного перехода (по таймеру).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._clicks = Counter()
+        self._pending = 0
+        self._timer = None
+        self._executor = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix='short-link-clicks')
+
+    def add(self, pk):
+        with self._lock:
+            self._clicks[pk] += 1
+            self._pending += 1
+            if self._pending < settings.SHORT_LINK_FLUSH_SIZE:
+                if self._timer is None:
+                    self._timer = threading.Timer(
+                        settings.SHORT_LINK_FLUSH_INTERVAL, self._flush_due)
+                    self._timer.daemon = True
+                    self._timer.start()
+                return
+            clicks = self._swap()
+        self._executor.submit(self._write_in_worker, clicks)
+
+    def flush(self):
+        with self._lock:
+            clicks = self._swap()
+        self._write(clicks)
+
+    def _flush_due(self):
+        with self._lock:
+            clicks = self._swap()
+        self._executor.submit(self._write_in_worker, clicks)
+
+    def _swap(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        clicks, self._clicks = self._clicks, Counter()
+        self._pending = 0
+        return clicks
+
+    def _write_in_worker(self, clicks):
+        try:
+            self._write(clicks)
+        finally:
+            close_old_connections()
+
+    @staticmethod
+    def _write(clicks):
+        if not clicks:
+            return
+        Recipe.objects.filter(pk__in=clicks).update(
+            short_link_clicks=F('short_link_clicks') + Case(
+                *(When(pk=pk, then=Value(count))
+                  for pk, count in clicks.items()),
+                default=Value(0),
+            ))
+
+
+recipe_ids = RecipeIdCache()
+click_buffer = ClickBuffer()
+atexit.register(click_buffer.flush)
@@ -0,0 +1,28 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from food.models import Ingredient, Recipe, ShoppingCart
+
+from .ingredient_index import ingredient_index
+from .shopping_list import invalidate_shopping_lists
+from .short_links import recipe_ids
+
+
+@receiver([post_save, post_delete], sender=Ingredient)
+def invalidate_ingredient_index(sender, **kwargs):
+    ingredient_index.invalidate()
+
+
+@receiver([post_save, post_delete], sender=ShoppingCart)
+def invalidate_user_shopping_list(sender, instance, **kwargs):
+    invalidate_shopping_lists([instance.user_id])
+
+
+@receiver([post_save, post_delete], sender=Ingredient)
+def invalidate_all_shopping_lists(sender, **kwargs):
+    invalidate_shopping_lists()
+
+
+@receiver(post_delete, sender=Recipe)
+def forget_recipe_id(sender, instance, **kwargs):
+    recipe_ids.discard(instance.pk)
@@ -0,0 +1,1515 @@
+import base64
+import gzip
+import io
+import json
+import logging
+import re
+import shutil
+import tempfile
+import threading
+import zlib
+from unittest import mock
+from urllib.parse import urlencode
+
+from asgiref.sync import async_to_sync, iscoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import MiddlewareNotUsed
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection
+from django.http import HttpResponse
+from django.test import (AsyncClient, AsyncRequestFactory, RequestFactory,
+                         TestCase, override_settings)
+from django.test.utils import CaptureQueriesContext
+from django.urls import resolve
+from PIL import Image, ImageDraw, ImageFont
+from rest_framework import serializers
+from rest_framework.authtoken.models import Token
+from rest_framework.exceptions import ValidationError
+from rest_framework.test import APIClient
+
+from api.cook_index import CookIndex, cook_index
+from api.fields import UploadedImageField
+from api.ingredient_index import IngredientIndex
+from api.pdf import PdfTextDocument, load_font
+from api.relations import favorite_relation
+from api.short_links import (ClickBuffer, RecipeIdCache, click_buffer,
+                             decode_short_code, encode_recipe_id)
+from food.catalog import (CHANGES_SEQUENCE_KEY, bump_catalog_version,
+                          get_changes, record_changes)
+from food.images import build_variants, paths_of, render_variants
+from food.models import (TAGS_MASK_BITS, Favorite, FeedItem, Follow,
+                         Ingredient, Recipe, RecipeIngredient, ShoppingCart,
+                         ShoppingListItem, Tag, User)
+from foodgram.routers import (ReplicaRouter, ReplicaRoutingMiddleware,
+                              get_sticky_key)
+
+MEDIA_ROOT = tempfile.mkdtemp()
+TEST_CACHES = {
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}
+}
+
+
+def make_png(size=(40, 30), color='red'):
+    buffer = io.BytesIO()
+    Image.new('RGB', size, color).save(buffer, 'PNG')
+    return buffer.getvalue()
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT, CACHES=TEST_CACHES,
+                   IMAGE_WORKERS=0, DATABASE_REPLICAS=[])
+class APITestCase(TestCase):
+    """
+    Авторы, теги, ингредиенты и рецепты; reader подписан на двух
+    авторов, первые пять рецептов у него в избранном и в списке покупок.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.authors = [
+            User.objects.create_user(
+                username=f'author{number}', email=f'author{number}@ya.ru',
+                password='password')
+            for number in range(3)]
+        cls.reader = User.objects.create_user(
+            username='reader', email='reader@ya.ru', password='password')
+        cls.tags = [Tag.objects.create(name=f'Тег {number}',
+                                       slug=f'tag{number}')
+                    for number in range(3)]
+        cls.ingredients = [
+            Ingredient.objects.create(name=name, measurement_unit='г')
+            for name in ('соль', 'сахар', 'мука', 'масло', 'сода')]
+        cls.recipes = []
+        for number in range(12):
+            recipe = Recipe.objects.create(
+                name=f'Рецепт {number}', title=f'Рецепт {number}',
+                author=cls.authors[number % 3],
+                text='суп с грибами' if number % 2 else 'каша на молоке',
+                cooking_time=10 + number,
+                image=SimpleUploadedFile('recipe.png', make_png()))
+            recipe.tags.set(cls.tags[:number % 3 + 1])
+            for position, ingredient in enumerate(
+                    cls.ingredients[:number % 5 + 1]):
+                RecipeIngredient.objects.create(
+                    recipe=recipe, ingredient=ingredient,
+                    quantity=position + 1)
+            cls.recipes.append(recipe)
+        for recipe in cls.recipes[:5]:
+            Favorite.objects.create(user=cls.reader, recipe=recipe)
+            ShoppingCart.objects.create(user=cls.reader, recipe=recipe)
+        for author in cls.authors[:2]:
+            Follow.objects.create(follower=cls.reader, following=author)
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(MEDIA_ROOT, ignore_errors=True)
+
+    def setUp(self):
+        cache.clear()
+        self.client = self.client_for(self.reader)
+        self.anonymous = APIClient()
+
+    def client_for(self, user):
+        """Клиент с настоящим токеном: его проверка - тоже запрос."""
+        client = APIClient()
+        token, _ = Token.objects.get_or_create(user=user)
+        client.credentials(HTTP_AUTHORIZATION=f'Token {token.key}')
+        return client
+
+    def download(self, format, client=None):
+        response = (client or self.client).get(
+            f'/api/recipes/download_shopping_cart/?format={format}')
+        body = (b''.join(response.streaming_content)
+                if response.streaming else response.content)
+        return response, body
+
+    def count_queries(self, request):
+        with CaptureQueriesContext(connection) as context:
+            response = request()
+        return response, len(context.captured_queries)
+
+
+class RecipeQueryBudgetTests(APITestCase):
+    """Число запросов к базе не зависит от размера страницы."""
+
+    def test_list_queries_do_not_depend_on_page_size(self):
+        # Токен, COUNT(*), страница, теги и ингредиенты; без токена - 4.
+        for client, budget in ((self.client, 5), (self.anonymous, 4)):
+            for limit in (1, 100):
+                with (self.subTest(budget=budget, limit=limit),
+                      self.assertNumQueries(budget)):
+                    response = client.get(f'/api/recipes/?limit={limit}')
+                self.assertEqual(response.status_code, 200)
+
+    def test_detail_queries(self):
+        recipe = self.recipes[4]
+        with self.assertNumQueries(4):
+            response = self.client.get(f'/api/recipes/{recipe.id}/')
+        data = response.json()
+        self.assertTrue(data['is_favorited'])
+        self.assertTrue(data['is_in_shopping_cart'])
+        self.assertTrue(data['author']['is_subscribed'])
+        self.assertEqual(len(data['ingredients']), 5)
+        self.assertEqual(len(data['tags']), 2)
+
+    def test_list_annotations(self):
+        results = self.client.get('/api/recipes/?limit=100').json()['results']
+        self.assertEqual(
+            {recipe['id'] for recipe in results if recipe['is_favorited']},
+            {recipe.id for recipe in self.recipes[:5]})
+        subscribed = {recipe['author']['id'] for recipe in results
+                      if recipe['author']['is_subscribed']}
+        self.assertEqual(subscribed,
+                         {author.id for author in self.authors[:2]})
+
+
+class SubscriptionsTests(APITestCase):
+
+    def test_recipes_limit_and_counts(self):
+        response = self.client.get(
+            '/api/users/subscriptions/?recipes_limit=2')
+        self.assertEqual(response.status_code, 200)
+        results = response.json()['results']
+        self.assertEqual([author['id'] for author in results],
+                         [author.id for author in self.authors[:2]])
+        for author, data in zip(self.authors, results):
+            newest = Recipe.objects.filter(author=author).order_by(
+                '-id').values_list('id', flat=True)[:2]
+            self.assertEqual([recipe['id'] for recipe in data['recipes']],
+                             list(newest))
+            self.assertEqual(data['recipes_count'], 4)
+            self.assertTrue(data['is_subscribed'])
+
+    def test_queries_do_not_depend_on_subscriptions(self):
+        path = '/api/users/subscriptions/?recipes_limit=3'
+        _, before = self.count_queries(lambda: self.client.get(path))
+        Follow.objects.create(follower=self.reader,
+                              following=self.authors[2])
+        response, after = self.count_queries(lambda: self.client.get(path))
+        self.assertEqual(response.json()['count'], 3)
+        self.assertEqual(before, after)
+
+
+class IngredientSearchTests(APITestCase):
+
+    def search(self, name):
+        response = self.anonymous.get(f'/api/ingredients/?name={name}')
+        self.assertEqual(response.status_code, 200)
+        return [ingredient['name'] for ingredient in response.json()]
+
+    def test_prefix_matches_before_substring_matches(self):
+        Ingredient.objects.create(name='Морская соль', measurement_unit='г')
+        self.assertEqual(self.search('СО'), ['сода', 'соль', 'Морская соль'])
+        response = self.anonymous.get('/api/ingredients/?name=с&limit=1')
+        self.assertEqual(len(response.json()), 1)
+
+    def test_change_in_other_worker_rebuilds_index(self):
+        self.assertEqual(self.search('сод'), ['сода'])
+        # Другой воркер меняет ингредиент: сигналы этого процесса
+        # не срабатывают, меняется только общая версия справочника.
+        Ingredient.objects.filter(name='сода').update(name='содовая')
+        self.assertEqual(self.search('сод'), ['сода'])
+        bump_catalog_version(Ingredient)
+        self.assertEqual(self.search('сод'), ['содовая'])
+
+    def test_rebuild_keeps_keys_and_rows_together(self):
+        index = IngredientIndex()
+        index.search()
+        entries = index._entries
+        Ingredient.objects.create(name='перец', measurement_unit='г')
+        index.invalidate()
+        index.search()
+        # Читатель, взявший старый снимок, видит согласованную пару.
+        self.assertEqual(entries[0], [row['name'] for row in entries[1]])
+        keys, items = index._entries
+        self.assertEqual(len(keys), len(entries[0]) + 1)
+        self.assertEqual(keys, [row['name'] for row in items])
+
+
+class ShoppingListTests(APITestCase):
+    totals = [('масло', 8.0), ('мука', 9.0), ('сахар', 8.0), ('сода', 5.0),
+              ('соль', 5.0)]
+
+    def test_text_csv_and_json(self):
+        response, body = self.download('txt')
+        self.assertEqual(response['Content-Type'], 'text/plain')
+        self.assertIn('соль (г) — 5.0', body.decode())
+        _, body = self.download('csv')
+        self.assertEqual(body.decode().splitlines(), [
+            'name,measurement_unit,amount',
+            *(f'{name},г,{amount}' for name, amount in self.totals)])
+        _, body = self.download('json')
+        data = json.loads(body)
+        self.assertEqual(data['user'], 'reader')
+        self.assertEqual(
+            [(item['name'], item['amount']) for item in data['ingredients']],
+            self.totals)
+
+    def test_cached_body_is_returned(self):
+        _, first = self.download('csv')
+        response, second = self.download('csv')
+        self.assertFalse(response.streaming)
+        self.assertEqual(first, second)
+
+    def test_pdf_is_text_with_valid_xref(self):
+        response, body = self.download('pdf')
+        self.assertEqual(response['Content-Type'], 'application/pdf')
+        self.assertTrue(body.startswith(b'%PDF-1.4'))
+        self.assertTrue(body.endswith(b'%%EOF\n'))
+        self.assertIn(b'/Subtype /Type0', body)
+        self.assertNotIn(b'/Image', body)
+        start = int(body.rsplit(b'startxref\n', 1)[1].split()[0])
+        xref = body[start:].split(b'trailer')[0].splitlines()[2:]
+        for number, entry in enumerate(xref):
+            offset, _, kind = entry.split()
+            if kind == b'n':
+                self.assertTrue(body[int(offset):].startswith(
+                    f'{number} 0 obj'.encode()))
+        # Текст можно извлечь: соответствие глифов символам в ToUnicode.
+        font = load_font(settings.SHOPPING_LIST_PDF_FONT)
+        for char in 'масло':
+            self.assertIn(
+                f'<{font.glyphs[char]:04X}> <{ord(char):04X}>'.encode(),
+                body)
+
+    def test_pdf_embeds_font_subset(self):
+        _, body = self.download('pdf')
+        # Весь DejaVuSans.ttf - около 400 КБ в сжатом виде.
+        self.assertLess(len(body), 30_000)
+        length, original = map(int, re.search(
+            rb'/Length (\d+) /Length1 (\d+) /Filter', body).groups())
+        start = body.index(b'stream\n', body.index(b'/Length1')) + 7
+        subset = zlib.decompress(body[start:start + length])
+        self.assertEqual(len(subset), original)
+        self.assertRegex(body, rb'/FontName /[A-Z]{6}\+')
+
+        def draw(font, text):
+            image = Image.new('L', (400, 60))
+            ImageDraw.Draw(image).text(
+                (5, 5), text, fill=255, font=ImageFont.truetype(font, 40))
+            return image.tobytes()
+
+        full = settings.SHOPPING_LIST_PDF_FONT
+        # Глифы списка покупок совпадают с полным шрифтом,
+        # неиспользованные глифы пусты.
+        self.assertEqual(draw(io.BytesIO(subset), 'масло соль'),
+                         draw(full, 'масло соль'))
+        self.assertFalse(any(draw(io.BytesIO(subset), 'Q')))
+        self.assertTrue(any(draw(full, 'Q')))
+
+    def test_pdf_pages_are_streamed(self):
+        document = PdfTextDocument(settings.SHOPPING_LIST_PDF_FONT)
+        consumed = []
+
+        def lines():
+            for number in range(100):
+                consumed.append(number)
+                yield f'Строка {number}'
+
+        chunks = document.stream(lines())
+        next(chunks)
+        next(chunks)
+        self.assertEqual(len(consumed), document.lines_per_page)
+        body = b''.join(chunks)
+        self.assertEqual(len(consumed), 100)
+        self.assertIn(b'/Count 3', body)
+
+    def test_pdf_without_font_uses_helvetica(self):
+        document = PdfTextDocument('/nonexistent.ttf')
+        body = b''.join(document.stream(['Salt (g) - 5']))
+        self.assertIn(b'/BaseFont /Helvetica', body)
+
+    def test_errors_are_json(self):
+        for format in ('txt', 'csv', 'pdf'):
+            with self.subTest(format=format):
+                response, _ = self.download(format, self.anonymous)
+                self.assertEqual(response.status_code, 401)
+                self.assertEqual(response['Content-Type'],
+                                 'application/json')
+                self.assertIn('detail', response.json())
+        response, _ = self.download('xml')
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(response['Content-Type'], 'application/json')
+
+
+class ShoppingListAggregateTests(APITestCase):
+    """Агрегаты ShoppingListItem следуют за корзиной и рецептами."""
+
+    def totals(self, user=None):
+        return dict(ShoppingListItem.objects.filter(
+            user=user or self.reader).values_list(
+                'ingredient__name', 'total_amount'))
+
+    def test_cart_changes(self):
+        self.assertEqual(self.totals(), {
+            'соль': 5, 'сахар': 8, 'мука': 9, 'масло': 8, 'сода': 5})
+        path = '/api/recipes/{}/shopping_cart/'
+        response = self.client.post(path.format(self.recipes[5].id))
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(self.totals()['соль'], 6)
+        response = self.client.delete(path.format(self.recipes[4].id))
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(self.totals(), {
+            'соль': 5, 'сахар': 6, 'мука': 6, 'масло': 4})
+
+    def test_recipe_update_and_delete(self):
+        recipe = self.recipes[4]
+        _, before = self.download('csv')
+        response = self.client_for(recipe.author).patch(
+            f'/api/recipes/{recipe.id}/',
+            {'ingredients': [{'id': self.ingredients[0].id, 'amount': 10}]},
+            format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.totals(), {
+            'соль': 14, 'сахар': 6, 'мука': 6, 'масло': 4})
+        _, after = self.download('csv')
+        self.assertIn('соль,г,14.0', after.decode())
+        self.assertNotEqual(before, after)
+        recipe.delete()
+        self.assertEqual(self.totals(), {
+            'соль': 4, 'сахар': 6, 'мука': 6, 'масло': 4})
+
+    def test_rebuild_command_fixes_drift(self):
+        ShoppingListItem.objects.filter(user=self.reader).update(
+            total_amount=0)
+        ShoppingListItem.objects.create(
+            user=self.authors[0], ingredient=self.ingredients[0],
+            total_amount=1, recipe_count=1)
+        call_command('rebuild_shopping_aggregates', stdout=io.StringIO())
+        self.assertEqual(self.totals()['мука'], 9)
+        self.assertEqual(self.totals(self.authors[0]), {})
+
+
+class ConditionalCatalogTests(APITestCase):
+
+    def test_etag_and_not_modified(self):
+        response = self.anonymous.get('/api/tags/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()), 3)
+        etag = response['ETag']
+        # Версия справочника в кеше: 304 без запросов к базе.
+        with self.assertNumQueries(0):
+            response = self.anonymous.get('/api/tags/',
+                                          headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+        response = self.anonymous.get(
+            '/api/tags/',
+            headers={'If-Modified-Since': response['Last-Modified']})
+        self.assertEqual(response.status_code, 304)
+
+    def test_change_gives_new_etag(self):
+        etag = self.anonymous.get('/api/tags/')['ETag']
+        Tag.objects.create(name='Новый', slug='new')
+        response = self.anonymous.get('/api/tags/',
+                                      headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual(len(response.json()), 4)
+
+    def test_gzip_and_query_have_own_etags(self):
+        plain = self.anonymous.get('/api/ingredients/')
+        gzipped = self.anonymous.get('/api/ingredients/',
+                                     headers={'Accept-Encoding': 'gzip'})
+        self.assertEqual(gzipped['Content-Encoding'], 'gzip')
+        self.assertEqual(gzip.decompress(gzipped.content), plain.content)
+        filtered = self.anonymous.get('/api/ingredients/?name=со')
+        self.assertEqual(len({plain['ETag'], gzipped['ETag'],
+                              filtered['ETag']}), 3)
+        self.assertEqual(len(filtered.json()), 2)
+
+
+class PaginationTests(APITestCase):
+
+    def walk(self, path):
+        """id рецептов со всех страниц по ссылкам next."""
+        ids = []
+        while path:
+            data = self.client.get(path).json()
+            ids.extend(recipe['id'] for recipe in data['results'])
+            path = data['next']
+        return ids
+
+    def test_cursor_pages_cover_all_recipes_once(self):
+        ids = self.walk('/api/recipes/?pagination=cursor&limit=5')
+        self.assertEqual(ids, sorted(
+            (recipe.id for recipe in self.recipes), reverse=True))
+
+    def test_cursor_page_has_no_count(self):
+        # Токен, страница, теги и ингредиенты - без COUNT(*).
+        with self.assertNumQueries(4):
+            response = self.client.get(
+                '/api/recipes/?pagination=cursor&limit=100')
+        self.assertNotIn('count', response.json())
+        self.assertIsNone(response.json()['next'])
+
+    def test_cursor_with_filter(self):
+        ids = self.walk(f'/api/recipes/?pagination=cursor&limit=2'
+                        f'&author={self.authors[1].id}')
+        self.assertEqual(ids, sorted(
+            (recipe.id for recipe in self.recipes
+             if recipe.author == self.authors[1]), reverse=True))
+
+    def test_cursor_allows_only_id_ordering(self):
+        ids = self.walk('/api/recipes/?pagination=cursor&limit=5&ordering=id')
+        self.assertEqual(ids, sorted(recipe.id for recipe in self.recipes))
+        response = self.client.get(
+            '/api/recipes/?pagination=cursor&ordering=-favorites_count')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('ordering', response.json())
+        # Постраничная пагинация сортирует по любому из полей.
+        response = self.client.get('/api/recipes/?ordering=-favorites_count')
+        self.assertEqual(response.status_code, 200)
+
+    def test_approximate_count_is_exact_on_small_tables(self):
+        response = self.client.get('/api/recipes/?count=approximate&limit=5')
+        self.assertEqual(response.json()['count'], 12)
+        self.assertEqual(
+            len(self.walk('/api/recipes/?count=approximate&limit=5')), 12)
+
+
+class CounterTests(APITestCase):
+
+    def test_counters_follow_relations(self):
+        recipe = self.recipes[7]
+        self.assertEqual(
+            (recipe.favorites_count, recipe.in_carts_count), (0, 0))
+        self.client.post(f'/api/recipes/{recipe.id}/favorite/')
+        self.client_for(self.authors[0]).post(
+            f'/api/recipes/{recipe.id}/favorite/')
+        self.client.post(f'/api/recipes/{recipe.id}/shopping_cart/')
+        recipe.refresh_from_db()
+        self.assertEqual(
+            (recipe.favorites_count, recipe.in_carts_count), (2, 1))
+        self.client.delete(f'/api/recipes/{recipe.id}/favorite/')
+        recipe.refresh_from_db()
+        self.assertEqual(recipe.favorites_count, 1)
+        author = self.authors[0]
+        author.refresh_from_db()
+        self.assertEqual((author.recipes_count, author.followers_count),
+                         (4, 1))
+        self.reader.refresh_from_db()
+        self.assertEqual(self.reader.following_count, 2)
+
+    def test_ordering_by_counter(self):
+        recipe = self.recipes[9]
+        for user in self.authors:
+            Favorite.objects.create(user=user, recipe=recipe)
+        results = self.client.get(
+            '/api/recipes/?ordering=-favorites_count&limit=6'
+        ).json()['results']
+        self.assertEqual([item['id'] for item in results], [
+            recipe.id, *(item.id for item in self.recipes[4::-1])])
+
+    def test_recount_fixes_drift(self):
+        Recipe.objects.update(favorites_count=7)
+        User.objects.filter(pk=self.reader.pk).update(following_count=0)
+        call_command('recount', stdout=io.StringIO())
+        self.assertEqual(
+            sorted(Recipe.objects.values_list('favorites_count', flat=True)),
+            [0] * 7 + [1] * 5)
+        self.reader.refresh_from_db()
+        self.assertEqual(self.reader.following_count, 2)
+
+
+class ImageVariantTests(APITestCase):
+
+    def test_render_variants_sizes(self):
+        variants = render_variants(io.BytesIO(make_png((2000, 1000))))
+        sizes = {'thumb': (240, 120), 'card': (640, 320),
+                 'full': (1600, 800)}
+        for variant, size in sizes.items():
+            self.assertEqual(set(variants[variant]), {'webp', 'jpeg'})
+            for content in variants[variant].values():
+                with Image.open(io.BytesIO(content)) as image:
+                    self.assertEqual(image.size, size)
+
+    def test_variants_are_built_after_commit(self):
+        image = base64.b64encode(make_png((800, 400))).decode()
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.put(
+                '/api/users/me/avatar/',
+                {'avatar': f'data:image/png;base64,{image}'}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.reader.refresh_from_db()
+        variants = self.reader.avatar_variants
+        self.assertEqual(variants['source'], self.reader.avatar.name)
+        for path in paths_of(variants):
+            self.assertTrue(default_storage.exists(path))
+        data = self.client.get('/api/users/me/').json()
+        self.assertTrue(data['avatar_variants']['thumb']['webp'].endswith(
+            '.webp'))
+
+    def test_replaced_image_removes_old_variants(self):
+        recipe = self.recipes[0]
+        build_variants(Recipe, recipe.pk, 'image')
+        recipe.refresh_from_db()
+        old_paths = paths_of(recipe.image_variants)
+        recipe.image = SimpleUploadedFile('new.png', make_png(color='blue'))
+        with self.captureOnCommitCallbacks(execute=True):
+            recipe.save()
+        recipe.refresh_from_db()
+        self.assertEqual(recipe.image_variants['source'], recipe.image.name)
+        for path in old_paths:
+            self.assertFalse(default_storage.exists(path))
+
+
+class Base64ImageTests(APITestCase):
+
+    def decode(self, data):
+        file = UploadedImageField().to_internal_value(data)
+        return file.name, file.read()
+
+    def test_line_wrapped_base64(self):
+        content = make_png((300, 200))
+        encoded = base64.b64encode(content).decode()
+        for separator in ('\n', '\r\n', ' '):
+            wrapped = separator.join(
+                encoded[start:start + 76]
+                for start in range(0, len(encoded), 76))
+            # Фрагменты не кратны 4 после удаления пробельных символов.
+            for chunk_size in (8, 80, 64 * 1024):
+                with (self.subTest(separator=separator,
+                                   chunk_size=chunk_size),
+                      mock.patch('api.fields.BASE64_CHUNK_SIZE',
+                                 chunk_size)):
+                    name, decoded = self.decode(
+                        f'data:image/png;base64,\n{wrapped}\n')
+                    self.assertEqual(decoded, content)
+                    self.assertTrue(name.endswith('.png'))
+
+    def test_invalid_base64(self):
+        encoded = base64.b64encode(make_png()).decode()
+        for data in (encoded[:-1], encoded[:10] + '!' + encoded[10:]):
+            with self.assertRaises(ValidationError) as context:
+                self.decode(data)
+            self.assertEqual(context.exception.detail[0].code,
+                             'invalid_base64')
+
+    @override_settings(IMAGE_UPLOAD_MAX_SIZE=100)
+    def test_too_large(self):
+        with self.assertRaises(ValidationError) as context:
+            self.decode(base64.b64encode(make_png((300, 300))).decode())
+        self.assertEqual(context.exception.detail[0].code, 'too_large')
+
+
+class ShortLinkTests(APITestCase):
+
+    def test_encode_decode_round_trip(self):
+        codes = set()
+        for pk in (*range(1, 2000), 2 ** 31, 2 ** 40 - 1):
+            code = encode_recipe_id(pk)
+            self.assertLessEqual(len(code), 7)
+            self.assertEqual(decode_short_code(code), pk)
+            codes.add(code)
+        self.assertEqual(len(codes), 2001)
+        for code in ('', 'abc-d', 'zzzzzzz', '12345678'):
+            self.assertIsNone(decode_short_code(code))
+
+    def test_get_link_and_redirect(self):
+        recipe = self.recipes[3]
+        link = self.anonymous.get(
+            f'/api/recipes/{recipe.id}/get-link/').json()['short-link']
+        code = link.rsplit('/', 1)[1]
+        with mock.patch.object(click_buffer, 'add') as add:
+            response = self.anonymous.get(f'/s/{code}')
+        self.assertRedirects(response, f'/recipes/{recipe.id}',
+                             fetch_redirect_response=False)
+        add.assert_called_once_with(recipe.id)
+        self.assertEqual(self.anonymous.get('/s/zzzzzzz').status_code, 404)
+
+    def test_deleted_in_other_worker(self):
+        ids = RecipeIdCache()
+        recipe = self.recipes[3]
+        self.assertTrue(ids.exists(recipe.id))
+        # Удаление в другом воркере: в этом процессе остается только
+        # запись общего журнала изменений.
+        Recipe.objects.filter(pk=recipe.pk).delete()
+        with self.assertNumQueries(0):
+            self.assertTrue(ids.exists(recipe.id))
+        record_changes(Recipe, [recipe.pk])
+        self.assertFalse(ids.exists(recipe.id))
+
+    def test_incomplete_change_log_clears_cache(self):
+        ids = RecipeIdCache()
+        ids.exists(self.recipes[0].id)
+        ids.exists(self.recipes[1].id)
+        record_changes(Recipe, [self.recipes[0].id])
+        cache.clear()
+        with self.assertNumQueries(1):
+            ids.exists(self.recipes[1].id)
+
+    def test_delete_signal_records_change(self):
+        number, _ = get_changes(Recipe, None)
+        recipe = self.recipes[5]
+        pk = recipe.pk
+        with self.captureOnCommitCallbacks(execute=True):
+            recipe.delete()
+        self.assertEqual(get_changes(Recipe, number), (number + 1, {pk}))
+
+    def test_change_numbers_come_from_database(self):
+        first, second = self.recipes[0].pk, self.recipes[1].pk
+        record_changes(Recipe, [self.recipes[2].pk])
+        number, _ = get_changes(Recipe, None)
+        record_changes(Recipe, [first])
+        # Другой воркер прочитал номер до предыдущей записи: раньше он
+        # получал тот же номер и перезаписывал чужое изменение.
+        cache.set(CHANGES_SEQUENCE_KEY.format('food.recipe'), number, None)
+        record_changes(Recipe, [second])
+        self.assertEqual(get_changes(Recipe, number),
+                         (number + 2, {first, second}))
+
+    @override_settings(SHORT_LINK_FLUSH_SIZE=3,
+                       SHORT_LINK_FLUSH_INTERVAL=0.05)
+    def test_click_buffer_flushes_by_size_and_timer(self):
+        buffer = ClickBuffer()
+        written = []
+        done = threading.Event()
+
+        def write(clicks):
+            written.append(clicks)
+            done.set()
+
+        buffer._write_in_worker = write
+        for pk in (1, 1, 2):
+            buffer.add(pk)
+        self.assertTrue(done.wait(5))
+        self.assertEqual(written, [{1: 2, 2: 1}])
+        done.clear()
+        buffer.add(3)
+        self.assertTrue(done.wait(5))
+        self.assertEqual(written[1], {3: 1})
+
+    def test_flush_updates_counters(self):
+        buffer = ClickBuffer()
+        for pk in (self.recipes[0].id, self.recipes[0].id,
+                   self.recipes[1].id):
+            buffer.add(pk)
+        buffer.flush()
+        self.assertEqual(
+            list(Recipe.objects.filter(pk__in=[
+                self.recipes[0].id, self.recipes[1].id
+            ]).order_by('id').values_list('short_link_clicks', flat=True)),
+            [2, 1])
+
+
+class RecipeSearchTests(APITestCase):
+
+    def search(self, query):
+        return self.client.get('/api/recipes/',
+                               {'search': query, 'limit': 100})
+
+    def test_search_matches_words_by_prefix(self):
+        response = self.search('гриб')
+        self.assertEqual(
+            [recipe['id'] for recipe in response.json()['results']],
+            [recipe.id for recipe in self.recipes[::-1]
+             if recipe.text.startswith('суп')])
+        self.assertEqual(response.json()['count'], 6)
+        self.assertEqual(self.search('!!!').json()['count'], 0)
+
+    def test_name_ranks_above_text(self):
+        recipe = self.recipes[0]
+        Recipe.objects.filter(pk=recipe.pk).update(name='Грибной суп')
+        results = self.search('грибн').json()['results']
+        self.assertEqual(results[0]['id'], recipe.id)
+
+    def test_match_runs_once(self):
+        with CaptureQueriesContext(connection) as context:
+            self.search('суп')
+        page = [query['sql'] for query in context.captured_queries
+                if 'bm25' in query['sql']]
+        self.assertEqual(len(page), 1)
+        self.assertEqual(page[0].count('MATCH'), 1)
+        self.assertIn('JOIN "food_recipe_fts"', page[0])
+
+    def test_cursor_mode_falls_back_to_pages(self):
+        path = '/api/recipes/?' + urlencode(
+            {'search': 'суп', 'pagination': 'cursor', 'limit': 4})
+        ids = []
+        while path:
+            data = self.client.get(path).json()
+            self.assertEqual(data['count'], 6)
+            ids.extend(recipe['id'] for recipe in data['results'])
+            path = data['next']
+        self.assertEqual(len(ids), len(set(ids)))
+        self.assertEqual(len(ids), 6)
+
+
+class CookIndexTests(APITestCase):
+
+    def test_search_groups_by_missing(self):
+        index = CookIndex()
+        salt, sugar = self.ingredients[:2]
+        self.assertEqual(index.search([salt.id, sugar.id], 1), [
+            *((recipe.id, 0) for recipe in self.recipes[::-1]
+              if recipe.ingredients.count() <= 2),
+            *((recipe.id, 1) for recipe in self.recipes[::-1]
+              if recipe.ingredients.count() == 3)])
+        self.assertEqual(index.search([sugar.id], 0), [])
+
+    def test_endpoint(self):
+        ids = ','.join(str(ingredient.id)
+                       for ingredient in self.ingredients[:2])
+        results = self.anonymous.get(
+            f'/api/recipes/cook/?ingredients={ids}&max_missing=1&limit=100'
+        ).json()['results']
+        self.assertEqual(len(results), 8)
+        self.assertEqual(
+            [item['missing_ingredients'] for item in results],
+            [0] * 6 + [1] * 2)
+        response = self.anonymous.get('/api/recipes/cook/?ingredients=x')
+        self.assertEqual(response.status_code, 400)
+
+    def test_changes_in_other_worker_are_applied_as_deltas(self):
+        index = CookIndex()
+        salt = self.ingredients[0]
+        recipe = self.recipes[4]
+        self.assertNotIn((recipe.id, 0), index.search([salt.id], 0))
+        # Другой воркер меняет рецепт: локальные сигналы не
+        # срабатывают, остается запись общего журнала.
+        RecipeIngredient.objects.filter(recipe=recipe).exclude(
+            ingredient=salt).delete()
+        record_changes(Recipe, [recipe.id])
+        # Перечитывается только измененный рецепт.
+        with self.assertNumQueries(1):
+            self.assertIn((recipe.id, 0), index.search([salt.id], 0))
+        with self.assertNumQueries(0):
+            index.search([salt.id], 0)
+
+    def test_refresh_keeps_search_snapshot(self):
+        index = CookIndex()
+        salt = self.ingredients[0]
+        recipe = self.recipes[4]
+        index.search([salt.id])
+        # Снимок, который search читает после блокировки.
+        postings, sizes = index._postings, index._sizes
+        before = ({key: list(value) for key, value in postings.items()},
+                  dict(sizes))
+        RecipeIngredient.objects.filter(recipe=recipe).exclude(
+            ingredient=salt).delete()
+        record_changes(Recipe, [recipe.id])
+        self.assertIn((recipe.id, 0), index.search([salt.id], 0))
+        self.assertEqual(
+            ({key: list(value) for key, value in postings.items()},
+             dict(sizes)), before)
+        self.assertEqual(index._sizes[recipe.id], 1)
+
+    def test_api_update_and_delete(self):
+        salt = self.ingredients[0]
+        recipe = self.recipes[4]
+        cook_index.search([salt.id])
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client_for(recipe.author).patch(
+                f'/api/recipes/{recipe.id}/',
+                {'ingredients': [{'id': salt.id, 'amount': 1}]},
+                format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn((recipe.id, 0), cook_index.search([salt.id], 0))
+        with self.captureOnCommitCallbacks(execute=True):
+            Recipe.objects.get(pk=recipe.id).delete()
+        self.assertNotIn(recipe.id,
+                         [pk for pk, _ in cook_index.search([salt.id])])
+
+    def test_incomplete_log_rebuilds(self):
+        index = CookIndex()
+        salt = self.ingredients[0]
+        index.search([salt.id])
+        cache.clear()
+        _, count = self.count_queries(lambda: index.search([salt.id]))
+        self.assertEqual(count, 1)
+        self.assertEqual(len(index.search([salt.id], 5)), 12)
+
+
+class TagFilterTests(APITestCase):
+
+    def filter(self, *slugs, mode=None):
+        params = [('tags', slug) for slug in slugs] + [('limit', 100)]
+        if mode:
+            params.append(('tags_mode', mode))
+        response = self.anonymous.get(f'/api/recipes/?{urlencode(params)}')
+        self.assertEqual(response.status_code, 200)
+        return {recipe['id'] for recipe in response.json()['results']}
+
+    def tagged(self, tags, match_all=False):
+        check = all if match_all else any
+        return {recipe.id for recipe in self.recipes
+                if check(tag in recipe.tags.all() for tag in tags)}
+
+    def test_any_and_all(self):
+        first, second, third = self.tags
+        self.assertEqual(self.filter('tag1', 'tag2'),
+                         self.tagged([second, third]))
+        self.assertEqual(self.filter('tag1', 'tag2', mode='all'),
+                         self.tagged([second, third], match_all=True))
+        self.assertEqual(len(self.filter('tag0')), 12)
+        self.assertEqual(len(self.filter('tag2', mode='all')), 4)
+
+    def test_mask_follows_tag_changes(self):
+        recipe = self.recipes[0]
+        recipe.tags.add(self.tags[2])
+        self.assertIn(recipe.id, self.filter('tag2'))
+        self.tags[2].recipe_set.clear()
+        self.assertEqual(self.filter('tag2'), set())
+        recipe.refresh_from_db()
+        self.assertEqual(recipe.tags_mask, self.tags[0].bit)
+
+    def test_tags_past_mask_bits_use_subquery(self):
+        extra = Tag.objects.create(id=TAGS_MASK_BITS + 10, name='Без бита',
+                                   slug='extra')
+        self.assertEqual(extra.bit, 0)
+        recipes = self.recipes[:2]
+        for recipe in recipes:
+            recipe.tags.add(extra)
+            recipe.refresh_from_db()
+        self.assertEqual(recipes[0].tags_mask, self.tags[0].bit)
+        self.assertEqual(self.filter('extra'),
+                         {recipe.id for recipe in recipes})
+        self.assertEqual(self.filter('extra', 'tag2'),
+                         {recipe.id for recipe in recipes}
+                         | self.tagged([self.tags[2]]))
+        self.assertEqual(self.filter('extra', 'tag1', mode='all'),
+                         {recipes[1].id})
+        self.assertEqual(self.filter('extra', mode='all'),
+                         {recipe.id for recipe in recipes})
+
+
+class RecipeWriteTests(APITestCase):
+    """Правка рецепта меняет только отличающиеся строки."""
+
+    def patch(self, recipe, data):
+        return self.client_for(recipe.author).patch(
+            f'/api/recipes/{recipe.id}/', data, format='json')
+
+    def rows(self, recipe):
+        return {row.ingredient_id: (row.id, row.quantity)
+                for row in recipe.recipe_ingredients.all()}
+
+    def test_diff_keeps_unchanged_rows(self):
+        recipe = self.recipes[1]
+        salt, sugar, flour, *_ = self.ingredients
+        before = self.rows(recipe)
+        response = self.patch(recipe, {
+            'ingredients': [{'id': salt.id, 'amount': 1},
+                            {'id': sugar.id, 'amount': 5},
+                            {'id': flour.id, 'amount': 3}],
+            'tags': [self.tags[1].id, self.tags[2].id]})
+        self.assertEqual(response.status_code, 200)
+        after = self.rows(recipe)
+        self.assertEqual(after[salt.id], before[salt.id])
+        self.assertEqual(after[sugar.id], (before[sugar.id][0], 5))
+        self.assertEqual(after[flour.id][1], 3)
+        self.assertEqual(
+            {item['amount'] for item in response.json()['ingredients']},
+            {1, 5, 3})
+        self.assertEqual(set(recipe.tags.values_list('slug', flat=True)),
+                         {'tag1', 'tag2'})
+        self.patch(recipe, {'ingredients': [{'id': sugar.id, 'amount': 5}]})
+        self.assertEqual(self.rows(recipe),
+                         {sugar.id: (before[sugar.id][0], 5)})
+
+    def test_unchanged_edit_writes_nothing(self):
+        recipe = self.recipes[1]
+        data = {
+            'ingredients': [
+                {'id': ingredient_id, 'amount': quantity}
+                for ingredient_id, (_, quantity) in self.rows(recipe).items()],
+            'tags': [tag.id for tag in recipe.tags.all()]}
+        with CaptureQueriesContext(connection) as context:
+            self.assertEqual(self.patch(recipe, data).status_code, 200)
+        writes = [query['sql'] for query in context.captured_queries
+                  if query['sql'].startswith(('INSERT', 'UPDATE', 'DELETE'))
+                  and ('recipeingredient' in query['sql']
+                       or 'recipe_tags' in query['sql'])]
+        self.assertEqual(writes, [])
+
+    def test_edit_cost_does_not_depend_on_ingredient_count(self):
+        small, large = self.recipes[0], self.recipes[4]
+
+        def edit(recipe):
+            return self.count_queries(lambda: self.patch(recipe, {
+                'ingredients': [
+                    {'id': ingredient_id, 'amount': quantity + 1}
+                    for ingredient_id, (_, quantity)
+                    in self.rows(recipe).items()]}))[1]
+
+        self.assertEqual(edit(small), edit(large))
+
+    def test_invalid_ingredients(self):
+        recipe = self.recipes[1]
+        salt = self.ingredients[0]
+        for ingredients in ([{'id': 999, 'amount': 1}],
+                            [{'id': salt.id, 'amount': 1},
+                             {'id': salt.id, 'amount': 2}],
+                            [{'id': salt.id, 'amount': 0}],
+                            [{'id': 'соль', 'amount': 1}]):
+            with self.subTest(ingredients=ingredients):
+                response = self.patch(recipe, {'ingredients': ingredients})
+                self.assertEqual(response.status_code, 400)
+                self.assertIn('ingredients', response.json())
+
+
+class RecipeImportExportTests(APITestCase):
+
+    def export(self, query=''):
+        response = self.client.get(
+            f'/api/recipes/export/?author={self.authors[0].id}{query}')
+        self.assertEqual(response.status_code, 200)
+        return b''.join(response.streaming_content)
+
+    def import_lines(self, body):
+        response = self.client.post(
+            '/api/recipes/import/', body,
+            content_type='application/x-ndjson')
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    @staticmethod
+    def snapshot(recipes):
+        return {
+            recipe.name: (
+                {tag.slug for tag in recipe.tags.all()},
+                {(row.ingredient.name, row.quantity)
+                 for row in recipe.recipe_ingredients.all()},
+                recipe.image.read())
+            for recipe in recipes}
+
+    def imported(self):
+        return self.snapshot(Recipe.objects.filter(author=self.reader))
+
+    def test_round_trip(self):
+        originals = self.snapshot(
+            Recipe.objects.filter(author=self.authors[0]))
+        for query in ('', '&embed_images=1'):
+            with self.subTest(query=query):
+                Recipe.objects.filter(author=self.reader).delete()
+                report = self.import_lines(self.export(query))
+                self.assertEqual(report, {'created': 4, 'failed': 0,
+                                          'errors': []})
+                self.assertEqual(self.imported(), originals)
+        copied = Recipe.objects.filter(author=self.reader).first()
+        self.assertNotIn(copied.image.name,
+                         {recipe.image.name for recipe in self.recipes})
+
+    def test_command_round_trip(self):
+        path = f'{MEDIA_ROOT}/export.ndjson'
+        call_command('export_recipes', path=path, embed_images=True,
+                     author=self.authors[1].username, stdout=io.StringIO())
+        with open(path, encoding='utf-8') as file:
+            self.assertTrue(all(
+                json.loads(line)['image'].startswith('data:image/png')
+                for line in file))
+        call_command('import_recipes', path=path,
+                     author=self.reader.username, stdout=io.StringIO())
+        self.assertEqual(len(self.imported()), 4)
+
+    def test_ingredients_resolved_by_name(self):
+        salt, sugar = self.ingredients[:2]
+        line = json.loads(self.export().splitlines()[0])
+        line['ingredients'] = [
+            # id из другой базы: важно название.
+            {'id': sugar.id, 'name': 'Соль', 'measurement_unit': 'г',
+             'amount': 2},
+            {'id': sugar.id, 'amount': 3}]
+        report = self.import_lines(json.dumps(line))
+        self.assertEqual(report['created'], 1)
+        recipe = Recipe.objects.get(author=self.reader)
+        self.assertEqual(
+            set(recipe.recipe_ingredients.values_list(
+                'ingredient_id', 'quantity')),
+            {(salt.id, 2), (sugar.id, 3)})
+
+    def test_rejected_lines(self):
+        line = json.loads(self.export().splitlines()[0])
+        wrong_unit = {**line, 'ingredients': [
+            {'name': 'соль', 'measurement_unit': 'кг', 'amount': 1}]}
+        foreign_image = {**line,
+                         'image': 'https://example.com/images/1.png'}
+        missing_image = {**line, 'image': None}
+        escaping_image = {**line, 'image': '/media/../../etc/passwd'}
+        report = self.import_lines('\n'.join(json.dumps(data) for data in (
+            wrong_unit, foreign_image, missing_image, escaping_image)))
+        self.assertEqual(report['created'], 0)
+        self.assertEqual([error['line'] for error in report['errors']],
+                         [1, 2, 3, 4])
+        self.assertIn('ingredients', report['errors'][0]['errors'])
+        for error in report['errors'][1:]:
+            self.assertIn('image', error['errors'])
+
+
+class RelationTests(APITestCase):
+    """Пакетные и одиночные избранное, список покупок и подписки."""
+
+    def batch(self, method, path, ids, client=None):
+        response = getattr(client or self.client, method)(
+            path, {'ids': ids}, format='json')
+        self.assertEqual(response.status_code, 200)
+        return {item['id']: item['status']
+                for item in response.json()['results']}
+
+    def test_favorites_batch(self):
+        path = '/api/recipes/favorite/'
+        old, new = self.recipes[0], self.recipes[8]
+        self.assertEqual(self.batch('post', path, [old.id, new.id, 999]), {
+            old.id: 'exists', new.id: 'created', 999: 'not_found'})
+        new.refresh_from_db()
+        self.assertEqual(new.favorites_count, 1)
+        self.assertEqual(self.batch('delete', path, [old.id, new.id]), {
+            old.id: 'deleted', new.id: 'deleted'})
+        self.assertEqual(self.batch('delete', path, [old.id]),
+                         {old.id: 'absent'})
+        for recipe in (old, new):
+            recipe.refresh_from_db()
+            self.assertEqual(recipe.favorites_count, 0)
+        self.assertFalse(
+            Favorite.objects.filter(user=self.reader,
+                                    recipe__in=[old, new]).exists())
+
+    def test_shopping_cart_batch(self):
+        path = '/api/recipes/shopping_cart/'
+        recipes = self.recipes[5:7]
+        ids = [recipe.id for recipe in recipes]
+        self.batch('post', path, ids)
+        _, body = self.download('csv')
+        self.assertIn('соль,г,7.0', body.decode())
+        self.assertEqual(
+            sorted(Recipe.objects.filter(id__in=ids).values_list(
+                'in_carts_count', flat=True)), [1, 1])
+        self.batch('delete', path, ids)
+        _, body = self.download('csv')
+        self.assertIn('соль,г,5.0', body.decode())
+        self.assertEqual(
+            ShoppingListItem.objects.get(
+                user=self.reader, ingredient=self.ingredients[0]
+            ).total_amount, 5)
+
+    def test_subscribe_batch(self):
+        path = '/api/users/subscribe/'
+        first, second, third = self.authors
+        self.assertEqual(
+            self.batch('post', path, [third.id, self.reader.id, first.id]),
+            {third.id: 'created', self.reader.id: 'self',
+             first.id: 'exists'})
+        third.refresh_from_db()
+        self.reader.refresh_from_db()
+        self.assertEqual(third.followers_count, 1)
+        self.assertEqual(self.reader.following_count, 3)
+        self.assertEqual(self.batch('delete', path, [first.id, third.id]),
+                         {first.id: 'deleted', third.id: 'deleted'})
+        self.reader.refresh_from_db()
+        self.assertEqual(self.reader.following_count, 1)
+
+    def test_concurrent_insert_reports_exists(self):
+        recipe, other = self.recipes[8], self.recipes[9]
+        lookup = favorite_relation.lookup
+
+        def stale_lookup(user, target_ids):
+            # Параллельный запрос добавил связь после чтения.
+            targets = lookup(user, target_ids)
+            Favorite.objects.create(user=user, recipe=recipe)
+            return targets
+
+        with mock.patch.object(favorite_relation, 'lookup', stale_lookup):
+            self.assertEqual(
+                self.batch('post', '/api/recipes/favorite/',
+                           [recipe.id, other.id]),
+                {recipe.id: 'exists', other.id: 'created'})
+        for item in (recipe, other):
+            item.refresh_from_db()
+            self.assertEqual(item.favorites_count, 1)
+
+    def test_concurrent_delete_keeps_counters(self):
+        recipe = self.recipes[0]
+        lookup = favorite_relation.lookup
+
+        def stale_lookup(user, target_ids):
+            targets = lookup(user, target_ids)
+            Favorite.objects.filter(user=user, recipe=recipe).delete()
+            return targets
+
+        with mock.patch.object(favorite_relation, 'lookup', stale_lookup):
+            response = self.client.delete(
+                f'/api/recipes/{recipe.id}/favorite/')
+        self.assertEqual(response.status_code, 400)
+        recipe.refresh_from_db()
+        self.assertEqual(recipe.favorites_count, 0)
+
+    def test_single_toggle_queries(self):
+        recipe = self.recipes[8]
+        path = f'/api/recipes/{recipe.id}/favorite/'
+        # Токен, рецепт со связью, INSERT и пересчет счетчика;
+        # в TestCase транзакция - точка сохранения (еще два запроса).
+        response, queries = self.count_queries(
+            lambda: self.client.post(path))
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(queries, 4 + 2)
+        # Токен, рецепт со связью, DELETE и пересчет счетчика.
+        response, queries = self.count_queries(
+            lambda: self.client.delete(path))
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(queries, 4 + 2)
+
+    def test_batch_remove_queries_do_not_depend_on_size(self):
+        ids = [recipe.id for recipe in self.recipes[5:]]
+        for path in ('/api/recipes/favorite/', '/api/recipes/shopping_cart/',
+                     '/api/users/subscribe/'):
+            targets = ([author.id for author in self.authors]
+                       if 'subscribe' in path else ids)
+            with self.subTest(path=path):
+                self.batch('post', path, targets)
+                _, single = self.count_queries(
+                    lambda: self.batch('delete', path, targets[:1]))
+                _, batch = self.count_queries(
+                    lambda: self.batch('delete', path, targets[1:]))
+                self.assertEqual(batch, single)
+
+
+class FeedTests(APITestCase):
+    """Лента подписок reader: рецепты authors[0] и authors[1]."""
+
+    def feed(self, client=None, **params):
+        response = (client or self.client).get('/api/recipes/feed/', params)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def feed_ids(self, client=None):
+        return [recipe['id'] for recipe in self.feed(client, limit=100)[
+            'results']]
+
+    def publish(self, author):
+        return Recipe.objects.create(
+            name='Новый', title='Новый', author=author, text='текст',
+            cooking_time=5,
+            image=SimpleUploadedFile('recipe.png', make_png()))
+
+    def expected(self, authors):
+        return [recipe.id for recipe in reversed(self.recipes)
+                if recipe.author in authors]
+
+    def test_pages_newest_first(self):
+        expected = self.expected(self.authors[:2])
+        self.assertEqual(len(expected), 8)
+        page = self.feed(limit=3)
+        ids = []
+        while True:
+            ids.extend(recipe['id'] for recipe in page['results'])
+            if not page['next']:
+                break
+            page = self.client.get(page['next']).json()
+        self.assertEqual(ids, expected)
+        self.assertEqual(self.anonymous.get(
+            '/api/recipes/feed/').status_code, 401)
+
+    def test_publish_and_unfollow(self):
+        followed = self.publish(self.authors[0])
+        other = self.publish(self.authors[2])
+        self.assertEqual(self.feed_ids()[0], followed.id)
+        self.assertTrue(FeedItem.objects.filter(
+            user=self.reader, recipe=followed).exists())
+        self.client.delete(f'/api/users/{self.authors[0].id}/subscribe/')
+        self.assertEqual(self.feed_ids(), self.expected(self.authors[1:2]))
+        self.client.post(f'/api/users/{self.authors[2].id}/subscribe/')
+        self.assertEqual(self.feed_ids(),
+                         [other.id, *self.expected(self.authors[1:])])
+
+    @override_settings(FEED_FANOUT_THRESHOLD=1)
+    def test_popular_authors_merged_on_read(self):
+        recipe = self.publish(self.authors[0])
+        self.assertFalse(FeedItem.objects.filter(recipe=recipe).exists())
+        self.assertEqual(self.feed_ids()[0], recipe.id)
+        self.assertEqual(
+            [item['id'] for item in self.feed(
+                limit=2, before=recipe.id)['results']],
+            self.expected(self.authors[:2])[:2])
+
+    def test_refresh_feeds(self):
+        call_command('refresh_feeds', max_length=3, stdout=io.StringIO())
+        self.assertEqual(FeedItem.objects.filter(user=self.reader).count(),
+                         3)
+        self.assertEqual(self.feed_ids()[:3],
+                         self.expected(self.authors[:2])[:3])
+        call_command('refresh_feeds', backfill=True, max_length=100,
+                     stdout=io.StringIO())
+        self.assertEqual(self.feed_ids(), self.expected(self.authors[:2]))
+
+
+@override_settings(REQUEST_TIMING_ENABLED=True,
+                   REQUEST_TIMING_SAMPLE_RATE=1, REQUEST_TIMING_SLOW_MS=10000)
+class RequestTimingTests(APITestCase):
+
+    def record(self, logs):
+        self.assertEqual(len(logs.records), 1)
+        return json.loads(logs.records[0].getMessage())
+
+    def test_server_timing_and_log(self):
+        client = self.client_for(self.reader)
+        with self.assertLogs('foodgram.timing', 'INFO') as logs, \
+                CaptureQueriesContext(connection) as queries:
+            response = client.get('/api/recipes/?limit=6')
+        self.assertEqual(response.status_code, 200)
+        header = response['Server-Timing']
+        self.assertIn(f'desc="{len(queries)} queries', header)
+        self.assertRegex(header, r'app;dur=[\d.]+, total;dur=[\d.]+$')
+        record = self.record(logs)
+        self.assertEqual(record['path'], '/api/recipes/')
+        self.assertEqual(record['queries'], len(queries))
+        self.assertGreater(record['app_ms'], 0)
+        self.assertEqual(len(record['slowest']), 3)
+
+    def test_serializers_are_not_patched(self):
+        with self.assertLogs('foodgram.timing', 'INFO'):
+            self.client.get('/api/recipes/')
+        for cls in (serializers.Serializer, serializers.ListSerializer):
+            self.assertEqual(cls.data.fget.__qualname__,
+                             f'{cls.__name__}.data')
+
+    def test_streaming_response_logged_after_last_chunk(self):
+        with self.assertLogs('foodgram.timing', 'INFO') as logs:
+            response = self.client.get('/api/recipes/export/')
+            self.assertIn('Server-Timing', response)
+            logger = logging.getLogger('foodgram.timing')
+            logger.info('{}')
+            lines = b''.join(response.streaming_content).splitlines()
+        self.assertEqual(len(lines), 12)
+        self.assertEqual(logs.records[0].getMessage(), '{}')
+        record = json.loads(logs.records[1].getMessage())
+        # Рецепты, авторы, теги и ингредиенты читаются при отдаче.
+        self.assertGreaterEqual(record['queries'], 4)
+
+    @override_settings(ROOT_URLCONF='foodgram.asgi_urls')
+    async def test_async_requests(self):
+        with self.assertLogs('foodgram.timing', 'INFO') as logs:
+            response = await AsyncClient().get('/api/recipes/')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('app;dur=', response['Server-Timing'])
+        record = self.record(logs)
+        # COUNT, страница, теги и ингредиенты.
+        self.assertEqual(record['queries'], 4)
+
+    @override_settings(ROOT_URLCONF='foodgram.asgi_urls')
+    async def test_async_streaming_response(self):
+        token, _ = await Token.objects.aget_or_create(user=self.reader)
+        with self.assertLogs('foodgram.timing', 'INFO') as logs:
+            response = await AsyncClient().get(
+                '/api/recipes/download_shopping_cart/?format=txt',
+                headers={'Authorization': f'Token {token.key}'})
+            self.assertTrue(response.streaming)
+            logging.getLogger('foodgram.timing').info('{}')
+            body = b''.join(
+                [chunk async for chunk in response.streaming_content])
+        self.assertIn('соль'.encode(), body)
+        self.assertEqual(logs.records[0].getMessage(), '{}')
+        record = json.loads(logs.records[1].getMessage())
+        # Токен и список покупок, прочитанный при отдаче.
+        self.assertEqual(record['queries'], 2)
+
+    @override_settings(REQUEST_TIMING_SAMPLE_RATE=0)
+    def test_unsampled_requests(self):
+        response = self.client.get('/api/tags/')
+        self.assertNotIn('Server-Timing', response)
+
+
+@override_settings(DATABASE_REPLICAS=['replica'], REPLICA_STICKY_SECONDS=10)
+class ReplicaRoutingTests(APITestCase):
+    """
+    Какую базу выбирает ReplicaRouter внутри запроса, прошедшего
+    через ReplicaRoutingMiddleware (самих реплик в тестах нет).
+    """
+    router = ReplicaRouter()
+
+    def route(self, method, path, authorization=None, status=200):
+        seen = {}
+
+        def get_response(request):
+            seen['recipe'] = self.router.db_for_read(Recipe)
+            seen['token'] = self.router.db_for_read(Token)
+            seen['write'] = self.router.db_for_write(Recipe)
+            return HttpResponse(status=status)
+
+        headers = ({'HTTP_AUTHORIZATION': authorization}
+                   if authorization else {})
+        request = getattr(RequestFactory(), method)(path, **headers)
+        ReplicaRoutingMiddleware(get_response)(request)
+        return seen
+
+    def test_reads_go_to_replica(self):
+        self.assertEqual(self.route('get', '/api/recipes/'), {
+            'recipe': 'replica', 'token': 'default', 'write': 'default'})
+        self.assertEqual(self.route('head', '/api/tags/')['recipe'],
+                         'replica')
+        self.assertEqual(self.route('get', '/admin/')['recipe'], 'default')
+        self.assertEqual(self.route('post', '/api/recipes/')['recipe'],
+                         'default')
+        # Вне запроса (команды, фоновые потоки) - основная база.
+        self.assertEqual(self.router.db_for_read(Recipe), 'default')
+
+    def test_client_reads_own_writes(self):
+        writer, other = 'Token writer', 'Token other'
+        self.route('post', '/api/recipes/1/favorite/', writer, 201)
+        self.assertEqual(
+            self.route('get', '/api/recipes/', writer)['recipe'], 'default')
+        self.assertEqual(
+            self.route('get', '/api/recipes/', other)['recipe'], 'replica')
+        self.assertEqual(self.route('get', '/api/recipes/')['recipe'],
+                         'replica')
+        cache.delete(get_sticky_key(
+            RequestFactory().get('/', HTTP_AUTHORIZATION=writer)))
+        self.assertEqual(
+            self.route('get', '/api/recipes/', writer)['recipe'], 'replica')
+
+    def test_failed_and_anonymous_writes_are_not_sticky(self):
+        self.route('post', '/api/recipes/', 'Token writer', 400)
+        self.route('post', '/api/users/', status=201)
+        self.assertEqual(
+            self.route('get', '/api/recipes/', 'Token writer')['recipe'],
+            'replica')
+
+    def test_async_requests(self):
+        seen = []
+
+        async def get_response(request):
+            seen.append(await sync_to_async(self.router.db_for_read)(
+                Recipe))
+            return HttpResponse(status=201)
+
+        middleware = ReplicaRoutingMiddleware(get_response)
+        factory = AsyncRequestFactory()
+        async_to_sync(middleware)(factory.get('/api/recipes/'))
+        headers = {'Authorization': 'Token writer'}
+        async_to_sync(middleware)(factory.post('/api/recipes/',
+                                               headers=headers))
+        async_to_sync(middleware)(factory.get('/api/recipes/',
+                                              headers=headers))
+        self.assertEqual(seen, ['replica', 'default', 'default'])
+
+    def test_cache_rebuilds_read_from_primary(self):
+        # Алиаса replica в тестах нет: запрос к реплике завершился бы
+        # ошибкой.
+        seen = {}
+
+        def get_response(request):
+            salt = self.ingredients[0]
+            seen['ingredients'] = IngredientIndex().search('со')
+            seen['cook'] = CookIndex().search([salt.id], 0)
+            seen['exists'] = RecipeIdCache().exists(self.recipes[0].id)
+            seen['after'] = self.router.db_for_read(Recipe)
+            return HttpResponse()
+
+        ReplicaRoutingMiddleware(get_response)(
+            RequestFactory().get('/api/ingredients/'))
+        self.assertEqual([row['name'] for row in seen['ingredients']],
+                         ['сода', 'соль'])
+        self.assertEqual(sorted(pk for pk, _ in seen['cook']),
+                         [recipe.id for recipe in self.recipes[::5]])
+        self.assertTrue(seen['exists'])
+        self.assertEqual(seen['after'], 'replica')
+        for path in ('/api/tags/', '/api/ingredients/'):
+            with self.subTest(path=path):
+                self.assertEqual(self.anonymous.get(path).status_code, 200)
+
+    def test_migrations_and_relations(self):
+        self.assertIs(self.router.allow_migrate('replica', 'food'), False)
+        self.assertIsNone(self.router.allow_migrate('default', 'food'))
+        recipe = Recipe.objects.first()
+        recipe._state.db = 'replica'
+        self.assertTrue(self.router.allow_relation(recipe, self.reader))
+
+    @override_settings(DATABASE_REPLICAS=[])
+    def test_disabled_without_replicas(self):
+        with self.assertRaises(MiddlewareNotUsed):
+            ReplicaRoutingMiddleware(lambda request: None)
+
+
+class AsyncViewTests(APITestCase):
+    """
+    Ответы асинхронных представлений (foodgram.asgi_urls) совпадают
+    с ответами синхронных.
+    """
+
+    def headers(self, user):
+        token, _ = Token.objects.get_or_create(user=user)
+        return {'Authorization': f'Token {token.key}'}
+
+    def get_async(self, path, user=None, **headers):
+        if user is not None:
+            headers.update(self.headers(user))
+        with override_settings(ROOT_URLCONF='foodgram.asgi_urls'):
+            return async_to_sync(AsyncClient().get)(path, headers=headers)
+
+    @staticmethod
+    async def read_stream(response):
+        return b''.join([chunk async for chunk in response.streaming_content])
+
+    def assertSameResponse(self, path, user=None):
+        client = self.client_for(user) if user else self.anonymous
+        expected = client.get(path)
+        response = self.get_async(path, user)
+        self.assertEqual(response.status_code, expected.status_code)
+        self.assertEqual(response.json(), expected.json())
+        return response
+
+    def test_routes_are_async(self):
+        for path in ('/api/recipes/', f'/api/recipes/{self.recipes[0].id}/',
+                     '/api/tags/', '/api/ingredients/',
+                     '/api/recipes/download_shopping_cart/'):
+            with self.subTest(path=path):
+                self.assertTrue(iscoroutinefunction(
+                    resolve(path, 'foodgram.asgi_urls').func))
+
+    def test_same_responses(self):
+        recipe = self.recipes[3]
+        for path in ('/api/recipes/?limit=5', '/api/recipes/?limit=5&page=2',
+                     f'/api/recipes/?author={self.authors[0].id}&limit=3',
+                     '/api/recipes/?tags=tag2&is_favorited=1',
+                     '/api/recipes/?page=99',
+                     f'/api/recipes/{recipe.id}/', '/api/recipes/999/',
+                     '/api/tags/', '/api/ingredients/?name=с'):
+            with self.subTest(path=path):
+                self.assertSameResponse(path, self.reader)
+        self.assertSameResponse('/api/recipes/?limit=5')
+
+    def test_sync_fallbacks(self):
+        # Пагинация по курсору, поиск и запись - синхронным DRF.
+        self.assertSameResponse(
+            '/api/recipes/?pagination=cursor&limit=3', self.reader)
+        self.assertSameResponse(
+            f"/api/recipes/?{urlencode({'search': 'грибами'})}", self.reader)
+        self.assertEqual(
+            self.get_async('/api/recipes/', Accept='text/html')[
+                'Content-Type'], 'text/html; charset=utf-8')
+        with override_settings(ROOT_URLCONF='foodgram.asgi_urls'):
+            response = async_to_sync(AsyncClient().post)(
+                f'/api/recipes/{self.recipes[9].id}/favorite/',
+                headers=self.headers(self.reader))
+        self.assertEqual(response.status_code, 201)
+
+    def test_authentication_errors(self):
+        response = self.get_async('/api/recipes/',
+                                  Authorization='Token wrong')
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(response['WWW-Authenticate'], 'Token')
+        self.assertEqual(response.json(), self.anonymous.get(
+            '/api/recipes/', HTTP_AUTHORIZATION='Token wrong').json())
+        response = self.get_async('/api/recipes/download_shopping_cart/')
+        self.assertEqual(response.status_code, 401)
+
+    def test_shopping_list_download(self):
+        _, expected = self.download('txt')
+        cache.clear()
+        path = '/api/recipes/download_shopping_cart/?format=txt'
+        response = self.get_async(path, self.reader)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        self.assertEqual(async_to_sync(self.read_stream)(response), expected)
+        self.assertEqual(response['Content-Disposition'],
+                         'attachment; filename=shopping_list.txt')
+        # Отданный поток сохранен в кеш.
+        response = self.get_async(path, self.reader)
+        self.assertFalse(response.streaming)
+        self.assertEqual(response.content, expected)
+        response = self.get_async(
+            '/api/recipes/download_shopping_cart/?format=xml', self.reader)
+        self.assertEqual(response.status_code, 404)
@@ -1,28 +1,87 @@
 from datetime import datetime
 
-from django.db.models import Sum
-from django.http import HttpResponse
-from django.shortcuts import get_object_or_404
+from asgiref.sync import sync_to_async
+from django.core.cache import cache
+from django.db.models import Exists, OuterRef, Prefetch, Value
+from django.http import (Http404, HttpResponse, HttpResponseRedirect,
+                         StreamingHttpResponse)
+from django.urls import reverse
 from django_filters.rest_framework import DjangoFilterBackend
 from djoser.views import UserViewSet as DjoserUserViewSet
 from rest_framework import generics, status, viewsets
 from rest_framework.decorators import action
 from rest_framework.permissions import (AllowAny, IsAuthenticated,
                                         IsAuthenticatedOrReadOnly)
+from rest_framework.renderers import JSONRenderer
 from rest_framework.response import Response
 
+from food.feed import get_feed_ids
 from food.models import (Favorite, Follow, Ingredient, Recipe,
                          RecipeIngredient, ShoppingCart, Tag, User)
-
-from .filters import RecipeFilter
+from foodgram.pagination import (KeysetPagination, RecipePagination,
+                                 StandartPagination)
+from foodgram.timing import ServerTimingMixin
+
+from .bulk_recipes import RecipeImporter, export_lines
+from .conditional import ConditionalCatalogMixin
+from .cook_index import cook_index
+from .filters import RecipeFilter, RecipeOrderingFilter
+from .ingredient_index import ingredient_index
+from .parsers import UPLOAD_PARSERS, NDJSONParser
 from .permissions import IsAuthorOrReadOnly
-from .serializers import (IngredientSerializer, RecipeSerializer,
-                          RecipeShortSerializer, SubscriptionSerializer,
-                          TagSerializer, UserAvatarSerializer,
-                          UserRegistrationSerializer, UserSerializer)
-
-
-class UserViewSet(DjoserUserViewSet):
+from .relations import (ABSENT, CREATED, EXISTS, NOT_FOUND, SELF,
+                        favorite_relation, follow_relation,
+                        shopping_cart_relation)
+from .serializers import (BatchIdsSerializer, IngredientSerializer,
+                          RecipeSerializer, RecipeShortSerializer,
+                          SubscriptionSerializer, TagSerializer,
+                          UserAvatarSerializer, UserRegistrationSerializer,
+                          UserSerializer, get_recipes_limit)
+from .shopping_list import (SHOPPING_LIST_RENDERERS, cached_stream,
+                            get_cache_key, get_shopping_list)
+from .short_links import (click_buffer, decode_short_code, encode_recipe_id,
+                          recipe_ids)
+
+
+def change_relation(relation, request, pk, represent, messages):
+    """
+    Добавляет (POST) или удаляет (DELETE) одну связь пользователя
+    с объектом pk. Ошибки описываются сообщениями messages по статусу.
+    """
+    if not str(pk).isdigit():
+        raise Http404
+    pk = int(pk)
+    if request.method == 'POST':
+        results, targets = relation.add(request.user, [pk])
+    else:
+        results = relation.remove(request.user, [pk])
+    result = results[pk]
+    if result == NOT_FOUND:
+        raise Http404
+    if result in messages:
+        return Response({'errors': messages[result]},
+                        status=status.HTTP_400_BAD_REQUEST)
+    if result == CREATED:
+        return Response(represent(targets[pk]),
+                        status=status.HTTP_201_CREATED)
+    return Response(status=status.HTTP_204_NO_CONTENT)
+
+
+def change_relations(relation, request):
+    """Пакетный вариант: тело {"ids": [...]}, статус для каждого id."""
+    serializer = BatchIdsSerializer(data=request.data)
+    serializer.is_valid(raise_exception=True)
+    ids = list(dict.fromkeys(serializer.validated_data['ids']))
+    if request.method == 'POST':
+        results, _ = relation.add(request.user, ids)
+    else:
+        results = relation.remove(request.user, ids)
+    return Response({'results': [
+        {'id': pk, 'status': result} for pk, result in results.items()
+    ]})
+
+
+class UserViewSet(ServerTimingMixin, DjoserUserViewSet):
     queryset = User.objects.all()
     serializer_class = UserSerializer
 
@@ -41,7 +100,17 @@ class UserViewSet(DjoserUserViewSet):
     @action(detail=False, permission_classes=[IsAuthenticated])
     def subscriptions(self, request):
         user = request.user
-        queryset = User.objects.filter(followers__follower=user)
+        recipes = Recipe.objects.order_by('-id')
+        limit = get_recipes_limit(request)
+        if limit is not None:
+            # Срез внутри Prefetch выполняется одним запросом
+            # с ROW_NUMBER() OVER (PARTITION BY author_id).
+            recipes = recipes[:limit]
+        queryset = User.objects.filter(
+            followers__follower=user
+        ).prefetch_related(
+            Prefetch('recipes', queryset=recipes, to_attr='limited_recipes')
+        ).order_by('id')
         pages = self.paginate_queryset(queryset)
         serializer = SubscriptionSerializer(
             pages, many=True, context={'request': request}
@@ -51,40 +120,25 @@ class UserViewSet(DjoserUserViewSet):
     @action(detail=True, methods=['post', 'delete'],
             permission_classes=[IsAuthenticated])
     def subscribe(self, request, id=None):
-        user = request.user
-        author = get_object_or_404(User, pk=id)
-
-        if request.method == 'POST':
-            if user == author:
-                return Response(
-                    {'errors': 'Нельзя подписаться на себя'},
-                    status=status.HTTP_400_BAD_REQUEST
-                )
-            if Follow.objects.filter(follower=user, following=author).exists():
-                return Response(
-                    {'errors': 'Вы уже подписаны'},
-                    status=status.HTTP_400_BAD_REQUEST
-                )
-            Follow.objects.create(follower=user, following=author)
-            serializer = SubscriptionSerializer(
-                author, context={'request': request}
-            )
-            return Response(serializer.data, status=status.HTTP_201_CREATED)
-
-        deleted_count, _ = Follow.objects.filter(
-            follower=user, following=author
-        ).delete()
-        if deleted_count == 0:
-            return Response(
-                {'errors': 'Вы не были подписаны'},
-                status=status.HTTP_400_BAD_REQUEST
-            )
-        return Response(status=status.HTTP_204_NO_CONTENT)
+        return change_relation(
+            follow_relation, request, id,
+            lambda author: SubscriptionSerializer(
+                author, context={'request': request}).data,
+            {EXISTS: 'Вы уже подписаны',
+             ABSENT: 'Вы не были подписаны',
+             SELF: 'Нельзя подписаться на себя'})
+
+    @action(detail=False, methods=['post', 'delete'],
+            permission_classes=[IsAuthenticated],
+            url_path='subscribe', url_name='subscribe-batch')
+    def subscribe_batch(self, request):
+        return change_relations(follow_relation, request)
 
 
-class UserAvatarView(generics.UpdateAPIView):
+class UserAvatarView(ServerTimingMixin, generics.UpdateAPIView):
     serializer_class = UserAvatarSerializer
     permission_classes = [IsAuthenticated]
+    parser_classes = UPLOAD_PARSERS
     http_method_names = ['put', 'delete']
 
     def get_object(self):
@@ -97,122 +151,223 @@ class UserAvatarView(generics.UpdateAPIView):
         return Response(status=status.HTTP_204_NO_CONTENT)
 
 
-class TagViewSet(viewsets.ReadOnlyModelViewSet):
+class TagViewSet(ServerTimingMixin, ConditionalCatalogMixin,
+                 viewsets.ReadOnlyModelViewSet):
     queryset = Tag.objects.all()
     serializer_class = TagSerializer
     permission_classes = [AllowAny]
     pagination_class = None
 
 
-class RecipeViewSet(viewsets.ModelViewSet):
+class RecipeViewSet(ServerTimingMixin, viewsets.ModelViewSet):
     queryset = Recipe.objects.all()
     serializer_class = RecipeSerializer
     permission_classes = [IsAuthenticatedOrReadOnly, IsAuthorOrReadOnly]
-    filter_backends = (DjangoFilterBackend,)
+    filter_backends = (DjangoFilterBackend, RecipeOrderingFilter)
     filterset_class = RecipeFilter
+    ordering_fields = ('id', 'favorites_count', 'in_carts_count')
+    ordering = ('-id',)
+    pagination_class = RecipePagination
+    parser_classes = UPLOAD_PARSERS
+
+    def get_queryset(self):
+        user = self.request.user
+        queryset = Recipe.objects.select_related('author').prefetch_related(
+            Prefetch('tags', queryset=Tag.objects.all()),
+            Prefetch(
+                'recipe_ingredients',
+                queryset=RecipeIngredient.objects.select_related('ingredient')
+            ),
+        )
+        if not user.is_authenticated:
+            return queryset.annotate(
+                is_favorited=Value(False),
+                is_in_shopping_cart=Value(False),
+                is_author_subscribed=Value(False),
+            )
+        return queryset.annotate(
+            is_favorited=Exists(Favorite.objects.filter(
+                user=user, recipe=OuterRef('pk'))),
+            is_in_shopping_cart=Exists(ShoppingCart.objects.filter(
+                user=user, recipe=OuterRef('pk'))),
+            is_author_subscribed=Exists(Follow.objects.filter(
+                follower=user, following=OuterRef('author'))),
+        )
 
     def perform_create(self, serializer):
         serializer.save(author=self.request.user)
 
+    def finalize_response(self, request, response, *args, **kwargs):
+        # Ошибки выгрузки списка покупок (401, 406 и т.п.) - в JSON,
+        # а не в запрошенном формате списка.
+        if (self.action == 'download_shopping_cart'
+                and getattr(response, 'exception', False)):
+            request.accepted_renderer = JSONRenderer()
+            request.accepted_media_type = JSONRenderer.media_type
+        return super().finalize_response(request, response, *args, **kwargs)
+
+    @action(detail=False, methods=['post'], url_path='import',
+            permission_classes=[IsAuthenticated],
+            parser_classes=[NDJSONParser])
+    def import_recipes(self, request):
+        """
+        Массовая загрузка рецептов текущего пользователя: по рецепту
+        в формате RecipeSerializer на строку NDJSON.
+        """
+        return Response(RecipeImporter(request.user).run(request.data))
+
+    @action(detail=False, methods=['get'], url_path='export')
+    def export_recipes(self, request):
+        """
+        Потоковая выгрузка рецептов (с учетом фильтров) в NDJSON.
+        С embed_images=1 изображения встраиваются в base64.
+        """
+        queryset = self.filter_queryset(Recipe.objects.all())
+        embed_images = request.query_params.get('embed_images') in (
+            '1', 'true')
+        return StreamingHttpResponse(
+            export_lines(queryset, request.build_absolute_uri,
+                         embed_images),
+            content_type='application/x-ndjson; charset=utf-8')
+
+    @action(detail=False, methods=['get'],
+            permission_classes=[IsAuthenticated])
+    def feed(self, request):
+        """Новые рецепты авторов, на которых подписан пользователь."""
+        paginator = KeysetPagination()
+        page = paginator.paginate_ids(
+            lambda before, limit: get_feed_ids(request.user, before, limit),
+            request)
+        recipes = self.get_queryset().in_bulk(page)
+        serializer = self.get_serializer(
+            [recipes[pk] for pk in page if pk in recipes], many=True)
+        return paginator.get_paginated_response(serializer.data)
+
+    @action(detail=False, methods=['get'])
+    def cook(self, request):
+        """
+        Рецепты из имеющихся ингредиентов (?ingredients=1,2,3):
+        сначала те, для которых есть все ингредиенты, затем те,
+        где недостает не более max_missing (по умолчанию 2).
+        """
+        try:
+            ingredient_ids = {
+                int(value)
+                for param in request.query_params.getlist('ingredients')
+                for value in param.split(',') if value
+            }
+            max_missing = int(request.query_params.get('max_missing', 2))
+        except ValueError:
+            return Response(
+                {'errors': 'Ожидаются целые id ингредиентов'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        if not ingredient_ids or not 0 <= max_missing <= 5:
+            return Response(
+                {'errors': 'Укажите ингредиенты, max_missing от 0 до 5'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        paginator = StandartPagination()
+        page = paginator.paginate_queryset(
+            cook_index.search(ingredient_ids, max_missing), request, self)
+        recipes = self.get_queryset().in_bulk([pk for pk, _ in page])
+        data = []
+        for pk, missing in page:
+            if pk in recipes:
+                item = self.get_serializer(recipes[pk]).data
+                item['missing_ingredients'] = missing
+                data.append(item)
+        return paginator.get_paginated_response(data)
+
     @action(detail=True, methods=['get'], url_path='get-link')
     def get_link(self, request, pk=None):
-        get_object_or_404(Recipe, pk=pk)
-        short_link = f'http://{request.get_host()}/s/{pk}'
+        if not pk.isdigit() or not recipe_ids.exists(int(pk)):
+            raise Http404
+        short_link = request.build_absolute_uri(
+            reverse('short-link', args=[encode_recipe_id(int(pk))]))
         return Response({'short-link': short_link})
 
     @action(detail=True, methods=['post', 'delete'],
             permission_classes=[IsAuthenticated])
     def shopping_cart(self, request, pk=None):
-        user = request.user
-        recipe = get_object_or_404(Recipe, pk=pk)
-
-        if request.method == 'POST':
-            if ShoppingCart.objects.filter(user=user, recipe=recipe).exists():
-                return Response(
-                    {'errors': 'Рецепт уже добавлен в список покупок'},
-                    status=status.HTTP_400_BAD_REQUEST
-                )
-            ShoppingCart.objects.create(user=user, recipe=recipe)
-            serializer = RecipeShortSerializer(recipe)
-            return Response(serializer.data, status=status.HTTP_201_CREATED)
-
-        deleted_count, _ = ShoppingCart.objects.filter(
-            user=user, recipe=recipe
-        ).delete()
-        if deleted_count == 0:
-            return Response(
-                {'errors': 'Рецепта нет в списке покупок'},
-                status=status.HTTP_400_BAD_REQUEST
-            )
-        return Response(status=status.HTTP_204_NO_CONTENT)
+        return change_relation(
+            shopping_cart_relation, request, pk,
+            lambda recipe: RecipeShortSerializer(recipe).data,
+            {EXISTS: 'Рецепт уже добавлен в список покупок',
+             ABSENT: 'Рецепта нет в списке покупок'})
+
+    @action(detail=False, methods=['post', 'delete'],
+            permission_classes=[IsAuthenticated],
+            url_path='shopping_cart', url_name='shopping-cart-batch')
+    def shopping_cart_batch(self, request):
+        return change_relations(shopping_cart_relation, request)
 
     @action(detail=False, methods=['get'],
             permission_classes=[IsAuthenticated],
+            renderer_classes=SHOPPING_LIST_RENDERERS,
             url_path='download_shopping_cart')
     def download_shopping_cart(self, request):
         user = request.user
-        ingredients = RecipeIngredient.objects.filter(
-            recipe__in_shopping_cart__user=user
-        ).values(
-            'ingredient__name',
-            'ingredient__measurement_unit'
-        ).annotate(
-            total_amount=Sum('quantity')
-        ).order_by('ingredient__name')
-
-        shopping_list = [
-            f'Список покупок для: {user.username}\n',
-            f'Дата: {datetime.now().strftime("%d-%m-%Y")}\n\n',
-        ]
-        for item in ingredients:
-            shopping_list.append(
-                f'{item["ingredient__name"]} '
-                f'({item["ingredient__measurement_unit"]}) '
-                f'— {item["total_amount"]}\n'
+        renderer = request.accepted_renderer
+        date = datetime.now().strftime('%d-%m-%Y')
+        cache_key = get_cache_key(user, renderer.format, date)
+        body = cache.get(cache_key)
+        if body is not None:
+            response = HttpResponse(body, content_type=renderer.media_type)
+        else:
+            rows = get_shopping_list(user).iterator()
+            response = StreamingHttpResponse(
+                cached_stream(renderer.stream(user, rows, date), cache_key),
+                content_type=renderer.media_type
             )
-
-        response = HttpResponse(''.join(shopping_list),
-                                content_type='text/plain')
         response['Content-Disposition'] = (
-            'attachment; filename=shopping_list.txt')
+            f'attachment; filename=shopping_list.{renderer.format}')
         return response
 
     @action(detail=True, methods=['post', 'delete'],
             permission_classes=[IsAuthenticated])
     def favorite(self, request, pk=None):
-        user = request.user
-        recipe = get_object_or_404(Recipe, pk=pk)
-
-        if request.method == 'POST':
-            if Favorite.objects.filter(user=user, recipe=recipe).exists():
-                return Response(
-                    {'errors': 'Рецепт уже в избранном'},
-                    status=status.HTTP_400_BAD_REQUEST
-                )
-            Favorite.objects.create(user=user, recipe=recipe)
-            serializer = RecipeShortSerializer(recipe)
-            return Response(serializer.data, status=status.HTTP_201_CREATED)
-
-        deleted_count, _ = Favorite.objects.filter(
-            user=user, recipe=recipe
-        ).delete()
-        if deleted_count == 0:
-            return Response(
-                {'errors': 'Рецепт не был в избранном'},
-                status=status.HTTP_400_BAD_REQUEST
-            )
-        return Response(status=status.HTTP_204_NO_CONTENT)
+        return change_relation(
+            favorite_relation, request, pk,
+            lambda recipe: RecipeShortSerializer(recipe).data,
+            {EXISTS: 'Рецепт уже в избранном',
+             ABSENT: 'Рецепт не был в избранном'})
 
+    @action(detail=False, methods=['post', 'delete'],
+            permission_classes=[IsAuthenticated],
+            url_path='favorite', url_name='favorite-batch')
+    def favorite_batch(self, request):
+        return change_relations(favorite_relation, request)
 
-class IngredientViewSet(viewsets.ReadOnlyModelViewSet):
+
+class IngredientViewSet(ServerTimingMixin, ConditionalCatalogMixin,
+                        viewsets.ReadOnlyModelViewSet):
     queryset = Ingredient.objects.all()
     serializer_class = IngredientSerializer
     permission_classes = [AllowAny]
     pagination_class = None
 
-    def get_queryset(self):
-        queryset = Ingredient.objects.all()
-        name = self.request.query_params.get('name')
-        if name:
-            queryset = queryset.filter(name__istartswith=name)
-        return queryset
+    def get_list_data(self, request):
+        name = request.query_params.get('name', '')
+        try:
+            limit = int(request.query_params.get('limit'))
+        except (TypeError, ValueError):
+            limit = None
+        if limit is not None and limit < 1:
+            limit = None
+        return ingredient_index.search(name, limit, self.catalog_version)
+
+    async def aget_list_data(self, request):
+        if ingredient_index.is_fresh(self.catalog_version):
+            return self.get_list_data(request)
+        # Индекс перестраивается запросом к базе - в потоке.
+        return await sync_to_async(self.get_list_data)(request)
+
+
+def short_link_redirect(request, code):
+    """Переход по короткой ссылке на страницу рецепта."""
+    pk = decode_short_code(code)
+    if pk is None or not recipe_ids.exists(pk):
+        raise Http404
+    click_buffer.add(pk)
+    return HttpResponseRedirect(f'/recipes/{pk}')
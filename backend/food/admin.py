@@ -36,16 +36,14 @@ class RecipeIngredientInline(admin.TabularInline):
 
 @admin.register(Recipe)
 class RecipeAdmin(admin.ModelAdmin):
-    list_display = ('id', 'name', 'author', 'favorites_count')
+    list_display = ('id', 'name', 'author', 'favorites_count',
+                    'in_carts_count')
     list_filter = ('author', 'name', 'tags')
+    list_select_related = ('author',)
     search_fields = ('name', 'author__username')
     inlines = (RecipeIngredientInline,)
     empty_value_display = '-пусто-'
 
-    @admin.display(description='В избранном')
-    def favorites_count(self, obj):
-        return obj.in_favorites.count()
-
 
 @admin.register(Ingredient)
 class IngredientAdmin(admin.ModelAdmin):
@@ -0,0 +1,151 @@
+from django.db import transaction
+from django.db.models import Count, F, OuterRef, Q, Subquery, Sum
+from django.db.models.functions import Coalesce
+
+from food.models import (TAGS_MASK_BITS, Favorite, Follow, Recipe,
+                         RecipeIngredient, ShoppingCart, ShoppingListItem,
+                         User)
+
+COUNTERS = {
+    Recipe: {
+        'favorites_count': (Favorite, 'recipe'),
+        'in_carts_count': (ShoppingCart, 'recipe'),
+    },
+    User: {
+        'recipes_count': (Recipe, 'author'),
+        'followers_count': (Follow, 'following'),
+        'following_count': (Follow, 'follower'),
+    },
+}
+
+
+def change_counter(model, pk, field, delta):
+    """Атомарно изменяет счетчик field у объекта model на delta."""
+    queryset = model.objects.filter(pk=pk)
+    if delta < 0:
+        queryset = queryset.filter(**{f'{field}__gte': -delta})
+    queryset.update(**{field: F(field) + delta})
+
+
+def update_counters(source, instance, delta):
+    """Изменяет счетчики, которые считают строки модели source."""
+    for model, counters in COUNTERS.items():
+        for field, (counted, related) in counters.items():
+            if counted is source:
+                change_counter(
+                    model, getattr(instance, f'{related}_id'), field, delta)
+
+
+def recount_related(source, **related_ids):
+    """
+    Пересчитывает по таблице счетчики строк модели source у объектов,
+    на которые ссылаются эти строки: recount_related(Favorite,
+    recipe=[1, 2]). Нужен после bulk-операций, минующих сигналы.
+    """
+    for model, counters in COUNTERS.items():
+        for field, (counted, related) in counters.items():
+            if counted is source and related_ids.get(related):
+                model.objects.filter(pk__in=related_ids[related]).update(
+                    **{field: count_subquery(counted, related)})
+
+
+def count_subquery(model, field):
+    return Coalesce(Subquery(
+        model.objects.filter(
+            **{field: OuterRef('pk')}
+        ).order_by().values(field).annotate(
+            total=Count('pk')
+        ).values('total')
+    ), 0)
+
+
+@transaction.atomic
+def recount_counters():
+    """
+    Пересчитывает денормализованные счетчики. Возвращает количество
+    исправленных строк для каждой модели.
+    """
+    fixed = {}
+    for model, counters in COUNTERS.items():
+        actual = {
+            name: count_subquery(*source)
+            for name, source in counters.items()
+        }
+        drift = Q()
+        for name in counters:
+            drift |= ~Q(**{name: F(f'actual_{name}')})
+        fixed[model._meta.verbose_name_plural] = model.objects.alias(
+            **{f'actual_{name}': value for name, value in actual.items()}
+        ).filter(drift).update(**actual)
+    return fixed
+
+
+@transaction.atomic
+def refresh_shopping_list(user_ids, ingredient_ids=None):
+    """
+    Пересчитывает агрегаты списков покупок пользователей user_ids
+    по ингредиентам ingredient_ids (по всем, если они не указаны).
+    """
+    user_ids = list(user_ids)
+    if not user_ids:
+        return
+    source = RecipeIngredient.objects.filter(
+        recipe__in_shopping_cart__user__in=user_ids)
+    items = ShoppingListItem.objects.filter(user__in=user_ids)
+    if ingredient_ids is not None:
+        ingredient_ids = list(ingredient_ids)
+        if not ingredient_ids:
+            return
+        source = source.filter(ingredient__in=ingredient_ids)
+        items = items.filter(ingredient__in=ingredient_ids)
+    totals = source.values_list(
+        'recipe__in_shopping_cart__user', 'ingredient'
+    ).annotate(
+        total_amount=Sum('quantity'),
+        recipe_count=Count('id'),
+    ).order_by()
+    fresh = [
+        ShoppingListItem(user_id=user_id, ingredient_id=ingredient_id,
+                         total_amount=total_amount, recipe_count=recipe_count)
+        for user_id, ingredient_id, total_amount, recipe_count in totals
+    ]
+    keys = {(item.user_id, item.ingredient_id) for item in fresh}
+    stale = [
+        pk for pk, user_id, ingredient_id
+        in items.values_list('id', 'user_id', 'ingredient_id')
+        if (user_id, ingredient_id) not in keys
+    ]
+    if stale:
+        ShoppingListItem.objects.filter(id__in=stale).delete()
+    if fresh:
+        ShoppingListItem.objects.bulk_create(
+            fresh,
+            update_conflicts=True,
+            unique_fields=['user', 'ingredient'],
+            update_fields=['total_amount', 'recipe_count'],
+        )
+
+
+def tags_mask(tag_ids):
+    """Битовая маска тегов с id из tag_ids."""
+    mask = 0
+    for tag_id in tag_ids:
+        if tag_id <= TAGS_MASK_BITS:
+            mask |= 1 << (tag_id - 1)
+    return mask
+
+
+def refresh_tags_mask(recipe_ids):
+    """Пересчитывает Recipe.tags_mask рецептов recipe_ids."""
+    recipe_ids = list(recipe_ids)
+    tag_ids = {recipe_id: [] for recipe_id in recipe_ids}
+    for recipe_id, tag_id in Recipe.tags.through.objects.filter(
+            recipe__in=recipe_ids).values_list('recipe_id', 'tag_id'):
+        tag_ids[recipe_id].append(tag_id)
+    masks = {}
+    for recipe_id, ids in tag_ids.items():
+        masks.setdefault(tags_mask(ids), []).append(recipe_id)
+    for mask, ids in masks.items():
+        Recipe.objects.filter(id__in=ids).update(tags_mask=mask)
+    return {recipe_id: mask
+            for mask, ids in masks.items() for recipe_id in ids}
@@ -0,0 +1,101 @@
+import time
+import uuid
+
+from django.core.cache import cache
+from django.db import router, transaction
+from django.db.models import F
+
+from food.models import ChangeSequence
+
+CATALOG_VERSION_KEY = 'catalog_version:{}'
+
+
+def _new_version():
+    return uuid.uuid4().hex, int(time.time())
+
+
+def get_catalog_version(model):
+    """
+    Версия содержимого справочника и время его последнего изменения.
+    Хранится в общем кеше, чтобы все воркеры видели одно значение.
+    """
+    return cache.get_or_set(
+        CATALOG_VERSION_KEY.format(model._meta.label_lower),
+        _new_version, None)
+
+
+async def aget_catalog_version(model):
+    """Асинхронный вариант get_catalog_version."""
+    return await cache.aget_or_set(
+        CATALOG_VERSION_KEY.format(model._meta.label_lower),
+        _new_version, None)
+
+
+def bump_catalog_version(model):
+    cache.set(CATALOG_VERSION_KEY.format(model._meta.label_lower),
+              _new_version(), None)
+
+
+CHANGES_SEQUENCE_KEY = 'catalog_changes:{}'
+CHANGE_KEY = 'catalog_change:{}:{}'
+# Сколько последних изменений можно применить точечно; при большем
+# отставании (или если записи вытеснены из кеша) - полная перестройка.
+CHANGES_LOG_SIZE = 1000
+CHANGES_LOG_TIMEOUT = 60 * 60 * 24
+
+
+def _new_sequence():
+    # Случайное начало: после очистки кеша номера не совпадут
+    # с прочитанными ранее, и журнал будет считаться неполным.
+    return uuid.uuid4().int >> 80
+
+
+def record_changes(model, pks):
+    """
+    Добавляет объекты pks в общий журнал изменений model, по которому
+    кеши в памяти других воркеров обновляются точечно.
+
+    Номера изменений выдает ChangeSequence: UPDATE блокирует строку
+    счетчика до конца транзакции, поэтому воркеры получают разные номера
+    и публикуют последний номер в кеше по порядку.
+    """
+    pks = list(pks)
+    if not pks:
+        return
+    label = model._meta.label_lower
+    key = CHANGES_SEQUENCE_KEY.format(label)
+    sequences = ChangeSequence.objects.filter(model=label)
+    with transaction.atomic(using=router.db_for_write(ChangeSequence)):
+        while not sequences.update(number=F('number') + len(pks)):
+            # Счетчик продолжает номер, уже известный читателям журнала.
+            sequences.get_or_create(model=label, defaults={
+                'number': cache.get_or_set(key, _new_sequence, None)})
+        last = sequences.select_for_update().values_list(
+            'number', flat=True).get()
+        first = last - len(pks) + 1
+        cache.set_many({
+            CHANGE_KEY.format(label, number): pk
+            for number, pk in enumerate(pks, start=first)
+        }, CHANGES_LOG_TIMEOUT)
+        cache.set(key, last, None)
+
+
+def get_changes(model, since):
+    """
+    Номер последнего изменения model и множество pk, измененных после
+    изменения since; вместо множества None, если журнал неполон
+    (since неизвестен, слишком старый или записи вытеснены).
+    """
+    label = model._meta.label_lower
+    number = cache.get_or_set(
+        CHANGES_SEQUENCE_KEY.format(label), _new_sequence, None)
+    if number == since:
+        return number, set()
+    if since is None or not since < number <= since + CHANGES_LOG_SIZE:
+        return number, None
+    keys = [CHANGE_KEY.format(label, position)
+            for position in range(since + 1, number + 1)]
+    changes = cache.get_many(keys)
+    if len(changes) < len(keys):
+        return number, None
+    return number, set(changes.values())
@@ -0,0 +1,101 @@
+from collections import defaultdict
+
+from django.conf import settings
+from django.db.models import Count, F, Window
+from django.db.models.functions import RowNumber
+
+from food.models import FeedItem, Follow, Recipe, User
+
+BATCH_SIZE = 1000
+
+
+def _save(items):
+    FeedItem.objects.bulk_create(
+        items, batch_size=BATCH_SIZE, ignore_conflicts=True)
+
+
+def fan_out(recipes):
+    """
+    Добавляет рецепты в ленты подписчиков их авторов, если у автора
+    меньше FEED_FANOUT_THRESHOLD подписчиков.
+    """
+    by_author = defaultdict(list)
+    for recipe in recipes:
+        by_author[recipe.author_id].append(recipe.id)
+    authors = User.objects.filter(
+        id__in=by_author,
+        followers_count__lt=settings.FEED_FANOUT_THRESHOLD)
+    items = []
+    for follower_id, author_id in Follow.objects.filter(
+            following__in=authors).values_list(
+                'follower_id', 'following_id').iterator():
+        items.extend(
+            FeedItem(user_id=follower_id, recipe_id=recipe_id,
+                     author_id=author_id)
+            for recipe_id in by_author[author_id])
+        if len(items) >= BATCH_SIZE:
+            _save(items)
+            items = []
+    _save(items)
+
+
+def backfill(follower_id, author_ids):
+    """
+    Добавляет в ленту подписчика последние FEED_BACKFILL_SIZE рецептов
+    каждого из авторов author_ids, чьи рецепты раскладываются по лентам.
+    """
+    recipes = Recipe.objects.filter(
+        author__in=author_ids,
+        author__followers_count__lt=settings.FEED_FANOUT_THRESHOLD,
+    ).alias(
+        position=Window(RowNumber(), partition_by=F('author'),
+                        order_by=F('id').desc()),
+    ).filter(
+        position__lte=settings.FEED_BACKFILL_SIZE,
+    ).values_list('id', 'author_id')
+    _save([FeedItem(user_id=follower_id, recipe_id=recipe_id,
+                    author_id=author_id)
+           for recipe_id, author_id in recipes])
+
+
+def forget(follower_id, author_ids):
+    """Убирает из ленты подписчика рецепты авторов author_ids."""
+    FeedItem.objects.filter(
+        user_id=follower_id, author__in=author_ids).delete()
+
+
+def get_feed_ids(user, before=None, limit=10):
+    """
+    id рецептов ленты пользователя по убыванию, меньше before.
+    Сливает готовую ленту с последними рецептами авторов, у которых
+    больше FEED_FANOUT_THRESHOLD подписчиков.
+    """
+    timeline = FeedItem.objects.filter(user=user)
+    celebrities = Recipe.objects.filter(author__in=Follow.objects.filter(
+        follower=user,
+        following__followers_count__gte=settings.FEED_FANOUT_THRESHOLD,
+    ).values('following'))
+    if before is not None:
+        timeline = timeline.filter(recipe_id__lt=before)
+        celebrities = celebrities.filter(id__lt=before)
+    ids = set(timeline.order_by('-recipe_id').values_list(
+        'recipe_id', flat=True)[:limit])
+    ids.update(celebrities.order_by('-id').values_list(
+        'id', flat=True)[:limit])
+    return sorted(ids, reverse=True)[:limit]
+
+
+def trim(max_length):
+    """
+    Оставляет в каждой ленте не больше max_length последних рецептов.
+    Возвращает количество удаленных записей.
+    """
+    deleted = 0
+    for user_id in FeedItem.objects.values('user').annotate(
+            total=Count('id')).filter(
+                total__gt=max_length).values_list('user', flat=True):
+        oldest_kept = FeedItem.objects.filter(user_id=user_id).order_by(
+            '-recipe_id').values_list('recipe_id', flat=True)[max_length - 1]
+        deleted += FeedItem.objects.filter(
+            user_id=user_id, recipe_id__lt=oldest_kept).delete()[0]
+    return deleted
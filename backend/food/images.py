@@ -0,0 +1,118 @@
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from pathlib import PurePosixPath
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import close_old_connections, transaction
+from PIL import Image, ImageOps
+
+logger = logging.getLogger(__name__)
+
+FORMATS = {'webp': 'WEBP', 'jpeg': 'JPEG'}
+
+_executor = None
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            max_workers=settings.IMAGE_WORKERS,
+            thread_name_prefix='image-variants')
+    return _executor
+
+
+def render_variants(file):
+    """
+    Уменьшенные копии изображения без метаданных:
+    {вариант: {формат: байты}} для размеров из IMAGE_VARIANTS.
+    """
+    with Image.open(file) as original:
+        image = ImageOps.exif_transpose(original).convert('RGB')
+    result = {}
+    for variant, size in settings.IMAGE_VARIANTS.items():
+        resized = image.copy()
+        resized.thumbnail((size, size), Image.Resampling.LANCZOS)
+        result[variant] = {}
+        for extension, image_format in FORMATS.items():
+            output = BytesIO()
+            resized.save(output, image_format,
+                         quality=settings.IMAGE_QUALITY, optimize=True)
+            result[variant][extension] = output.getvalue()
+    return result
+
+
+def build_variants(model, pk, field_name):
+    """
+    Создает варианты изображения field_name объекта и сохраняет их пути
+    в поле {field_name}_variants. Выполняется в пуле потоков.
+    """
+    variants_field = f'{field_name}_variants'
+    try:
+        instance = model.objects.filter(pk=pk).only(
+            field_name, variants_field).first()
+        if instance is None:
+            return
+        source = getattr(instance, field_name)
+        old_paths = paths_of(getattr(instance, variants_field))
+        if not source:
+            model.objects.filter(pk=pk).update(**{variants_field: {}})
+            for path in old_paths:
+                default_storage.delete(path)
+            return
+        with source.open('rb') as file:
+            rendered = render_variants(file)
+        stem = PurePosixPath(source.name)
+        variants = {'source': source.name}
+        for variant, files in rendered.items():
+            variants[variant] = {
+                extension: default_storage.save(
+                    str(stem.parent / 'variants'
+                        / f'{stem.stem}_{variant}.{extension}'),
+                    ContentFile(content))
+                for extension, content in files.items()
+            }
+        updated = model.objects.filter(
+            pk=pk, **{field_name: source.name}
+        ).update(**{variants_field: variants})
+        # Если изображение успели заменить, новые варианты не нужны.
+        for path in old_paths if updated else paths_of(variants):
+            default_storage.delete(path)
+    except Exception:
+        logger.exception('Не удалось создать варианты изображения '
+                         '%s %s', model._meta.label, pk)
+
+
+def _build_in_worker(*args):
+    try:
+        build_variants(*args)
+    finally:
+        close_old_connections()
+
+
+def paths_of(variants):
+    return [path for variant, files in (variants or {}).items()
+            if variant != 'source' for path in files.values()]
+
+
+def schedule_variants(instance, field_name, update_fields=None):
+    """
+    После коммита транзакции ставит создание вариантов в очередь,
+    если изображение изменилось. При IMAGE_WORKERS = 0 варианты
+    создаются сразу (удобно для команд управления).
+    """
+    if update_fields is not None and field_name not in update_fields:
+        return
+    image = getattr(instance, field_name)
+    variants = getattr(instance, f'{field_name}_variants') or {}
+    if variants.get('source') == (image.name or None):
+        return
+    args = (type(instance), instance.pk, field_name)
+    if settings.IMAGE_WORKERS:
+        transaction.on_commit(lambda: _get_executor().submit(
+            _build_in_worker, *args))
+    else:
+        transaction.on_commit(lambda: build_variants(*args))
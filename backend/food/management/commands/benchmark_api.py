@@ -0,0 +1,149 @@
+import gc
+import json
+import statistics
+import tracemalloc
+from datetime import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import setup_test_environment, teardown_test_environment
+from rest_framework.test import APIClient
+
+from api.scenarios import get_cases, get_user, run
+from food.models import Recipe, User
+from foodgram.timing import RequestTiming
+
+
+def percentile(samples, percent):
+    return statistics.quantiles(samples, n=100,
+                                method='inclusive')[percent - 1]
+
+
+class Command(BaseCommand):
+    help = ('Замеряет задержку, число запросов к базе и память основных '
+            'эндпоинтов API на текущей (заполненной seed_scale) базе')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=30)
+        parser.add_argument('--warmup', type=int, default=3)
+        parser.add_argument('--only', nargs='+', metavar='NAME',
+                            help='замерить только эти эндпоинты')
+        parser.add_argument('--output', help='записать результаты в JSON')
+        parser.add_argument('--compare', metavar='BASELINE',
+                            help='сравнить с сохраненными результатами')
+        parser.add_argument('--tolerance', type=float, default=0.2,
+                            help='допустимый рост задержки и памяти, доля')
+        parser.add_argument('--min-delta-ms', type=float, default=1.0,
+                            help='рост задержки меньше этого - шум')
+        parser.add_argument('--query-tolerance', type=int, default=0,
+                            help='допустимый рост числа запросов')
+        parser.add_argument('--allow-writes', action='store_true',
+                            help='замерять и запросы, меняющие данные '
+                                 '(добавление в избранное и т.п.)')
+
+    def handle(self, *args, **options):
+        if options['iterations'] < 2:
+            raise CommandError('Нужно хотя бы две итерации')
+        user = get_user()
+        if user is None:
+            raise CommandError('Нет данных: сначала выполните seed_scale')
+        try:
+            cases = get_cases(user, options['only'],
+                              options['allow_writes'])
+        except ValueError as error:
+            raise CommandError(error)
+
+        # testserver в ALLOWED_HOSTS и т.п., как при запуске тестов.
+        setup_test_environment()
+        try:
+            client = APIClient()
+            client.force_authenticate(user)
+            results = {case.name: self.measure(client, case, options)
+                       for case in cases}
+        except ValueError as error:
+            raise CommandError(error)
+        finally:
+            teardown_test_environment()
+
+        report = {
+            'created': datetime.now().isoformat(timespec='seconds'),
+            'database': connection.vendor,
+            'iterations': options['iterations'],
+            'dataset': {'users': User.objects.count(),
+                        'recipes': Recipe.objects.count()},
+            'endpoints': results,
+        }
+        self.print_results(results)
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as file:
+                json.dump(report, file, ensure_ascii=False, indent=2)
+        if options['compare']:
+            self.compare(report, options)
+
+    def measure(self, client, case, options):
+        for _ in range(options['warmup']):
+            run(client, case)
+        gc.collect()
+        samples = [run(client, case) * 1000
+                   for _ in range(options['iterations'])]
+        # Запросы и память считаются отдельным прогоном, чтобы
+        # не искажать задержку.
+        timing = RequestTiming()
+        tracemalloc.start()
+        try:
+            run(client, case, timing)
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+        return {
+            'path': case.path,
+            'method': case.method.upper(),
+            'p50_ms': round(statistics.median(samples), 2),
+            'p95_ms': round(percentile(samples, 95), 2),
+            'queries': timing.queries,
+            'memory_kb': round(peak / 1024, 1),
+        }
+
+    def print_results(self, results):
+        self.stdout.write(
+            f"{'эндпоинт':<24}{'p50, мс':>10}{'p95, мс':>10}"
+            f"{'запросы':>10}{'память, КБ':>12}")
+        for name, result in results.items():
+            self.stdout.write(
+                f"{name:<24}{result['p50_ms']:>10.2f}"
+                f"{result['p95_ms']:>10.2f}{result['queries']:>10}"
+                f"{result['memory_kb']:>12.1f}")
+
+    def compare(self, report, options):
+        with open(options['compare'], encoding='utf-8') as file:
+            baseline = json.load(file)
+        if baseline.get('dataset') != report['dataset']:
+            self.stderr.write(self.style.WARNING(
+                f"Данные отличаются от базовых: {baseline.get('dataset')} "
+                f"и {report['dataset']}"))
+        tolerance = 1 + options['tolerance']
+        regressions = []
+        for name, current in report['endpoints'].items():
+            base = baseline['endpoints'].get(name)
+            if base is None:
+                continue
+            for key in ('p50_ms', 'p95_ms'):
+                if (current[key] > base[key] * tolerance
+                        and current[key] - base[key]
+                        > options['min_delta_ms']):
+                    regressions.append(
+                        f'{name}: {key} {base[key]} -> {current[key]}')
+            if current['memory_kb'] > base['memory_kb'] * tolerance:
+                regressions.append(
+                    f"{name}: memory_kb {base['memory_kb']} -> "
+                    f"{current['memory_kb']}")
+            if current['queries'] > (base['queries']
+                                     + options['query_tolerance']):
+                regressions.append(
+                    f"{name}: queries {base['queries']} -> "
+                    f"{current['queries']}")
+        if regressions:
+            raise CommandError(
+                'Регрессия относительно базовых результатов:\n'
+                + '\n'.join(regressions))
+        self.stdout.write(self.style.SUCCESS('Регрессий нет'))
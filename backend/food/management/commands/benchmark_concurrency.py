@@ -0,0 +1,197 @@
+import asyncio
+import json
+import statistics
+import time
+from datetime import datetime
+from urllib.parse import urlsplit
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.encoding import iri_to_uri
+from rest_framework.authtoken.models import Token
+
+from api.scenarios import get_cases, get_user
+from food.models import Recipe, User
+
+from .benchmark_api import percentile
+
+
+async def fetch(reader, writer, request):
+    """
+    Отправляет запрос HTTP/1.1 и читает ответ целиком. Возвращает
+    код ответа и признак того, что соединение можно использовать снова.
+    """
+    writer.write(request)
+    await writer.drain()
+    status = int((await reader.readline()).split()[1])
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b''):
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        headers[name.strip().lower()] = value.strip().lower()
+    if 'content-length' in headers:
+        await reader.readexactly(int(headers['content-length']))
+    elif headers.get('transfer-encoding') == 'chunked':
+        while True:
+            size = int((await reader.readline()).split(b';')[0], 16)
+            # Данные фрагмента и CRLF после них.
+            await reader.readexactly(size + 2)
+            if not size:
+                break
+    else:
+        await reader.read()
+        return status, False
+    return status, headers.get('connection') != 'close'
+
+
+class Target:
+    """Сервер под нагрузкой: адрес и накопленные результаты."""
+
+    def __init__(self, name, url):
+        parts = urlsplit(url)
+        if parts.scheme != 'http' or not parts.hostname:
+            raise CommandError(f'Нужен адрес вида http://host:port: {url}')
+        self.name = name
+        self.host = parts.hostname
+        self.port = parts.port or 80
+        self.prefix = parts.path.rstrip('/')
+        self.reset()
+
+    def reset(self):
+        self.latencies = []
+        self.errors = 0
+        self.elapsed = 0
+
+    def build_requests(self, paths, token):
+        return [
+            (f'GET {iri_to_uri(self.prefix + path)} HTTP/1.1\r\n'
+             f'Host: {self.host}:{self.port}\r\n'
+             f'Authorization: Token {token}\r\n'
+             f'Accept-Encoding: gzip\r\n\r\n').encode()
+            for path in paths]
+
+    async def worker(self, requests, offset, deadline):
+        """Запросы по кругу, со сдвигом offset, до момента deadline."""
+        connection = None
+        number = offset
+        while time.perf_counter() < deadline:
+            request = requests[number % len(requests)]
+            number += 1
+            started = time.perf_counter()
+            try:
+                if connection is None:
+                    connection = await asyncio.open_connection(
+                        self.host, self.port)
+                status, keep_alive = await fetch(*connection, request)
+            except (OSError, ValueError, IndexError,
+                    asyncio.IncompleteReadError):
+                status, keep_alive = None, False
+            self.latencies.append((time.perf_counter() - started) * 1000)
+            if status is None or status >= 400:
+                self.errors += 1
+            if not keep_alive and connection is not None:
+                connection[1].close()
+                connection = None
+        if connection is not None:
+            connection[1].close()
+
+    async def run(self, requests, concurrency, duration):
+        started = time.perf_counter()
+        deadline = started + duration
+        await asyncio.gather(*(
+            self.worker(requests, number, deadline)
+            for number in range(concurrency)))
+        self.elapsed = time.perf_counter() - started
+
+    def result(self):
+        latencies = self.latencies or [0, 0]
+        return {
+            'requests': len(self.latencies),
+            'errors': self.errors,
+            'rps': round(len(self.latencies) / self.elapsed, 1),
+            'p50_ms': round(statistics.median(latencies), 1),
+            'p95_ms': round(percentile(latencies, 95), 1),
+            'p99_ms': round(percentile(latencies, 99), 1),
+        }
+
+
+class Command(BaseCommand):
+    help = ('Нагружает запущенные серверы API одновременными GET-запросами '
+            'и сравнивает пропускную способность (например, WSGI и ASGI)')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'targets', nargs='+', metavar='NAME=URL',
+            help='серверы, например sync=http://127.0.0.1:8000')
+        parser.add_argument('--concurrency', type=int, default=200,
+                            help='число одновременных клиентов')
+        parser.add_argument('--duration', type=float, default=20,
+                            help='длительность нагрузки на сервер, с')
+        parser.add_argument('--warmup', type=float, default=3,
+                            help='прогрев перед замером, с')
+        parser.add_argument('--only', nargs='+', metavar='NAME',
+                            help='только эти эндпоинты из benchmark_api')
+        parser.add_argument('--output', help='записать результаты в JSON')
+
+    def handle(self, *args, **options):
+        targets = []
+        for value in options['targets']:
+            name, _, url = value.partition('=')
+            if not url:
+                raise CommandError(f'Ожидается NAME=URL: {value}')
+            targets.append(Target(name, url))
+        user = get_user()
+        if user is None:
+            raise CommandError('Нет данных: сначала выполните seed_scale')
+        try:
+            cases = get_cases(user, options['only'], allow_writes=True)
+        except ValueError as error:
+            raise CommandError(error)
+        # Только чтение: запросы на запись меняли бы данные между
+        # прогонами разных серверов.
+        paths = [case.path for case in cases if case.method == 'get']
+        if not paths:
+            raise CommandError('Нет GET-эндпоинтов для нагрузки')
+        token = Token.objects.get_or_create(user=user)[0].key
+
+        results = {}
+        for target in targets:
+            requests = target.build_requests(paths, token)
+            if options['warmup'] > 0:
+                asyncio.run(target.run(
+                    requests, options['concurrency'], options['warmup']))
+                target.reset()
+            asyncio.run(target.run(
+                requests, options['concurrency'], options['duration']))
+            results[target.name] = target.result()
+        self.print_results(results)
+        if options['output']:
+            report = {
+                'created': datetime.now().isoformat(timespec='seconds'),
+                'concurrency': options['concurrency'],
+                'duration': options['duration'],
+                'paths': paths,
+                'dataset': {'users': User.objects.count(),
+                            'recipes': Recipe.objects.count()},
+                'targets': results,
+            }
+            with open(options['output'], 'w', encoding='utf-8') as file:
+                json.dump(report, file, ensure_ascii=False, indent=2)
+
+    def print_results(self, results):
+        self.stdout.write(
+            f"{'сервер':<12}{'запросы':>10}{'ошибки':>8}{'в сек.':>10}"
+            f"{'p50, мс':>10}{'p95, мс':>10}{'p99, мс':>10}")
+        for name, result in results.items():
+            self.stdout.write(
+                f"{name:<12}{result['requests']:>10}{result['errors']:>8}"
+                f"{result['rps']:>10.1f}{result['p50_ms']:>10.1f}"
+                f"{result['p95_ms']:>10.1f}{result['p99_ms']:>10.1f}")
+        if len(results) > 1:
+            base_name, base = next(iter(results.items()))
+            for name, result in list(results.items())[1:]:
+                if base['rps']:
+                    self.stdout.write(
+                        f"{name} / {base_name}: "
+                        f"x{result['rps'] / base['rps']:.2f} запросов в сек.")
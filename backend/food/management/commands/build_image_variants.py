@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+
+from food.images import build_variants
+from food.models import Recipe, User
+
+
+class Command(BaseCommand):
+    help = 'Создает уменьшенные копии изображений рецептов и аватаров'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--force', action='store_true',
+                            help='пересоздать уже готовые копии')
+
+    def handle(self, *args, **options):
+        for model, field_name in ((Recipe, 'image'), (User, 'avatar')):
+            queryset = model.objects.exclude(**{field_name: ''}).exclude(
+                **{f'{field_name}__isnull': True})
+            done = 0
+            for pk, name, variants in queryset.values_list(
+                    'pk', field_name, f'{field_name}_variants').iterator():
+                if options['force'] or variants.get('source') != name:
+                    build_variants(model, pk, field_name)
+                    done += 1
+            self.stdout.write(self.style.SUCCESS(
+                f'{model._meta.verbose_name_plural}: обработано {done}'))
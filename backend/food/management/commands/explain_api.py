@@ -0,0 +1,183 @@
+import re
+from collections import Counter
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test.utils import setup_test_environment, teardown_test_environment
+from rest_framework.test import APIClient
+
+from api.cook_index import cook_index
+from api.scenarios import get_cases, get_user, run
+from food.aggregates import recount_related, refresh_shopping_list
+from food.feed import backfill, fan_out
+from food.models import Follow, Ingredient, Recipe, Tag, User
+from foodgram.timing import normalize_sql
+
+STATEMENTS = ('SELECT', 'INSERT', 'UPDATE', 'DELETE', 'WITH')
+# Таблицы, которые всегда читаются целиком и помещаются в память.
+SMALL_TABLES = {Tag._meta.db_table}
+PLANS = {
+    'postgresql': {
+        'scan': re.compile(r'Seq Scan on (\w+)'),
+        'sort': re.compile(r'^\s*(?:->\s*)?(?:Incremental )?Sort\b'),
+    },
+    'sqlite': {
+        'scan': re.compile(r'^\s*SCAN (\w+)$'),
+        'sort': re.compile(r'USE TEMP B-TREE FOR'),
+    },
+}
+
+
+class Capture:
+    """execute_wrapper: первый запрос каждого вида с параметрами."""
+
+    def __init__(self):
+        self.statements = {}
+
+    def __call__(self, execute, sql, params, many, context):
+        if not many and sql.lstrip()[:6].upper().startswith(STATEMENTS):
+            self.statements.setdefault(normalize_sql(sql), (sql, params))
+        return execute(sql, params, many, context)
+
+
+class Command(BaseCommand):
+    help = ('Выполняет EXPLAIN для запросов к базе, которые делает API, '
+            'и отмечает полные просмотры таблиц и сортировки')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--analyze', action='store_true',
+                            help='EXPLAIN ANALYZE (только PostgreSQL)')
+        parser.add_argument('--only', nargs='+', metavar='NAME',
+                            help='проверить только эти эндпоинты и задачи')
+        parser.add_argument('--plans', action='store_true',
+                            help='выводить планы целиком')
+        parser.add_argument('--strict', action='store_true',
+                            help='завершиться с ошибкой, если есть отметки')
+
+    def handle(self, *args, **options):
+        if connection.vendor not in PLANS:
+            raise CommandError(
+                f'EXPLAIN для {connection.vendor} не поддерживается')
+        if options['analyze'] and connection.vendor != 'postgresql':
+            self.stderr.write('ANALYZE доступен только в PostgreSQL')
+            options['analyze'] = False
+        self.tables = set(connection.introspection.table_names())
+        user = get_user()
+        if user is None:
+            raise CommandError('Нет данных: сначала выполните seed_scale')
+        jobs = self.get_jobs(user)
+        try:
+            cases = get_cases(user, allow_writes=True)
+        except ValueError as error:
+            raise CommandError(error)
+        if options['only']:
+            names = set(options['only'])
+            unknown = names - set(jobs) - {case.name for case in cases}
+            if unknown:
+                raise CommandError(
+                    f"Неизвестные имена: {', '.join(sorted(unknown))}")
+            cases = [case for case in cases if case.name in names]
+            jobs = {name: job for name, job in jobs.items() if name in names}
+
+        captured = {}
+        setup_test_environment()
+        try:
+            client = APIClient()
+            client.force_authenticate(user)
+            for case in cases:
+                # Запросы на запись меняют данные: изменения откатываются.
+                with transaction.atomic():
+                    # Первый запуск прогревает кеши процесса.
+                    run(client, case)
+                    capture = Capture()
+                    run(client, case, capture)
+                    transaction.set_rollback(True)
+                captured[case.name] = capture.statements
+        except ValueError as error:
+            raise CommandError(error)
+        finally:
+            teardown_test_environment()
+        for name, job in jobs.items():
+            capture = Capture()
+            # Фоновые задачи меняют данные: изменения откатываются.
+            with transaction.atomic(), connection.execute_wrapper(capture):
+                job()
+                transaction.set_rollback(True)
+            captured[name] = capture.statements
+
+        flagged = Counter()
+        for name, statements in captured.items():
+            self.stdout.write(self.style.MIGRATE_HEADING(name))
+            for sql, params in statements.values():
+                flagged.update(self.report(sql, params, options))
+        if not flagged:
+            self.stdout.write(self.style.SUCCESS('Замечаний нет'))
+            return
+        self.stdout.write(self.style.WARNING('Итого: ' + ', '.join(
+            f'{flag} - {count}' for flag, count in flagged.most_common())))
+        if options['strict']:
+            raise CommandError('Есть полные просмотры таблиц или сортировки')
+
+    def get_jobs(self, user):
+        """Запросы, которые выполняются вне HTTP-запросов на чтение."""
+        author = User.objects.order_by('-recipes_count', 'id').first()
+        ingredient = Ingredient.objects.order_by('id').first()
+        following = list(Follow.objects.filter(follower=user).values_list(
+            'following_id', flat=True))
+
+        def build_cook_index():
+            cook_index.invalidate()
+            cook_index.search([ingredient.id])
+
+        return {
+            'feed_fan_out': lambda: fan_out(
+                Recipe.objects.filter(author=author).order_by('-id')[:1]),
+            'feed_backfill': lambda: backfill(user.pk, following),
+            'shopping_list_refresh': lambda: refresh_shopping_list(
+                [user.pk]),
+            'follow_recount': lambda: recount_related(
+                Follow, following=[author.pk], follower=[user.pk]),
+            'cook_index_build': build_cook_index,
+        }
+
+    def explain(self, sql, params, analyze):
+        if connection.vendor == 'sqlite':
+            prefix = 'EXPLAIN QUERY PLAN '
+        elif analyze:
+            prefix = 'EXPLAIN (ANALYZE, BUFFERS) '
+        else:
+            prefix = 'EXPLAIN '
+        # ANALYZE выполняет запрос: изменения данных откатываются.
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute(prefix + sql, params)
+            rows = cursor.fetchall()
+            transaction.set_rollback(True)
+        if connection.vendor == 'sqlite':
+            return [detail for *_, detail in rows]
+        return [line for line, in rows]
+
+    def report(self, sql, params, options):
+        """Выводит отметки плана запроса sql и возвращает их."""
+        plan = self.explain(sql, params, options['analyze'])
+        patterns = PLANS[connection.vendor]
+        flags = []
+        for line in plan:
+            match = patterns['scan'].search(line)
+            # В SQLite SCAN бывает и по подзапросам.
+            if (match and match.group(1) in self.tables
+                    and match.group(1) not in SMALL_TABLES):
+                flags.append(f'scan {match.group(1)}')
+            if patterns['sort'].search(line):
+                flags.append('sort')
+        summary = ' '.join(normalize_sql(sql).split())
+        if len(summary) > 160:
+            summary = summary[:157] + '...'
+        if flags:
+            self.stdout.write(self.style.WARNING(
+                f"  [{', '.join(flags)}] {summary}"))
+        else:
+            self.stdout.write(f'  [ok] {summary}')
+        if options['plans'] or flags:
+            for line in plan:
+                self.stdout.write(f'      {line}')
+        return flags
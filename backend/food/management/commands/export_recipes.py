@@ -0,0 +1,31 @@
+from pathlib import Path
+
+from django.core.management.base import BaseCommand
+
+from api.bulk_recipes import export_lines
+from food.models import Recipe
+
+
+class Command(BaseCommand):
+    help = 'Выгружает рецепты в NDJSON (рецепт на строку)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--path', type=str,
+                            help='по умолчанию - стандартный вывод')
+        parser.add_argument('--author', type=str,
+                            help='только рецепты этого пользователя')
+        parser.add_argument('--embed-images', action='store_true',
+                            help='встроить изображения в base64, чтобы '
+                                 'файл можно было загрузить import_recipes')
+
+    def handle(self, *args, **options):
+        queryset = Recipe.objects.order_by('id')
+        if options['author']:
+            queryset = queryset.filter(author__username=options['author'])
+        lines = export_lines(queryset, embed_images=options['embed_images'])
+        if not options['path']:
+            for line in lines:
+                self.stdout.write(line, ending='')
+            return
+        with Path(options['path']).open('w', encoding='utf-8') as f:
+            f.writelines(lines)
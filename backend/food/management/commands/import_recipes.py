@@ -0,0 +1,38 @@
+import time
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+
+from api.bulk_recipes import RecipeImporter
+from api.parsers import iter_lines, upload_max_size
+from food.models import User
+
+
+class Command(BaseCommand):
+    help = 'Загружает рецепты из NDJSON (рецепт на строку)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--path', type=str, required=True)
+        parser.add_argument('--author', type=str, required=True,
+                            help='имя пользователя - автора рецептов')
+        parser.add_argument('--batch-size', type=int,
+                            help='рецептов в одной транзакции')
+
+    def handle(self, *args, **options):
+        author = User.objects.filter(username=options['author']).first()
+        if author is None:
+            raise CommandError(
+                f"Пользователь {options['author']} не найден")
+        started = time.perf_counter()
+        with Path(options['path']).open('rb') as f:
+            report = RecipeImporter(author, options['batch_size']).run(
+                iter_lines(f, upload_max_size()))
+        for error in report['errors']:
+            self.stdout.write(self.style.ERROR(
+                f"Строка {error['line']}: {error['errors']}"))
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(
+            f"Создано: {report['created']}, "
+            f"с ошибками: {report['failed']}. "
+            f"{elapsed:.2f} с ({report['created'] / elapsed:.0f} "
+            f"рецептов/с)"))
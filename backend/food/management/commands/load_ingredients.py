@@ -1,52 +1,158 @@
+import csv
 import json
+import time
+from itertools import islice
 from pathlib import Path
 
-from django.core.management.base import BaseCommand
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
 
+from api.shopping_list import invalidate_shopping_lists
+from food.catalog import bump_catalog_version
+from food.models import LENGT_MEASUREMENT_UNIT, LENGTH_NAME
 from food.models import Ingredient as Ing
 
+CHUNK_SIZE = 64 * 1024
+
+
+def iter_json_array(file):
+    """
+    Поэлементно читает JSON-массив, не загружая файл в память целиком.
+    """
+    decoder = json.JSONDecoder()
+    buffer = file.read(CHUNK_SIZE).lstrip()
+    if not buffer.startswith('['):
+        raise CommandError('JSON не является массивом')
+    buffer = buffer[1:]
+    eof = False
+    while True:
+        buffer = buffer.lstrip().lstrip(',').lstrip()
+        if buffer.startswith(']'):
+            return
+        try:
+            item, end = decoder.raw_decode(buffer)
+        except json.JSONDecodeError:
+            if eof:
+                raise CommandError('Некорректный JSON')
+            chunk = file.read(CHUNK_SIZE)
+            eof = not chunk
+            buffer += chunk
+            continue
+        yield item
+        buffer = buffer[end:]
+
+
+def iter_csv(file):
+    """Строки CSV вида name,measurement_unit (заголовок необязателен)."""
+    for row in csv.reader(file):
+        if not row or row[0].strip().lower() == 'name':
+            continue
+        yield {'name': row[0],
+               'measurement_unit': row[1] if len(row) > 1 else ''}
+
+
+def normalize(item):
+    """
+    Приводит элемент к виду (name, measurement_unit). Поддерживаются
+    плоский формат и формат фикстур Django с полем fields.
+    """
+    if not isinstance(item, dict):
+        raise ValueError('элемент не является объектом')
+    fields = item.get('fields', item)
+    unit = fields.get('measurement_unit', fields.get('unit_of_measurement'))
+    name = (fields.get('name') or '').strip()
+    unit = (unit or '').strip()
+    if len(name) > LENGTH_NAME or len(unit) > LENGT_MEASUREMENT_UNIT:
+        raise ValueError('слишком длинное значение')
+    return name, unit
+
 
 class Command(BaseCommand):
-    help = 'Загружает ингредиенты из JSON'
+    help = 'Загружает ингредиенты из JSON (плоского или фикстуры) или CSV'
 
     def add_arguments(self, parser):
         parser.add_argument('--path', type=str,
                             default='data/ingredients.json')
+        parser.add_argument('--format', choices=['json', 'csv'],
+                            help='по умолчанию определяется по расширению')
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--dry-run', action='store_true',
+                            help='показать изменения, не записывая их')
 
     def handle(self, *args, **options):
         file_path = Path(options['path'])
-        created = 0
-        updated = 0
-        skipped = 0
-
-        with file_path.open('r', encoding='utf-8') as f:
-            data = json.load(f)
-
-        if isinstance(data, list):
-            for row_num, item in enumerate(data, start=1):
-                try:
-                    name = item.get('name', '').strip()
-                    unit = item.get('measurement_unit', '').strip()
-
-                    if name:
-                        ingredient, created_new = Ing.objects.get_or_create(
-                            name=name,
-                            defaults={'measurement_unit': unit}
-                        )
-                        if created_new:
-                            created += 1
-                        else:
-                            ingredient.measurement_unit = unit
-                            ingredient.save()
-                            updated += 1
-                    else:
-                        skipped += 1
-                except Exception as e:
-                    self.stdout.write(self.style.ERROR(
-                        f'Элемент {row_num}: {e}'))
-                    skipped += 1
-        else:
-            self.stdout.write(self.style.ERROR('JSON не является массивом'))
+        file_format = options['format'] or (
+            'csv' if file_path.suffix.lower() == '.csv' else 'json')
+        reader = iter_csv if file_format == 'csv' else iter_json_array
+        self.dry_run = options['dry_run']
+        self.created = self.updated = self.unchanged = self.skipped = 0
+        started = time.perf_counter()
+
+        with file_path.open('r', encoding='utf-8', newline='') as f:
+            rows = self.normalized(reader(f))
+            with transaction.atomic():
+                while True:
+                    batch = dict(islice(rows, options['batch_size']))
+                    if not batch:
+                        break
+                    self.load_batch(batch)
+        if (self.created or self.updated) and not self.dry_run:
+            # bulk_create не отправляет сигналы post_save.
+            bump_catalog_version(Ing)
+        if self.updated and not self.dry_run:
+            # Единицы измерения есть в уже собранных списках покупок.
+            invalidate_shopping_lists()
 
+        elapsed = time.perf_counter() - started
+        total = self.created + self.updated + self.unchanged + self.skipped
+        prefix = 'Без записи (--dry-run). ' if self.dry_run else ''
         self.stdout.write(self.style.SUCCESS(
-            f'Создано: {created}, обновлено: {updated}, пропущено: {skipped}'))
+            f'{prefix}Создано: {self.created}, обновлено: {self.updated}, '
+            f'без изменений: {self.unchanged}, '
+            f'пропущено: {self.skipped}. '
+            f'{total} строк за {elapsed:.2f} с '
+            f'({total / elapsed if elapsed else 0:.0f} строк/с)'))
+
+    def normalized(self, items):
+        for row_num, item in enumerate(items, start=1):
+            try:
+                name, unit = normalize(item)
+            except (AttributeError, ValueError) as e:
+                self.stdout.write(self.style.ERROR(
+                    f'Элемент {row_num}: {e}'))
+                self.skipped += 1
+                continue
+            if not name:
+                self.skipped += 1
+                continue
+            yield name, unit
+
+    def load_batch(self, batch):
+        """
+        Записывает пачку {name: measurement_unit} одним upsert,
+        пропуская ингредиенты, которые не изменились.
+        """
+        existing = dict(Ing.objects.filter(
+            name__in=batch).values_list('name', 'measurement_unit'))
+        changed = []
+        for name, unit in batch.items():
+            if name not in existing:
+                self.created += 1
+                if self.dry_run:
+                    self.stdout.write(f'+ {name} ({unit})')
+            elif existing[name] != unit:
+                self.updated += 1
+                if self.dry_run:
+                    self.stdout.write(
+                        f'~ {name} ({existing[name]} -> {unit})')
+            else:
+                self.unchanged += 1
+                continue
+            changed.append(Ing(name=name, measurement_unit=unit))
+        if changed and not self.dry_run:
+            Ing.objects.bulk_create(
+                changed,
+                update_conflicts=True,
+                unique_fields=['name'],
+                update_fields=['measurement_unit'],
+            )
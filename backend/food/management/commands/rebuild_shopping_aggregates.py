@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from food.aggregates import refresh_shopping_list
+from food.models import ShoppingCart, ShoppingListItem, User
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает агрегированные списки покупок'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', type=int, action='append',
+                            help='id пользователя (можно указать несколько)')
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        user_ids = options['user']
+        if user_ids is None:
+            user_ids = User.objects.filter(
+                shopping_cart__isnull=False
+            ).distinct().order_by('id').values_list('id', flat=True)
+        user_ids = list(user_ids)
+        batch_size = options['batch_size']
+        with transaction.atomic():
+            orphans = ShoppingListItem.objects.exclude(
+                user__in=ShoppingCart.objects.values('user'))
+            if options['user'] is not None:
+                orphans = orphans.filter(user__in=user_ids)
+            removed, _ = orphans.delete()
+            for start in range(0, len(user_ids), batch_size):
+                refresh_shopping_list(user_ids[start:start + batch_size])
+        self.stdout.write(self.style.SUCCESS(
+            f'Пересчитано пользователей: {len(user_ids)}, '
+            f'удалено лишних позиций: {removed}'))
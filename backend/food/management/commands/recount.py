@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+
+from food.aggregates import recount_counters
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает счетчики избранного, подписок и рецептов'
+
+    def handle(self, *args, **options):
+        for name, fixed in recount_counters().items():
+            self.stdout.write(self.style.SUCCESS(
+                f'{name}: исправлено {fixed}'))
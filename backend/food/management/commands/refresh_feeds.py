@@ -0,0 +1,32 @@
+from itertools import groupby
+from operator import itemgetter
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from food.feed import backfill, trim
+from food.models import FeedItem, Follow
+
+
+class Command(BaseCommand):
+    help = 'Заполняет ленты подписок по текущим подпискам и обрезает их'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--backfill', action='store_true',
+                            help='добавить в ленты последние рецепты '
+                                 'всех авторов из подписок')
+        parser.add_argument('--max-length', type=int,
+                            default=settings.FEED_MAX_LENGTH,
+                            help='сколько рецептов оставить в ленте')
+
+    def handle(self, *args, **options):
+        if options['backfill']:
+            before = FeedItem.objects.count()
+            follows = Follow.objects.order_by('follower').values_list(
+                'follower_id', 'following_id').iterator()
+            for follower_id, pairs in groupby(follows, itemgetter(0)):
+                backfill(follower_id, [author_id for _, author_id in pairs])
+            self.stdout.write(self.style.SUCCESS(
+                f'Добавлено в ленты: {FeedItem.objects.count() - before}'))
+        self.stdout.write(self.style.SUCCESS(
+            f"Удалено из лент: {trim(options['max_length'])}"))
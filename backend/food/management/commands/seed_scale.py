@@ -0,0 +1,283 @@
+import csv
+import io
+import json
+import random
+import time
+from datetime import datetime, timezone
+from itertools import accumulate
+
+from django.contrib.auth.hashers import make_password
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.core.management.color import no_style
+from django.db import connection, transaction
+from django.db.models import Max
+from PIL import Image
+
+from food.aggregates import recount_counters, tags_mask
+from food.models import (Favorite, Follow, Ingredient, Recipe,
+                         RecipeIngredient, ShoppingCart, Tag, User)
+
+# Среднее на пользователя для подписок, избранного и списка покупок.
+PROFILES = {
+    'small': {'users': 1_000, 'recipes': 5_000,
+              'follows': 10, 'favorites': 15, 'cart': 3},
+    'medium': {'users': 20_000, 'recipes': 100_000,
+               'follows': 10, 'favorites': 15, 'cart': 3},
+    'prod-like': {'users': 200_000, 'recipes': 1_000_000,
+                  'follows': 10, 'favorites': 15, 'cart': 3},
+}
+TAGS = [('Завтрак', 'breakfast'), ('Обед', 'lunch'), ('Ужин', 'dinner'),
+        ('Десерт', 'dessert'), ('Выпечка', 'baking'), ('Супы', 'soups'),
+        ('Салаты', 'salads'), ('Вегетарианское', 'vegetarian')]
+DISHES = ['Суп', 'Салат', 'Пирог', 'Каша', 'Рагу', 'Запеканка', 'Омлет',
+          'Паста', 'Плов', 'Блины', 'Котлеты', 'Жаркое', 'Торт', 'Соус']
+STYLES = ['домашний', 'быстрый', 'летний', 'пряный', 'сливочный',
+          'овощной', 'праздничный', 'бабушкин', 'легкий', 'острый']
+WORDS = ('нарезать смешать обжарить добавить посолить варить запекать '
+         'подавать остудить взбить тесто соус масло огонь минут').split()
+IMAGE_NAME = 'recipes/seed.png'
+
+
+def zipf_cum_weights(size, exponent):
+    """Накопленные веса закона Ципфа: элемент с рангом r ~ 1 / r^s."""
+    return list(accumulate(1 / rank ** exponent
+                           for rank in range(1, size + 1)))
+
+
+class RowWriter:
+    """
+    Пачками записывает строки таблицы model: COPY в PostgreSQL,
+    bulk_create в остальных СУБД. fields - имена атрибутов (user_id).
+    """
+
+    def __init__(self, model, fields, batch_size):
+        self.model = model
+        self.fields = fields
+        self.batch_size = batch_size
+        self.rows = []
+        self.written = 0
+        self.copy = connection.vendor == 'postgresql'
+
+    def add(self, *row):
+        self.rows.append(row)
+        if len(self.rows) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if not self.rows:
+            return
+        if self.copy:
+            self._copy()
+        else:
+            self.model.objects.bulk_create(
+                [self.model(**dict(zip(self.fields, row)))
+                 for row in self.rows],
+                batch_size=self.batch_size)
+        self.written += len(self.rows)
+        self.rows = []
+
+    def _copy(self):
+        opts = self.model._meta
+        columns = ', '.join(
+            connection.ops.quote_name(opts.get_field(
+                name[:-3] if name.endswith('_id') else name).column)
+            for name in self.fields)
+        data = io.StringIO()
+        csv.writer(data).writerows(
+            [json.dumps(value) if isinstance(value, dict) else value
+             for value in row]
+            for row in self.rows)
+        data.seek(0)
+        sql = (f'COPY {connection.ops.quote_name(opts.db_table)} '
+               f'({columns}) FROM STDIN WITH (FORMAT csv)')
+        with connection.cursor() as cursor:
+            if hasattr(cursor, 'copy_expert'):
+                cursor.copy_expert(sql, data)
+            else:
+                with cursor.copy(sql) as copy:
+                    copy.write(data.getvalue())
+
+
+class Command(BaseCommand):
+    help = ('Создает синтетических пользователей, рецепты, подписки, '
+            'избранное и списки покупок для нагрузочных проверок')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--profile', choices=PROFILES, default='small')
+        parser.add_argument('--users', type=int,
+                            help='переопределить размер профиля')
+        parser.add_argument('--recipes', type=int,
+                            help='переопределить размер профиля')
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--batch-size', type=int, default=5000)
+
+    def handle(self, *args, **options):
+        profile = dict(PROFILES[options['profile']])
+        for key in ('users', 'recipes'):
+            if options[key]:
+                profile[key] = options[key]
+        self.seed = options['seed']
+        self.rng = random.Random(self.seed)
+        self.batch_size = options['batch_size']
+        started = time.perf_counter()
+
+        tag_ids = self.ensure_tags()
+        ingredient_ids = self.ensure_ingredients()
+        user_ids = self.create_users(profile['users'])
+        # Пользователи упорядочены по «популярности»: первые чаще
+        # публикуют рецепты и собирают больше подписчиков.
+        user_weights = zipf_cum_weights(len(user_ids), 1.1)
+        authors = self.create_recipes(
+            profile['recipes'], user_ids, user_weights, tag_ids,
+            ingredient_ids)
+        recipe_ids = list(authors)
+        self.create_pairs(
+            Follow, ('follower_id', 'following_id'), user_ids,
+            user_ids, user_weights, profile['follows'],
+            exclude=lambda user_id, target_id: user_id == target_id)
+        # Чем раньше рецепт в случайном порядке, тем он популярнее.
+        popular = recipe_ids[:]
+        self.rng.shuffle(popular)
+        recipe_weights = zipf_cum_weights(len(popular), 1.0)
+        self.create_pairs(Favorite, ('user_id', 'recipe_id'), user_ids,
+                          popular, recipe_weights, profile['favorites'])
+        self.create_pairs(ShoppingCart, ('user_id', 'recipe_id'), user_ids,
+                          popular, recipe_weights, profile['cart'])
+
+        with connection.cursor() as cursor:
+            for sql in connection.ops.sequence_reset_sql(
+                    no_style(), [User, Recipe, RecipeIngredient, Follow,
+                                 Favorite, ShoppingCart]):
+                cursor.execute(sql)
+        self.stdout.write('Пересчет счетчиков и списков покупок...')
+        recount_counters()
+        call_command('rebuild_shopping_aggregates', stdout=self.stdout)
+        self.stdout.write(self.style.SUCCESS(
+            f'Готово за {time.perf_counter() - started:.0f} с. '
+            f'Ленты подписок заполняет refresh_feeds --backfill.'))
+
+    def report(self, started, *writers):
+        elapsed = time.perf_counter() - started
+        rows = sum(writer.written for writer in writers)
+        counts = ', '.join(
+            f'{writer.model._meta.verbose_name_plural}: {writer.written}'
+            for writer in writers)
+        self.stdout.write(
+            f'{counts} за {elapsed:.1f} с ({rows / elapsed:.0f} строк/с)')
+
+    def next_id(self, model):
+        return (model.objects.aggregate(last=Max('id'))['last'] or 0) + 1
+
+    def ensure_tags(self):
+        for name, slug in TAGS:
+            Tag.objects.get_or_create(slug=slug, defaults={'name': name})
+        return list(Tag.objects.order_by('id').values_list('id', flat=True))
+
+    def ensure_ingredients(self):
+        if not Ingredient.objects.exists():
+            # Отдельный генератор: остальные данные не зависят от того,
+            # были ли ингредиенты в базе.
+            rng = random.Random(self.seed)
+            Ingredient.objects.bulk_create(
+                Ingredient(name=f'Ингредиент {number}',
+                           measurement_unit=rng.choice(
+                               ['г', 'мл', 'шт', 'ст. л.']))
+                for number in range(1, 2001))
+        return list(Ingredient.objects.order_by('id').values_list(
+            'id', flat=True))
+
+    @transaction.atomic
+    def create_users(self, count):
+        started = time.perf_counter()
+        first = self.next_id(User)
+        password = make_password('seed-password')
+        writer = RowWriter(
+            User, ('id', 'username', 'email', 'password', 'first_name',
+                   'last_name', 'is_superuser', 'is_staff', 'is_active',
+                   'date_joined', 'avatar_variants', 'recipes_count',
+                   'followers_count', 'following_count'),
+            self.batch_size)
+        joined = datetime(2024, 1, 1, tzinfo=timezone.utc)
+        for user_id in range(first, first + count):
+            writer.add(user_id, f'seed{user_id}', f'seed{user_id}@example.com',
+                       password, 'Тест', f'Пользователь {user_id}', False,
+                       False, True, joined, {}, 0, 0, 0)
+        writer.flush()
+        self.report(started, writer)
+        return list(range(first, first + count))
+
+    @transaction.atomic
+    def create_recipes(self, count, user_ids, user_weights, tag_ids,
+                       ingredient_ids):
+        started = time.perf_counter()
+        if not default_storage.exists(IMAGE_NAME):
+            image = io.BytesIO()
+            Image.new('RGB', (640, 480), (230, 180, 120)).save(image, 'PNG')
+            default_storage.save(IMAGE_NAME, ContentFile(image.getvalue()))
+        first = self.next_id(Recipe)
+        recipes = RowWriter(
+            Recipe, ('id', 'name', 'title', 'author_id', 'image',
+                     'image_variants', 'text', 'cooking_time', 'tags_mask',
+                     'favorites_count', 'in_carts_count',
+                     'short_link_clicks'),
+            self.batch_size)
+        tags = RowWriter(Recipe.tags.through, ('recipe_id', 'tag_id'),
+                         self.batch_size)
+        ingredients = RowWriter(
+            RecipeIngredient, ('recipe_id', 'ingredient_id', 'quantity',
+                               'unit'),
+            self.batch_size)
+        rng = self.rng
+        tag_weights = zipf_cum_weights(len(tag_ids), 0.8)
+        ingredient_weights = zipf_cum_weights(len(ingredient_ids), 1.0)
+        authors = {}
+        for recipe_id in range(first, first + count):
+            author_id = rng.choices(user_ids, cum_weights=user_weights)[0]
+            authors[recipe_id] = author_id
+            recipe_tags = set(rng.choices(
+                tag_ids, cum_weights=tag_weights, k=rng.randint(1, 3)))
+            name = (f'{rng.choice(DISHES)} {rng.choice(STYLES)} '
+                    f'№{recipe_id}')
+            text = ' '.join(rng.choices(WORDS, k=rng.randint(20, 120)))
+            cooking_time = min(int(rng.lognormvariate(3.4, 0.6)) + 1, 600)
+            recipes.add(recipe_id, name, name, author_id, IMAGE_NAME, {},
+                        text, cooking_time, tags_mask(recipe_tags), 0, 0, 0)
+            for tag_id in recipe_tags:
+                tags.add(recipe_id, tag_id)
+            size = min(max(int(rng.gauss(7, 3)), 1), 25)
+            for ingredient_id in set(rng.choices(
+                    ingredient_ids, cum_weights=ingredient_weights,
+                    k=size)):
+                ingredients.add(recipe_id, ingredient_id,
+                                rng.randint(1, 50) * 10, 'г')
+            # Строки рецептов должны попасть в базу раньше связанных.
+            if len(recipes.rows) + 1 >= recipes.batch_size:
+                recipes.flush()
+        for writer in (recipes, tags, ingredients):
+            writer.flush()
+        self.report(started, recipes, tags, ingredients)
+        return authors
+
+    @transaction.atomic
+    def create_pairs(self, model, fields, user_ids, targets, cum_weights,
+                     average, exclude=None):
+        """
+        Для каждого пользователя - случайное число (в среднем average,
+        распределение Парето) различных объектов из targets с весами.
+        """
+        started = time.perf_counter()
+        writer = RowWriter(model, fields, self.batch_size)
+        rng = self.rng
+        limit = len(targets) // 2
+        for user_id in user_ids:
+            size = min(int(average / 2 * rng.paretovariate(2)), limit)
+            chosen = set(rng.choices(targets, cum_weights=cum_weights,
+                                     k=size))
+            for target_id in sorted(chosen):
+                if exclude is None or not exclude(user_id, target_id):
+                    writer.add(user_id, target_id)
+        writer.flush()
+        self.report(started, writer)
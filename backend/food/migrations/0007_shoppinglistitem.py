@@ -0,0 +1,52 @@
+# Generated by Django 5.2.10 on 2026-10-18 03:06
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, Sum
+
+
+def fill_shopping_list_items(apps, schema_editor):
+    RecipeIngredient = apps.get_model('food', 'RecipeIngredient')
+    ShoppingListItem = apps.get_model('food', 'ShoppingListItem')
+    totals = RecipeIngredient.objects.filter(
+        recipe__in_shopping_cart__isnull=False
+    ).values_list(
+        'recipe__in_shopping_cart__user', 'ingredient'
+    ).annotate(
+        total_amount=Sum('quantity'), recipe_count=Count('id')
+    ).order_by()
+    ShoppingListItem.objects.bulk_create(
+        (ShoppingListItem(user_id=user_id, ingredient_id=ingredient_id,
+                          total_amount=total_amount,
+                          recipe_count=recipe_count)
+         for user_id, ingredient_id, total_amount, recipe_count in totals),
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('food', '0006_alter_user_first_name_alter_user_last_name_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ShoppingListItem',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('total_amount', models.FloatField(default=0, verbose_name='Общее количество')),
+                ('recipe_count', models.PositiveIntegerField(default=0, verbose_name='Количество рецептов')),
+                ('ingredient', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='shopping_list_items', to='food.ingredient', verbose_name='Ингредиент')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='shopping_list_items', to=settings.AUTH_USER_MODEL, verbose_name='Пользователь')),
+            ],
+            options={
+                'verbose_name': 'Позиция списка покупок',
+                'verbose_name_plural': 'Позиции списков покупок',
+                'unique_together': {('user', 'ingredient')},
+            },
+        ),
+        migrations.RunPython(
+            fill_shopping_list_items, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.10 on 2026-10-18 03:07
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('food', '0007_shoppinglistitem'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='ingredient',
+            name='name',
+            field=models.CharField(max_length=256, unique=True, verbose_name='Название ингредиента'),
+        ),
+    ]
@@ -0,0 +1,84 @@
+from django.db import migrations
+
+POSTGRESQL_FORWARD = [
+    """
+    ALTER TABLE food_recipe ADD COLUMN search_vector tsvector
+    GENERATED ALWAYS AS (
+        setweight(to_tsvector('russian', coalesce(name, '')), 'A')
+        || setweight(to_tsvector('russian', coalesce(text, '')), 'B')
+    ) STORED
+    """,
+    """
+    CREATE INDEX food_recipe_search_vector_idx
+    ON food_recipe USING GIN (search_vector)
+    """,
+]
+POSTGRESQL_BACKWARD = [
+    'DROP INDEX IF EXISTS food_recipe_search_vector_idx',
+    'ALTER TABLE food_recipe DROP COLUMN IF EXISTS search_vector',
+]
+SQLITE_FORWARD = [
+    """
+    CREATE VIRTUAL TABLE food_recipe_fts USING fts5(
+        name, text, content='food_recipe', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2'
+    )
+    """,
+    """
+    CREATE TRIGGER food_recipe_fts_insert AFTER INSERT ON food_recipe BEGIN
+        INSERT INTO food_recipe_fts(rowid, name, text)
+        VALUES (new.id, new.name, new.text);
+    END
+    """,
+    """
+    CREATE TRIGGER food_recipe_fts_delete AFTER DELETE ON food_recipe BEGIN
+        INSERT INTO food_recipe_fts(food_recipe_fts, rowid, name, text)
+        VALUES ('delete', old.id, old.name, old.text);
+    END
+    """,
+    """
+    CREATE TRIGGER food_recipe_fts_update AFTER UPDATE OF name, text
+    ON food_recipe BEGIN
+        INSERT INTO food_recipe_fts(food_recipe_fts, rowid, name, text)
+        VALUES ('delete', old.id, old.name, old.text);
+        INSERT INTO food_recipe_fts(rowid, name, text)
+        VALUES (new.id, new.name, new.text);
+    END
+    """,
+    "INSERT INTO food_recipe_fts(food_recipe_fts) VALUES ('rebuild')",
+]
+SQLITE_BACKWARD = [
+    'DROP TRIGGER IF EXISTS food_recipe_fts_insert',
+    'DROP TRIGGER IF EXISTS food_recipe_fts_delete',
+    'DROP TRIGGER IF EXISTS food_recipe_fts_update',
+    'DROP TABLE IF EXISTS food_recipe_fts',
+]
+
+
+def run_for_vendor(statements):
+    def run(apps, schema_editor):
+        for statement in statements.get(
+                schema_editor.connection.vendor, []):
+            schema_editor.execute(statement)
+    return run
+
+
+class Migration(migrations.Migration):
+    """
+    Полнотекстовый поиск по рецептам: генерируемый столбец tsvector
+    с GIN-индексом в PostgreSQL и внешняя таблица FTS5 с триггерами
+    в SQLite. Столбцы не описаны в модели, запросы - в api/search.py.
+    """
+
+    dependencies = [
+        ('food', '0011_short_link_clicks'),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            run_for_vendor({'postgresql': POSTGRESQL_FORWARD,
+                            'sqlite': SQLITE_FORWARD}),
+            run_for_vendor({'postgresql': POSTGRESQL_BACKWARD,
+                            'sqlite': SQLITE_BACKWARD}),
+        ),
+    ]
@@ -0,0 +1,46 @@
+# Generated by Django 5.2.10 on 2026-10-18 03:19
+
+from importlib import import_module
+
+from django.db import migrations, models
+from django.db.models import F
+
+TAGS_MASK_BITS = 63
+
+
+def fill_tags_mask(apps, schema_editor):
+    Recipe = apps.get_model('food', 'Recipe')
+    Tag = apps.get_model('food', 'Tag')
+    for tag_id in Tag.objects.filter(
+            id__lte=TAGS_MASK_BITS).values_list('id', flat=True):
+        Recipe.objects.filter(tags=tag_id).update(
+            tags_mask=F('tags_mask').bitor(1 << (tag_id - 1)))
+
+
+def restore_sqlite_search(apps, schema_editor):
+    # SQLite пересоздает food_recipe при добавлении столбца,
+    # триггеры полнотекстового поиска из 0012 при этом теряются.
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    search = import_module('food.migrations.0012_recipe_search')
+    drop_triggers = search.SQLITE_BACKWARD[:3]
+    for statement in drop_triggers + search.SQLITE_FORWARD[1:]:
+        schema_editor.execute(statement)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('food', '0012_recipe_search'),
+    ]
+
+    operations = [
+        migrations.RunPython(migrations.RunPython.noop, restore_sqlite_search),
+        migrations.AddField(
+            model_name='recipe',
+            name='tags_mask',
+            field=models.BigIntegerField(default=0, editable=False, verbose_name='Битовая маска тегов'),
+        ),
+        migrations.RunPython(restore_sqlite_search, migrations.RunPython.noop),
+        migrations.RunPython(fill_tags_mask, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,45 @@
+from importlib import import_module
+
+from django.db import migrations
+
+run_for_vendor = import_module(
+    'food.migrations.0012_recipe_search').run_for_vendor
+
+POSTGRESQL_FORWARD = [
+    """
+    CREATE OR REPLACE FUNCTION food_tags_bits(mask bigint)
+    RETURNS integer[] LANGUAGE sql IMMUTABLE PARALLEL SAFE AS $$
+        SELECT coalesce(array_agg(position), '{}')
+        FROM generate_series(0, 62) AS position
+        WHERE mask & (1::bigint << position) <> 0
+    $$
+    """,
+    """
+    CREATE INDEX food_recipe_tags_bits_idx
+    ON food_recipe USING GIN (food_tags_bits(tags_mask))
+    """,
+]
+POSTGRESQL_BACKWARD = [
+    'DROP INDEX IF EXISTS food_recipe_tags_bits_idx',
+    'DROP FUNCTION IF EXISTS food_tags_bits(bigint)',
+]
+
+
+class Migration(migrations.Migration):
+    """
+    GIN-индекс для фильтра по тегам в PostgreSQL: номера установленных
+    битов Recipe.tags_mask как массив, условия && (любой из тегов)
+    и @> (все теги) - см. api.filters.tags_mask_condition. В SQLite
+    подходящего индекса нет.
+    """
+
+    dependencies = [
+        ('food', '0016_recipe_search_document'),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            run_for_vendor({'postgresql': POSTGRESQL_FORWARD}),
+            run_for_vendor({'postgresql': POSTGRESQL_BACKWARD}),
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 5.2.10 on 2026-10-18 05:08
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('food', '0017_tags_bits_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ChangeSequence',
+            fields=[
+                ('model', models.CharField(max_length=256, primary_key=True, serialize=False, verbose_name='Модель')),
+                ('number', models.BigIntegerField(verbose_name='Номер изменения')),
+            ],
+            options={
+                'verbose_name': 'Счетчик журнала изменений',
+                'verbose_name_plural': 'Счетчики журнала изменений',
+            },
+        ),
+    ]
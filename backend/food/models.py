@@ -7,23 +7,26 @@ LENGTH_UNIT = 20
 LENGTH_TAG = 32
 LENGTH_TITLE = 200
 LENGT_MEASUREMENT_UNIT = 50
+# Тегам с id до TAGS_MASK_BITS соответствует бит id - 1 в Recipe.tags_mask.
+TAGS_MASK_BITS = 63
 
 
 class User(AbstractUser):
     email = models.EmailField(unique=True, verbose_name='Электронная почта')
     avatar = models.ImageField(
         upload_to='avatars/', null=True, blank=True, verbose_name='Аватар')
+    avatar_variants = models.JSONField(
+        'Уменьшенные копии аватара', default=dict, blank=True,
+        editable=False)
+    recipes_count = models.PositiveIntegerField(
+        'Количество рецептов', default=0, editable=False)
+    followers_count = models.PositiveIntegerField(
+        'Количество подписчиков', default=0, editable=False)
+    following_count = models.PositiveIntegerField(
+        'Количество подписок', default=0, editable=False)
     USERNAME_FIELD = 'email'
     REQUIRED_FIELDS = ['username']
 
-    @property
-    def following_count(self):
-        return self.following.count()
-
-    @property
-    def followers_count(self):
-        return self.followers.count()
-
     def __str__(self):
         return self.username
 
@@ -45,13 +48,20 @@ class Ingredient(models.Model):
 class Follow(models.Model):
     follower = models.ForeignKey(
         User, related_name='following', on_delete=models.CASCADE,
-        verbose_name='Подписчик')
+        db_index=False, verbose_name='Подписчик')
     following = models.ForeignKey(
         User, related_name='followers', on_delete=models.CASCADE,
-        verbose_name='Автор')
+        db_index=False, verbose_name='Автор')
 
     class Meta:
+        # Подписки пользователя читаются по индексу ограничения,
+        # подписчики автора (рассылка по лентам) - по following_idx
+        # без обращения к таблице.
         unique_together = ('follower', 'following')
+        indexes = [
+            models.Index(fields=['following', 'follower'],
+                         name='follow_following_idx'),
+        ]
         verbose_name = 'Подписка'
         verbose_name_plural = 'Подписки'
 
@@ -73,6 +83,11 @@ class Tag(models.Model):
     def __str__(self):
         return self.name
 
+    @property
+    def bit(self):
+        """Бит тега в Recipe.tags_mask (0, если битов не хватило)."""
+        return 1 << (self.pk - 1) if self.pk <= TAGS_MASK_BITS else 0
+
 
 class Recipe(models.Model):
     name = models.CharField(max_length=LENGTH_NAME,
@@ -82,6 +97,9 @@ class Recipe(models.Model):
         verbose_name='Автор')
     title = models.CharField(max_length=LENGTH_TITLE, verbose_name='Название')
     image = models.ImageField(upload_to='recipes/', verbose_name='Изображение')
+    image_variants = models.JSONField(
+        'Уменьшенные копии изображения', default=dict, blank=True,
+        editable=False)
     text = models.TextField('Описание')
     ingredients = models.ManyToManyField(
         Ingredient,
@@ -92,34 +110,73 @@ class Recipe(models.Model):
 
     )
     tags = models.ManyToManyField(Tag, verbose_name='Теги')
+    tags_mask = models.BigIntegerField(
+        'Битовая маска тегов', default=0, editable=False)
     cooking_time = models.PositiveSmallIntegerField(
         verbose_name='Время приготовления (мин)',
         validators=[MinValueValidator(
             1, message="Время приготовления должно быть не менее 1 минуты.")]
     )
+    favorites_count = models.PositiveIntegerField(
+        'В избранном', default=0, editable=False)
+    in_carts_count = models.PositiveIntegerField(
+        'В списках покупок', default=0, editable=False)
+    short_link_clicks = models.PositiveBigIntegerField(
+        'Переходы по короткой ссылке', default=0, editable=False)
 
     class Meta:
         verbose_name = 'Рецепт'
         verbose_name_plural = 'Рецепты'
         ordering = ['-id']
+        indexes = [
+            models.Index(fields=['-favorites_count', '-id'],
+                         name='recipe_favorites_count_idx'),
+            models.Index(fields=['-in_carts_count', '-id'],
+                         name='recipe_in_carts_count_idx'),
+            models.Index(fields=['author', '-id'],
+                         name='recipe_author_id_idx'),
+        ]
 
     def __str__(self):
         return self.name
 
 
+class RecipeSearchDocument(models.Model):
+    """
+    Строка таблицы FTS5 food_recipe_fts (только SQLite, см. миграцию
+    0012_recipe_search). Модель нужна поиску, чтобы соединить рецепты
+    с полнотекстовым индексом одним JOIN (api/search.py).
+    """
+    recipe = models.OneToOneField(
+        Recipe, primary_key=True, db_column='rowid', db_constraint=False,
+        on_delete=models.DO_NOTHING, related_name='search_document')
+
+    class Meta:
+        managed = False
+        db_table = 'food_recipe_fts'
+
+
 class RecipeIngredient(models.Model):
     recipe = models.ForeignKey(
         'Recipe', on_delete=models.CASCADE, related_name='recipe_ingredients',
-        verbose_name='Рецепт')
+        db_index=False, verbose_name='Рецепт')
     ingredient = models.ForeignKey(
         Ingredient, on_delete=models.CASCADE, related_name='used_in_recipes',
-        verbose_name='Ингредиент')
+        db_index=False, verbose_name='Ингредиент')
     quantity = models.FloatField('количество', default=1.0)
     unit = models.CharField('единица', max_length=LENGTH_UNIT,
                             default='г')
 
     class Meta:
         unique_together = ('recipe', 'ingredient')
+        indexes = [
+            # Индекс «ингредиент -> рецепты» строится по порядку индекса.
+            models.Index(fields=['ingredient', 'recipe'],
+                         name='recipeingr_ingredient_idx'),
+            # Агрегаты списков покупок считаются без чтения таблицы.
+            models.Index(fields=['recipe', 'ingredient', 'quantity'],
+                         name='recipeingr_quantity_idx'),
+        ]
         verbose_name = 'Ингредиент в рецепте'
         verbose_name_plural = 'Ингредиенты в рецептах'
 
@@ -133,6 +190,7 @@ class Favorite(models.Model):
         User,
         on_delete=models.CASCADE,
         related_name='favorites',
+        db_index=False,
         verbose_name='Пользователь'
     )
     recipe = models.ForeignKey(
@@ -155,6 +213,7 @@ class ShoppingCart(models.Model):
         User,
         on_delete=models.CASCADE,
         related_name='shopping_cart',
+        db_index=False,
         verbose_name='Пользователь'
     )
     recipe = models.ForeignKey(
@@ -169,3 +228,85 @@ class ShoppingCart(models.Model):
         verbose_name_plural = 'Списки покупок'
         unique_together = ('user', 'recipe')
         ordering = ['-id']
+
+
+class ShoppingListItem(models.Model):
+    """
+    Суммарное количество ингредиента в списке покупок пользователя.
+    Поддерживается при изменении списка покупок и ингредиентов рецепта.
+    """
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='shopping_list_items',
+        db_index=False,
+        verbose_name='Пользователь'
+    )
+    ingredient = models.ForeignKey(
+        Ingredient,
+        on_delete=models.CASCADE,
+        related_name='shopping_list_items',
+        verbose_name='Ингредиент'
+    )
+    total_amount = models.FloatField('Общее количество', default=0)
+    recipe_count = models.PositiveIntegerField(
+        'Количество рецептов', default=0)
+
+    class Meta:
+        verbose_name = 'Позиция списка покупок'
+        verbose_name_plural = 'Позиции списков покупок'
+        unique_together = ('user', 'ingredient')
+
+    def __str__(self):
+        return f'{self.ingredient} — {self.total_amount}'
+
+
+class FeedItem(models.Model):
+    """
+    Рецепт в ленте подписок пользователя. Заполняется при публикации
+    рецепта для авторов, у которых меньше FEED_FANOUT_THRESHOLD
+    подписчиков; рецепты остальных добавляются при чтении ленты.
+    """
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='feed_items',
+        db_index=False,
+        verbose_name='Пользователь'
+    )
+    recipe = models.ForeignKey(
+        Recipe,
+        on_delete=models.CASCADE,
+        related_name='+',
+        verbose_name='Рецепт'
+    )
+    author = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='+',
+        verbose_name='Автор'
+    )
+
+    class Meta:
+        verbose_name = 'Рецепт в ленте'
+        verbose_name_plural = 'Ленты подписок'
+        # Индекс ограничения используется и для чтения ленты по -recipe.
+        unique_together = ('user', 'recipe')
+
+
+class ChangeSequence(models.Model):
+    """
+    Номер последнего изменения справочника в журнале food.catalog.
+    Номера выдаются атомарным UPDATE под блокировкой строки, поэтому
+    воркеры не получают одинаковых номеров.
+    """
+    model = models.CharField(
+        max_length=LENGTH_NAME, primary_key=True, verbose_name='Модель')
+    number = models.BigIntegerField(verbose_name='Номер изменения')
+
+    class Meta:
+        verbose_name = 'Счетчик журнала изменений'
+        verbose_name_plural = 'Счетчики журнала изменений'
+
+    def __str__(self):
+        return f'{self.model}: {self.number}'
@@ -0,0 +1,126 @@
+from django.db import transaction
+from django.db.models import F
+from django.db.models.signals import (m2m_changed, post_delete, post_save,
+                                      pre_delete)
+from django.dispatch import Signal, receiver
+
+from food.aggregates import (refresh_shopping_list, refresh_tags_mask,
+                             update_counters)
+from food.catalog import bump_catalog_version, record_changes
+from food.feed import backfill, fan_out, forget
+from food.images import schedule_variants
+from food.models import (Favorite, Follow, Ingredient, Recipe,
+                         RecipeIngredient, ShoppingCart, Tag, User)
+
+# Отправляется после изменения ингредиентов рецепта через bulk-операции,
+# которые не вызывают post_save/post_delete: аргумент recipe.
+recipe_ingredients_changed = Signal()
+
+
+def _recipe_ingredient_ids(recipe_id):
+    return list(RecipeIngredient.objects.filter(
+        recipe_id=recipe_id).values_list('ingredient_id', flat=True))
+
+
+@receiver(post_save, sender=ShoppingCart)
+def add_to_shopping_list(sender, instance, created, **kwargs):
+    if created:
+        refresh_shopping_list(
+            [instance.user_id], _recipe_ingredient_ids(instance.recipe_id))
+
+
+@receiver(pre_delete, sender=ShoppingCart)
+def remember_shopping_list_ingredients(sender, instance, **kwargs):
+    # При каскадном удалении рецепта его ингредиенты могут быть
+    # удалены раньше, чем придет post_delete.
+    instance._ingredient_ids = _recipe_ingredient_ids(instance.recipe_id)
+
+
+@receiver(post_delete, sender=ShoppingCart)
+def remove_from_shopping_list(sender, instance, **kwargs):
+    refresh_shopping_list(
+        [instance.user_id],
+        getattr(instance, '_ingredient_ids', None))
+
+
+@receiver([post_save, post_delete], sender=Tag)
+@receiver([post_save, post_delete], sender=Ingredient)
+def bump_catalog(sender, **kwargs):
+    bump_catalog_version(sender)
+
+
+@receiver(post_delete, sender=Recipe)
+def record_recipe_delete(sender, instance, **kwargs):
+    record_recipe_change(sender, instance)
+
+
+@receiver(recipe_ingredients_changed)
+def record_recipe_change(sender, recipe, **kwargs):
+    # Журнал читают кеши рецептов в памяти воркеров: id существующих
+    # рецептов (короткие ссылки) и индекс ингредиентов (api.cook_index).
+    pk = recipe.pk
+    transaction.on_commit(lambda: record_changes(Recipe, [pk]))
+
+
+@receiver(post_save, sender=Favorite)
+@receiver(post_save, sender=ShoppingCart)
+@receiver(post_save, sender=Follow)
+@receiver(post_save, sender=Recipe)
+def increment_counters(sender, instance, created, **kwargs):
+    if created:
+        update_counters(sender, instance, 1)
+
+
+@receiver(post_delete, sender=Favorite)
+@receiver(post_delete, sender=ShoppingCart)
+@receiver(post_delete, sender=Follow)
+@receiver(post_delete, sender=Recipe)
+def decrement_counters(sender, instance, **kwargs):
+    update_counters(sender, instance, -1)
+
+
+@receiver(post_save, sender=Recipe)
+def schedule_recipe_image_variants(sender, instance, update_fields,
+                                   **kwargs):
+    schedule_variants(instance, 'image', update_fields)
+
+
+@receiver(post_save, sender=User)
+def schedule_avatar_variants(sender, instance, update_fields, **kwargs):
+    schedule_variants(instance, 'avatar', update_fields)
+
+
+@receiver(m2m_changed, sender=Recipe.tags.through)
+def sync_tags_mask(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if not reverse:
+        instance.tags_mask = refresh_tags_mask([instance.pk])[instance.pk]
+    elif action == 'post_clear':
+        clear_tag_bit(Tag, instance)
+    else:
+        refresh_tags_mask(pk_set)
+
+
+@receiver(post_delete, sender=Tag)
+def clear_tag_bit(sender, instance, **kwargs):
+    if instance.bit:
+        Recipe.objects.filter(tags_mask__gt=0).update(
+            tags_mask=F('tags_mask').bitand(~instance.bit))
+
+
+@receiver(post_save, sender=Recipe)
+def fan_out_recipe(sender, instance, created, **kwargs):
+    if created:
+        fan_out([instance])
+
+
+@receiver(post_save, sender=Follow)
+def backfill_feed(sender, instance, created, **kwargs):
+    if created:
+        backfill(instance.follower_id, [instance.following_id])
+
+
+@receiver(post_delete, sender=Follow)
+def forget_feed(sender, instance, **kwargs):
+    forget(instance.follower_id, [instance.following_id])
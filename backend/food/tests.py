@@ -0,0 +1,343 @@
+import io
+import json
+import shutil
+import tempfile
+from pathlib import Path
+from unittest import mock, skipUnless
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.storage import default_storage
+from django.core.management import CommandError, call_command
+from django.db.models import Count, F
+from django.test import TestCase, override_settings
+
+from api.scenarios import get_cases, get_user
+from api.shopping_list import get_cache_key
+from food.aggregates import recount_counters, tags_mask
+from food.management.commands.load_ingredients import (CHUNK_SIZE,
+                                                       iter_json_array)
+from food.management.commands.seed_scale import IMAGE_NAME
+from food.models import (Favorite, Follow, Ingredient, Recipe,
+                         RecipeIngredient, ShoppingCart, ShoppingListItem, Tag,
+                         User)
+
+TEST_CACHES = {
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}
+}
+MEDIA_ROOT = tempfile.mkdtemp()
+
+
+@override_settings(CACHES=TEST_CACHES)
+class LoadIngredientsTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            username='user', email='user@ya.ru', password='password')
+        Ingredient.objects.create(name='соль', measurement_unit='г')
+
+    def setUp(self):
+        cache.clear()
+
+    def load(self, items, *args):
+        return self.load_text(json.dumps(items, ensure_ascii=False),
+                              '.json', *args)
+
+    def load_text(self, text, suffix, *args):
+        with tempfile.NamedTemporaryFile(
+                'w', suffix=suffix, encoding='utf-8') as file:
+            file.write(text)
+            file.flush()
+            return self.load_path(file.name, *args)
+
+    def load_path(self, path, *args):
+        output = io.StringIO()
+        call_command('load_ingredients', '--path', str(path), *args,
+                     stdout=output)
+        return output.getvalue()
+
+    def units(self):
+        return dict(Ingredient.objects.values_list(
+            'name', 'measurement_unit'))
+
+    def cache_key(self):
+        return get_cache_key(self.user, 'txt', '01-01-2025')
+
+    def test_created_rows_keep_shopping_lists(self):
+        key = self.cache_key()
+        output = self.load([{'name': 'соль', 'measurement_unit': 'г'},
+                            {'name': 'сахар', 'measurement_unit': 'г'}])
+        self.assertIn('Создано: 1, обновлено: 0, без изменений: 1', output)
+        self.assertEqual(self.cache_key(), key)
+
+    def test_updated_rows_invalidate_shopping_lists(self):
+        key = self.cache_key()
+        self.load([{'name': 'соль', 'measurement_unit': 'кг'}], '--dry-run')
+        self.assertEqual(self.cache_key(), key)
+        self.assertEqual(
+            Ingredient.objects.get(name='соль').measurement_unit, 'г')
+        output = self.load([{'name': 'соль', 'measurement_unit': 'кг'}])
+        self.assertIn('обновлено: 1', output)
+        self.assertEqual(
+            Ingredient.objects.get(name='соль').measurement_unit, 'кг')
+        self.assertNotEqual(self.cache_key(), key)
+
+    def test_fixture_format(self):
+        output = self.load([
+            {'model': 'recipes.Ingredient', 'pk': 1,
+             'fields': {'name': 'абрикосовое варенье',
+                        'unit_of_measurement': 'г'}},
+            {'model': 'recipes.Ingredient', 'pk': 2,
+             'fields': {'name': 'соль', 'unit_of_measurement': 'г'}},
+        ])
+        self.assertIn('Создано: 1, обновлено: 0, без изменений: 1', output)
+        self.assertEqual(self.units()['абрикосовое варенье'], 'г')
+
+    @skipUnless((Path(settings.BASE_DIR).parent / 'ingredient.json').exists(),
+                'нет ingredient.json')
+    def test_repository_fixture(self):
+        path = Path(settings.BASE_DIR).parent / 'ingredient.json'
+        with path.open(encoding='utf-8') as file:
+            expected = {item['fields']['name']:
+                        item['fields']['unit_of_measurement']
+                        for item in json.load(file)}
+        output = self.load_path(path, '--batch-size', '500')
+        self.assertIn('пропущено: 0', output)
+        self.assertEqual(self.units(), expected)
+
+    def test_csv_with_and_without_header(self):
+        self.load_text('name,measurement_unit\nсахар,г\nмолоко,мл\n', '.csv')
+        output = self.load_text('мука,кг\nсоль,г\n"перец, черный",г\n',
+                                '.csv')
+        self.assertIn('Создано: 2, обновлено: 0, без изменений: 1', output)
+        self.assertEqual(self.units(), {
+            'соль': 'г', 'сахар': 'г', 'молоко': 'мл', 'мука': 'кг',
+            'перец, черный': 'г'})
+
+    def test_json_items_across_chunk_boundary(self):
+        # Второй элемент начинается перед границей первого фрагмента
+        # и заканчивается после нее, третий длиннее двух фрагментов.
+        items = [
+            {'name': 'а' * (CHUNK_SIZE - 50), 'measurement_unit': 'г'},
+            {'name': 'граница', 'measurement_unit': 'шт'},
+            {'name': 'б' * (CHUNK_SIZE * 2), 'measurement_unit': 'кг'},
+            {'name': 'последний', 'measurement_unit': 'мл'},
+        ]
+        text = json.dumps(items, ensure_ascii=False)
+        boundary = text.index('граница')
+        self.assertLess(text.rindex('{', 0, boundary), CHUNK_SIZE)
+        self.assertGreater(text.index('}', boundary), CHUNK_SIZE)
+        self.assertEqual(list(iter_json_array(io.StringIO(text))), items)
+        with self.assertRaises(CommandError):
+            list(iter_json_array(io.StringIO(text[:CHUNK_SIZE + 10])))
+
+
+@override_settings(CACHES=TEST_CACHES, MEDIA_ROOT=MEDIA_ROOT, IMAGE_WORKERS=0)
+class SeedScaleTests(TestCase):
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(MEDIA_ROOT, ignore_errors=True)
+
+    def seed(self, **options):
+        output = io.StringIO()
+        call_command('seed_scale', users=40, recipes=120, batch_size=7,
+                     stdout=output, **options)
+        return output.getvalue()
+
+    def test_rows_and_derived_data(self):
+        self.assertIn('Готово', self.seed())
+        self.assertEqual(User.objects.count(), 40)
+        self.assertEqual(Recipe.objects.count(), 120)
+        self.assertEqual(Tag.objects.count(), 8)
+        self.assertEqual(Ingredient.objects.count(), 2000)
+        self.assertTrue(Follow.objects.exists())
+        self.assertFalse(Follow.objects.filter(
+            follower=F('following')).exists())
+        self.assertTrue(Favorite.objects.exists())
+        self.assertFalse(RecipeIngredient.objects.values('recipe').annotate(
+            total=Count('id')).filter(total=0).exists())
+        # Счетчики и списки покупок уже пересчитаны.
+        self.assertFalse(any(recount_counters().values()))
+        self.assertEqual(
+            ShoppingListItem.objects.count(),
+            RecipeIngredient.objects.filter(
+                recipe__in_shopping_cart__isnull=False).values(
+                    'recipe__in_shopping_cart__user', 'ingredient'
+            ).distinct().count())
+        for recipe in Recipe.objects.prefetch_related('tags'):
+            self.assertEqual(
+                recipe.tags_mask,
+                tags_mask(tag.id for tag in recipe.tags.all()))
+        self.assertTrue(default_storage.exists(IMAGE_NAME))
+
+    def test_same_seed_same_data(self):
+        self.seed(seed=7)
+        first = list(Recipe.objects.order_by('id').values_list(
+            'name', 'author__username', 'cooking_time'))
+        Recipe.objects.all().delete()
+        User.objects.all().delete()
+        self.seed(seed=7)
+        second = list(Recipe.objects.order_by('id').values_list(
+            'name', 'author__username', 'cooking_time'))
+        # Id продолжаются, поэтому сравниваются имена без номера.
+        self.assertEqual(
+            [(name.rsplit(' №', 1)[0], cooking_time)
+             for name, _, cooking_time in first],
+            [(name.rsplit(' №', 1)[0], cooking_time)
+             for name, _, cooking_time in second])
+
+    def test_second_run_appends(self):
+        self.seed()
+        self.seed(seed=1)
+        self.assertEqual(User.objects.count(), 80)
+        self.assertEqual(Recipe.objects.count(), 240)
+        # Последовательности сброшены: обычное создание не конфликтует.
+        user = User.objects.create_user(username='new', email='new@ya.ru')
+        self.assertGreater(user.id, 80)
+        self.assertFalse(any(recount_counters().values()))
+
+
+@override_settings(CACHES=TEST_CACHES, MEDIA_ROOT=MEDIA_ROOT, IMAGE_WORKERS=0,
+                   DATABASE_REPLICAS=[])
+class SeededTestCase(TestCase):
+    """Небольшая база из seed_scale."""
+
+    @classmethod
+    def setUpTestData(cls):
+        call_command('seed_scale', users=30, recipes=60,
+                     stdout=io.StringIO())
+        cls.user = get_user()
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(MEDIA_ROOT, ignore_errors=True)
+
+    def setUp(self):
+        cache.clear()
+
+
+class BenchmarkApiTests(SeededTestCase):
+
+    def benchmark(self, *args):
+        output = io.StringIO()
+        # Окружение тестов уже настроено раннером.
+        with mock.patch.multiple(
+                'food.management.commands.benchmark_api',
+                setup_test_environment=mock.DEFAULT,
+                teardown_test_environment=mock.DEFAULT):
+            call_command('benchmark_api', '--iterations', '2',
+                         '--warmup', '0', *args, stdout=output)
+        return output.getvalue()
+
+    def names(self, **kwargs):
+        return [case.name for case in get_cases(self.user, **kwargs)]
+
+    def test_write_cases_need_permission(self):
+        writes = {'favorite_add', 'favorite_remove', 'cart_add',
+                  'cart_remove'}
+        self.assertFalse(writes & set(self.names()))
+        self.assertLessEqual(writes, set(self.names(allow_writes=True)))
+        with self.assertRaisesMessage(ValueError, '--allow-writes'):
+            get_cases(self.user, ['recipes', 'cart_add'])
+        with self.assertRaisesMessage(CommandError, '--allow-writes'):
+            self.benchmark('--only', 'favorite_add')
+
+    def test_few_tags(self):
+        self.assertIn('recipes_tags_all', self.names())
+        Tag.objects.exclude(pk=Tag.objects.order_by('id')[0].pk).delete()
+        names = self.names()
+        self.assertIn('recipes_tags', names)
+        self.assertNotIn('recipes_tags_all', names)
+        Tag.objects.all().delete()
+        self.assertNotIn('recipes_tags', self.names())
+
+    def test_report_and_compare(self):
+        path = f'{MEDIA_ROOT}/benchmark.json'
+        output = self.benchmark('--only', 'recipes', 'feed',
+                                '--output', path)
+        self.assertIn('recipes', output)
+        with open(path, encoding='utf-8') as file:
+            report = json.load(file)
+        self.assertEqual(set(report['endpoints']), {'recipes', 'feed'})
+        self.assertEqual(report['dataset'], {'users': 30, 'recipes': 60})
+        self.assertGreater(report['endpoints']['recipes']['queries'], 0)
+        self.assertIn('Регрессий нет', self.benchmark(
+            '--only', 'recipes', '--compare', path, '--tolerance', '100',
+            '--min-delta-ms', '1000'))
+        report['endpoints']['recipes']['queries'] = 0
+        with open(path, 'w', encoding='utf-8') as file:
+            json.dump(report, file)
+        with self.assertRaisesMessage(CommandError, 'recipes: queries 0'):
+            self.benchmark('--only', 'recipes', '--compare', path,
+                           '--tolerance', '100', '--min-delta-ms', '1000')
+
+    def test_write_cases_restore_data(self):
+        before = (Favorite.objects.count(), ShoppingCart.objects.count())
+        self.benchmark('--allow-writes', '--only', 'favorite_add',
+                       'favorite_remove', 'cart_add', 'cart_remove')
+        self.assertEqual(
+            (Favorite.objects.count(), ShoppingCart.objects.count()),
+            before)
+
+
+class ExplainApiTests(SeededTestCase):
+
+    def explain(self, *args):
+        output = io.StringIO()
+        with mock.patch.multiple(
+                'food.management.commands.explain_api',
+                setup_test_environment=mock.DEFAULT,
+                teardown_test_environment=mock.DEFAULT):
+            call_command('explain_api', *args, stdout=output)
+        sections = {}
+        for line in output.getvalue().splitlines():
+            if not line.startswith(' '):
+                name = line
+                sections[name] = []
+            elif line.startswith('  ['):
+                sections[name].append(line.strip())
+        return sections
+
+    def flags(self, lines, table_or_flag):
+        return [line for line in lines
+                if line.startswith('[') and table_or_flag
+                in line[:line.index(']')]]
+
+    def test_cases_and_jobs(self):
+        sections = self.explain('--only', 'recipe_detail', 'feed_fan_out',
+                                'cook_index_build', 'shopping_list_refresh')
+        self.assertLessEqual(
+            {'recipe_detail', 'feed_fan_out', 'cook_index_build',
+             'shopping_list_refresh'}, set(sections))
+        self.assertIn('[ok] SELECT', ' '.join(sections['recipe_detail']))
+        # Индексы (following, follower) и (ingredient, recipe).
+        self.assertEqual(
+            self.flags(sections['feed_fan_out'], 'food_follow'), [])
+        self.assertEqual(self.flags(sections['cook_index_build'], 'sort'),
+                         [])
+        self.assertEqual(
+            self.flags(sections['shopping_list_refresh'],
+                       'food_recipeingredient'), [])
+
+    def test_strict_fails_on_flags(self):
+        # Побитовое И по tags_mask в SQLite - полный просмотр.
+        sections = self.explain('--only', 'recipes_tags_all')
+        self.assertTrue(self.flags(sections['recipes_tags_all'],
+                                   'scan food_recipe'))
+        with self.assertRaisesMessage(CommandError, 'полные просмотры'):
+            self.explain('--only', 'recipes_tags_all', '--strict')
+        with self.assertRaisesMessage(CommandError, 'Неизвестные имена'):
+            self.explain('--only', 'nothing')
+
+    def test_write_cases_rolled_back(self):
+        before = (Favorite.objects.count(), ShoppingCart.objects.count())
+        sections = self.explain('--only', 'favorite_add', 'cart_remove')
+        self.assertIn('INSERT', ' '.join(sections['favorite_add']))
+        self.assertIn('DELETE', ' '.join(sections['cart_remove']))
+        self.assertEqual(
+            (Favorite.objects.count(), ShoppingCart.objects.count()),
+            before)
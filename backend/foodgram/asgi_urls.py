@@ -0,0 +1,11 @@
+from django.urls import include, path
+
+from .urls import urlpatterns as sync_urlpatterns
+
+# URLconf ASGI-приложения: частые запросы на чтение (рецепты, теги,
+# ингредиенты, список покупок) обрабатываются асинхронными
+# представлениями api.async_views, остальное - как в foodgram.urls.
+urlpatterns = [
+    path('api/', include('api.async_urls')),
+    *sync_urlpatterns,
+]
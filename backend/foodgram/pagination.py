@@ -1,7 +1,146 @@
+import json
+
+from django.core.paginator import Paginator
+from django.db import connections
+from django.utils.functional import cached_property
 from rest_framework import pagination
+from rest_framework.exceptions import ValidationError
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+
+def estimate_count(queryset):
+    """Оценка количества строк по плану запроса PostgreSQL."""
+    sql, params = queryset.query.sql_with_params()
+    with connections[queryset.db].cursor() as cursor:
+        cursor.execute(f'EXPLAIN (FORMAT JSON) {sql}', params)
+        plan = cursor.fetchone()[0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return int(plan[0]['Plan']['Plan Rows'])
+
+
+class ApproximateCountPaginator(Paginator):
+    """
+    Вместо COUNT(*) использует оценку планировщика PostgreSQL.
+    Небольшие выборки и другие СУБД считаются точно.
+    """
+    exact_count_threshold = 1000
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        if (hasattr(queryset, 'query')
+                and connections[queryset.db].vendor == 'postgresql'):
+            estimate = estimate_count(queryset)
+            if estimate >= self.exact_count_threshold:
+                return estimate
+        return super().count
 
 
 class StandartPagination(pagination.PageNumberPagination):
     page_size = 6
     page_size_query_param = 'limit'
     max_page_size = 1000
+    count_query_param = 'count'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if request.query_params.get(self.count_query_param) == 'approximate':
+            self.django_paginator_class = ApproximateCountPaginator
+        return super().paginate_queryset(queryset, request, view)
+
+
+class RecipeCursorPagination(pagination.CursorPagination):
+    """
+    Курсор по id. Сортировка по неуникальному полю
+    (?ordering=-favorites_count) отклоняется: внутри групп равных
+    значений курсор DRF переходит к OFFSET, и дальние страницы
+    становятся дорогими.
+    """
+    page_size = 6
+    page_size_query_param = 'limit'
+    max_page_size = 1000
+    ordering = '-id'
+
+    def get_ordering(self, request, queryset, view):
+        ordering = super().get_ordering(request, queryset, view)
+        if ordering[0].lstrip('-') != 'id':
+            raise ValidationError({'ordering': [
+                'Пагинация по курсору поддерживает только сортировку '
+                'по id.']})
+        return ordering
+
+
+class RecipePagination(StandartPagination):
+    """
+    Постраничная пагинация, по запросу ?pagination=cursor (или при
+    наличии ?cursor=) - пагинация по ключу без COUNT(*) и OFFSET.
+    Результаты поиска (?search=) всегда постраничные: они упорядочены
+    по релевантности, а курсор по неуникальному рангу дает повторы.
+    """
+    mode_query_param = 'pagination'
+    search_query_param = 'search'
+    cursor_class = RecipeCursorPagination
+
+    def use_cursor(self, request):
+        params = request.query_params
+        return ((params.get(self.mode_query_param) == 'cursor'
+                 or self.cursor_class.cursor_query_param in params)
+                and not params.get(self.search_query_param, '').strip())
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.cursor_paginator = None
+        if self.use_cursor(request):
+            self.cursor_paginator = self.cursor_class()
+            return self.cursor_paginator.paginate_queryset(
+                queryset, request, view)
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        if self.cursor_paginator is not None:
+            return self.cursor_paginator.get_paginated_response(data)
+        return super().get_paginated_response(data)
+
+
+class KeysetPagination(pagination.BasePagination):
+    """
+    Пагинация по ключу для списков id, которые собираются не одним
+    queryset: следующая страница - id меньше ?before=. Ответ того же
+    вида, что у RecipeCursorPagination.
+    """
+    page_size = 6
+    page_size_query_param = 'limit'
+    max_page_size = 1000
+    before_query_param = 'before'
+
+    def paginate_ids(self, fetch, request):
+        """fetch(before, limit) возвращает id по убыванию."""
+        self.request = request
+        try:
+            limit = min(int(request.query_params[self.page_size_query_param]),
+                        self.max_page_size)
+        except (KeyError, ValueError):
+            limit = self.page_size
+        limit = limit if limit > 0 else self.page_size
+        try:
+            before = int(request.query_params[self.before_query_param])
+        except (KeyError, ValueError):
+            before = None
+        ids = fetch(before, limit + 1)
+        self.has_next = len(ids) > limit
+        self.page = ids[:limit]
+        return self.page
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        return replace_query_param(
+            self.request.build_absolute_uri(),
+            self.before_query_param, self.page[-1])
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_next_link(),
+            'previous': None,
+            'results': data,
+        })
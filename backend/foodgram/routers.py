@@ -0,0 +1,127 @@
+import hashlib
+import random
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import MiddlewareNotUsed
+from rest_framework.permissions import SAFE_METHODS
+
+API_PREFIX = '/api/'
+STICKY_KEY = 'db_primary:{}'
+# Токены читаются только с основной базы: иначе сразу после входа
+# реплика может не знать новый токен, а после выхода - принять старый.
+PRIMARY_MODELS = {'authtoken.Token'}
+
+_replica = ContextVar('replica', default=None)
+
+
+@contextmanager
+def read_from_primary():
+    """
+    Чтение с основной базы внутри блока, в том числе в безопасных
+    запросах. Нужно кешам в памяти, которые перестраиваются при смене
+    версии или по журналу изменений: данные с отстающей реплики
+    сохранились бы под новой версией и больше не перечитывались.
+    """
+    token = _replica.set(None)
+    try:
+        yield
+    finally:
+        _replica.reset(token)
+
+
+class ReplicaRouter:
+    """
+    Чтение - с реплики, выбранной для текущего запроса
+    ReplicaRoutingMiddleware. Запись, миграции, команды и фоновые
+    задачи работают с основной базой.
+    """
+
+    def db_for_read(self, model, **hints):
+        replica = _replica.get()
+        if replica and model._meta.label not in PRIMARY_MODELS:
+            return replica
+        return 'default'
+
+    def db_for_write(self, model, **hints):
+        # Объект, прочитанный с реплики, сохраняется в основную базу.
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        databases = {'default', *settings.DATABASE_REPLICAS}
+        if {obj1._state.db, obj2._state.db} <= databases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if db in settings.DATABASE_REPLICAS:
+            return False
+        return None
+
+
+def get_sticky_key(request):
+    """Ключ кеша клиента, по которому помнится его последняя запись."""
+    authorization = request.META.get('HTTP_AUTHORIZATION')
+    if not authorization:
+        return None
+    return STICKY_KEY.format(
+        hashlib.sha256(authorization.encode()).hexdigest())
+
+
+class ReplicaRoutingMiddleware:
+    """
+    Направляет на реплики чтение в безопасных (GET, HEAD, OPTIONS)
+    запросах к API. Клиент, который только что что-то изменил,
+    REPLICA_STICKY_SECONDS читает с основной базы и видит свои
+    изменения, даже если реплика отстает. Без реплик отключается.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not settings.DATABASE_REPLICAS:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        key = get_sticky_key(request)
+        token = _replica.set(
+            self.choose_replica(request, key and cache.get(key)))
+        try:
+            response = self.get_response(request)
+        finally:
+            _replica.reset(token)
+        if self.is_write(request, key, response):
+            cache.set(key, True, settings.REPLICA_STICKY_SECONDS)
+        return response
+
+    async def __acall__(self, request):
+        key = get_sticky_key(request)
+        # Переменная контекста копируется в потоки sync_to_async.
+        token = _replica.set(
+            self.choose_replica(request, key and await cache.aget(key)))
+        try:
+            response = await self.get_response(request)
+        finally:
+            _replica.reset(token)
+        if self.is_write(request, key, response):
+            await cache.aset(key, True, settings.REPLICA_STICKY_SECONDS)
+        return response
+
+    def choose_replica(self, request, sticky):
+        if (request.method in SAFE_METHODS
+                and request.path.startswith(API_PREFIX) and not sticky):
+            # Одна реплика на запрос: все чтения видят один снимок.
+            return random.choice(settings.DATABASE_REPLICAS)
+        return None
+
+    def is_write(self, request, key, response):
+        return (request.method not in SAFE_METHODS and key
+                and response.status_code < 400)
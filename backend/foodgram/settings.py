@@ -25,6 +25,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'foodgram.timing.RequestTimingMiddleware',
+    'foodgram.routers.ReplicaRoutingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -34,7 +36,8 @@ MIDDLEWARE = [
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
-ROOT_URLCONF = 'foodgram.urls'
+# В ASGI-приложении - foodgram.asgi_urls (см. foodgram/asgi.py).
+ROOT_URLCONF = os.getenv('ROOT_URLCONF', 'foodgram.urls')
 
 TEMPLATES = [
     {
@@ -64,6 +67,26 @@ DATABASES = {
     }
 }
 
+# Реплики только для чтения: DB_REPLICAS=host[:port],... получают алиасы
+# replica, replica_2 и т.д. с настройками основной базы. Для SQLite
+# реплика - второе подключение к тому же файлу (локальная проверка).
+DATABASE_REPLICAS = []
+for number, address in enumerate(
+        filter(None, os.getenv('DB_REPLICAS', '').split(',')), start=1):
+    host, _, port = address.strip().partition(':')
+    alias = 'replica' if number == 1 else f'replica_{number}'
+    DATABASES[alias] = {
+        **DATABASES['default'],
+        'HOST': host,
+        'PORT': port or DATABASES['default']['PORT'],
+        'TEST': {'MIRROR': 'default'},
+    }
+    DATABASE_REPLICAS.append(alias)
+
+DATABASE_ROUTERS = ['foodgram.routers.ReplicaRouter']
+# Сколько секунд после записи клиент читает с основной базы.
+REPLICA_STICKY_SECONDS = int(os.getenv('REPLICA_STICKY_SECONDS', 10))
+
 
 AUTH_PASSWORD_VALIDATORS = [
     {
@@ -121,3 +144,88 @@ DJOSER = {
 
 MEDIA_URL = '/media/'
 MEDIA_ROOT = '/app/media/'
+
+# Время жизни индекса ингредиентов в памяти процесса (секунды).
+INGREDIENT_INDEX_TTL = int(os.getenv('INGREDIENT_INDEX_TTL', 300))
+
+# Общий для всех воркеров и контейнеров кеш: списки покупок, версии
+# каталога, журнал изменений рецептов, привязка клиентов к основной базе.
+# В продакшене - Redis (CACHE_BACKEND=django.core.cache.backends.redis.
+# RedisCache, CACHE_LOCATION=redis://redis:6379/1); файловый кеш подходит
+# только для разработки на одной машине.
+CACHES = {
+    'default': {
+        'BACKEND': os.getenv(
+            'CACHE_BACKEND',
+            'django.core.cache.backends.filebased.FileBasedCache'),
+        'LOCATION': os.getenv('CACHE_LOCATION', '/tmp/foodgram_cache'),
+    }
+}
+# Файловый и локальный кеши по умолчанию хранят лишь 300 записей и
+# выбрасывают треть при переполнении; Redis ограничивается своим maxmemory.
+if CACHES['default']['BACKEND'].endswith(('FileBasedCache', 'LocMemCache')):
+    CACHES['default']['OPTIONS'] = {
+        'MAX_ENTRIES': int(os.getenv('CACHE_MAX_ENTRIES', 100_000)),
+    }
+
+SHOPPING_LIST_CACHE_TIMEOUT = 60 * 60 * 24
+# Списки покупок больше этого размера (байт) не кешируются.
+SHOPPING_LIST_CACHE_MAX_SIZE = 1024 * 1024
+SHOPPING_LIST_PDF_FONT = os.getenv(
+    'SHOPPING_LIST_PDF_FONT',
+    '/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf')
+
+# Уменьшенные копии изображений рецептов и аватаров:
+# {вариант: максимальная сторона в пикселях}.
+IMAGE_VARIANTS = {
+    'thumb': 240,
+    'card': 640,
+    'full': 1600,
+}
+IMAGE_QUALITY = 80
+# Потоки для фоновой обработки изображений; 0 - обработка сразу
+# после коммита в текущем потоке.
+IMAGE_WORKERS = int(os.getenv('IMAGE_WORKERS', 2))
+
+# Максимальный размер загружаемого изображения (байт, после декодирования).
+IMAGE_UPLOAD_MAX_SIZE = int(
+    os.getenv('IMAGE_UPLOAD_MAX_SIZE', 10 * 1024 * 1024))
+
+# Короткие ссылки на рецепты. Константы перестановки id менять нельзя:
+# уже выданные ссылки перестанут открываться.
+SHORT_LINK_MULTIPLIER = int(os.getenv('SHORT_LINK_MULTIPLIER', 0x5DEECE66D))
+SHORT_LINK_KEY = int(os.getenv('SHORT_LINK_KEY', 0x9E3779B97F))
+SHORT_LINK_CACHE_SIZE = 100_000
+SHORT_LINK_FLUSH_SIZE = 500
+SHORT_LINK_FLUSH_INTERVAL = 10
+
+# Рецептов в одной транзакции при импорте NDJSON.
+RECIPE_IMPORT_BATCH_SIZE = int(os.getenv('RECIPE_IMPORT_BATCH_SIZE', 100))
+
+# Лента подписок: рецепты авторов, у которых меньше FEED_FANOUT_THRESHOLD
+# подписчиков, раскладываются по лентам при публикации, остальные
+# добавляются при чтении. Лента обрезается командой refresh_feeds.
+FEED_FANOUT_THRESHOLD = int(os.getenv('FEED_FANOUT_THRESHOLD', 1000))
+FEED_BACKFILL_SIZE = 50
+FEED_MAX_LENGTH = int(os.getenv('FEED_MAX_LENGTH', 1000))
+
+# Server-Timing и лог запросов к базе (foodgram.timing.RequestTimingMiddleware).
+REQUEST_TIMING_ENABLED = os.getenv('REQUEST_TIMING_ENABLED', 'False') == 'True'
+REQUEST_TIMING_SAMPLE_RATE = float(os.getenv('REQUEST_TIMING_SAMPLE_RATE', 1))
+REQUEST_TIMING_SLOW_MS = int(os.getenv('REQUEST_TIMING_SLOW_MS', 500))
+REQUEST_TIMING_TOP_QUERIES = 3
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        'foodgram.timing': {
+            'handlers': ['console'],
+            'level': 'INFO',
+            'propagate': False,
+        },
+    },
+}
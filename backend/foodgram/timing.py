@@ -0,0 +1,272 @@
+import json
+import logging
+import random
+import re
+import time
+from collections import defaultdict
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.core.signals import request_started
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.utils.functional import cached_property
+
+logger = logging.getLogger('foodgram.timing')
+
+_current = ContextVar('request_timing', default=None)
+
+_LITERALS = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+_LISTS = re.compile(r'\((?:\s*(?:%s|\?)\s*,)+\s*(?:%s|\?)\s*\)')
+
+
+def normalize_sql(sql):
+    """SQL без значений: запросы, отличающиеся только ими, совпадают."""
+    sql = _LITERALS.sub('?', sql).replace('%s', '?')
+    return ' '.join(_LISTS.sub('(...)', sql).split())
+
+
+class RequestTiming:
+    """Запросы к базе и время обработчиков одного HTTP-запроса."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.db_time = 0.0
+        self.app_time = 0.0
+        self.raw_statements = []
+
+    def mark(self):
+        return time.perf_counter(), self.db_time
+
+    def add_app_time(self, mark):
+        """Добавляет время после mark за вычетом запросов к базе."""
+        started, db_time = mark
+        self.app_time += max(
+            time.perf_counter() - started - (self.db_time - db_time), 0)
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            elapsed = time.perf_counter() - started
+            self.queries += 1
+            self.db_time += elapsed
+            # Нормализация откладывается до конца запроса.
+            self.raw_statements.append((sql, elapsed))
+
+    @cached_property
+    def statements(self):
+        """{нормализованный SQL: [количество, время]}."""
+        by_sql = defaultdict(lambda: [0, 0.0])
+        for sql, elapsed in self.raw_statements:
+            by_sql[sql][0] += 1
+            by_sql[sql][1] += elapsed
+        result = defaultdict(lambda: [0, 0.0])
+        for sql, (count, elapsed) in by_sql.items():
+            totals = result[normalize_sql(sql)]
+            totals[0] += count
+            totals[1] += elapsed
+        return result
+
+    def duplicates(self):
+        """Повторяющиеся запросы (признак N+1), частые первыми."""
+        return sorted(
+            ((sql, count) for sql, (count, _) in self.statements.items()
+             if count > 1),
+            key=lambda item: item[1], reverse=True)
+
+    def slowest(self, limit):
+        return sorted(
+            ((sql, elapsed) for sql, (_, elapsed) in self.statements.items()),
+            key=lambda item: item[1], reverse=True)[:limit]
+
+    def server_timing(self, total):
+        duplicates = self.duplicates()
+        db_desc = f'{self.queries} queries'
+        if duplicates:
+            db_desc += f', {duplicates[0][1]}x duplicate'
+        return ', '.join((
+            f'db;dur={self.db_time * 1000:.1f};desc="{db_desc}"',
+            f'app;dur={self.app_time * 1000:.1f}',
+            f'total;dur={total * 1000:.1f}',
+        ))
+
+
+def get_current_timing():
+    """Замер текущего запроса или None, если запрос не замеряется."""
+    return _current.get()
+
+
+def _execute(execute, sql, params, many, context):
+    timing = _current.get()
+    if timing is None:
+        return execute(sql, params, many, context)
+    return timing(execute, sql, params, many, context)
+
+
+def instrument_connection(sender=None, connection=None, **kwargs):
+    """
+    Добавляет соединению обертку, которая учитывает запросы в замере
+    текущего запроса. Замер берется из контекста, поэтому запросы
+    из sync_to_async и из потокового ответа тоже учитываются.
+    """
+    if _execute not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_execute)
+
+
+def instrument_connections(sender=None, **kwargs):
+    """
+    Обертка для уже открытых соединений потока. request_started
+    отправляется в потоке, где выполняется синхронный код запроса,
+    а новые соединения получают обертку по connection_created.
+    """
+    for connection in connections.all(initialized_only=True):
+        instrument_connection(connection=connection)
+
+
+class ServerTimingMixin:
+    """
+    Для представлений DRF: время обработчика без запросов к базе
+    (в основном сериализация) - метрика app в Server-Timing.
+    """
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        timing = get_current_timing()
+        if timing is not None:
+            self._timing_mark = timing.mark()
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        timing = get_current_timing()
+        mark = getattr(self, '_timing_mark', None)
+        if timing is not None and mark is not None:
+            timing.add_app_time(mark)
+        return super().finalize_response(request, response, *args, **kwargs)
+
+
+class RequestTimingMiddleware:
+    """
+    Для доли REQUEST_TIMING_SAMPLE_RATE запросов считает запросы
+    к базе, их время, повторы и время обработчиков (ServerTimingMixin).
+    Итог - заголовок Server-Timing и строка JSON в логе foodgram.timing;
+    запросы дольше REQUEST_TIMING_SLOW_MS логируются вместе с их SQL.
+    У потоковых ответов заголовок описывает время до начала ответа,
+    а в лог попадает итог после отдачи последнего фрагмента.
+    Работает в WSGI и ASGI. Включается REQUEST_TIMING_ENABLED.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not settings.REQUEST_TIMING_ENABLED:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+        connection_created.connect(instrument_connection)
+        request_started.connect(instrument_connections)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        if random.random() >= settings.REQUEST_TIMING_SAMPLE_RATE:
+            return self.get_response(request)
+        timing = RequestTiming()
+        token = _current.set(timing)
+        try:
+            response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self.finish(request, response, timing)
+
+    async def __acall__(self, request):
+        if random.random() >= settings.REQUEST_TIMING_SAMPLE_RATE:
+            return await self.get_response(request)
+        timing = RequestTiming()
+        token = _current.set(timing)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self.finish(request, response, timing)
+
+    def finish(self, request, response, timing):
+        total = time.perf_counter() - timing.started
+        response['Server-Timing'] = timing.server_timing(total)
+        if not response.streaming:
+            self.log(request, response, timing, total)
+        elif response.is_async:
+            response.streaming_content = self.astream(
+                request, response, timing, response.streaming_content)
+        else:
+            response.streaming_content = self.stream(
+                request, response, timing, response.streaming_content)
+        return response
+
+    def stream(self, request, response, timing, content):
+        """Фрагменты content; запросы при их чтении тоже замеряются."""
+        content = iter(content)
+        try:
+            while True:
+                token = _current.set(timing)
+                try:
+                    chunk = next(content)
+                except StopIteration:
+                    break
+                finally:
+                    _current.reset(token)
+                yield chunk
+        finally:
+            self.log(request, response, timing,
+                     time.perf_counter() - timing.started)
+
+    async def astream(self, request, response, timing, content):
+        """stream для асинхронного content."""
+        content = aiter(content)
+        try:
+            while True:
+                token = _current.set(timing)
+                try:
+                    chunk = await anext(content)
+                except StopAsyncIteration:
+                    break
+                finally:
+                    _current.reset(token)
+                yield chunk
+        finally:
+            self.log(request, response, timing,
+                     time.perf_counter() - timing.started)
+
+    def log(self, request, response, timing, total):
+        duplicates = timing.duplicates()
+        record = {
+            'method': request.method,
+            'path': request.path,
+            'status': response.status_code,
+            'total_ms': round(total * 1000, 1),
+            'db_ms': round(timing.db_time * 1000, 1),
+            'queries': timing.queries,
+            'duplicate_queries': sum(count - 1 for _, count in duplicates),
+            'app_ms': round(timing.app_time * 1000, 1),
+            'slowest': [
+                {'sql': sql[:200], 'ms': round(elapsed * 1000, 1)}
+                for sql, elapsed in timing.slowest(
+                    settings.REQUEST_TIMING_TOP_QUERIES)
+            ],
+        }
+        if duplicates:
+            record['n_plus_one'] = {'sql': duplicates[0][0][:200],
+                                    'count': duplicates[0][1]}
+        if total * 1000 < settings.REQUEST_TIMING_SLOW_MS:
+            logger.info(json.dumps(record, ensure_ascii=False))
+            return
+        record['statements'] = [
+            {'sql': sql, 'count': count, 'ms': round(elapsed * 1000, 1)}
+            for sql, (count, elapsed) in timing.statements.items()
+        ]
+        logger.warning(json.dumps(record, ensure_ascii=False))